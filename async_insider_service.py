@@ -0,0 +1,399 @@
+# -асинхронный клиент API ИНСАЙДЕР и асинхронный обход сотрудников
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+import aiohttp
+from loguru import logger
+from config import (
+    INSIDER_API_URL,
+    INSIDER_API_KEY,
+    HTTP_POOL_SIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_FACTOR,
+    BATCH_SIZE,
+    ASYNC_CONCURRENCY,
+    ASYNC_RATE_LIMIT,
+    ASYNC_OCR_WORKERS,
+    ASYNC_MAX_IN_FLIGHT,
+    require_insider_credentials
+)
+from insider_service import InsiderService, activity_time
+from image_processor import ImageProcessor
+from hash_index import to_signed64
+from pipeline import ScreenshotJob
+from models import Employee
+
+RETRY_STATUSES = {500, 502, 503, 504}
+
+
+class AsyncRateLimiter:
+    """Ограничитель частоты запросов (token bucket)"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncInsiderService:
+    """Асинхронный аналог InsiderService с общим лимитом параллелизма и лимитом частоты на хост"""
+
+    def __init__(self, concurrency: int = ASYNC_CONCURRENCY, rate_limit: float = ASYNC_RATE_LIMIT):
+        require_insider_credentials()
+        self.base_url = INSIDER_API_URL
+        self.api_key = INSIDER_API_KEY
+        self.rate_limit = rate_limit
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._limiters = {}
+        self._session = None
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+
+    def _limiter(self, url: str) -> AsyncRateLimiter:
+        host = urlsplit(url).netloc
+        if host not in self._limiters:
+            self._limiters[host] = AsyncRateLimiter(self.rate_limit)
+        return self._limiters[host]
+
+    async def _request(self, method: str, endpoint: str, params: dict, read_json: bool = True):
+        """Выполняет запрос с повторами на 5xx и ошибках соединения"""
+        url = f"{self.base_url}{endpoint}"
+        params = dict(params, key=self.api_key)
+
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            async with self._semaphore:
+                await self._limiter(url).acquire()
+                try:
+                    async with self._session.request(method, url, params=params) as response:
+                        if response.status not in RETRY_STATUSES:
+                            response.raise_for_status()
+                            return await response.json(content_type=None) if read_json else await response.read()
+                        error = f"HTTP {response.status}"
+                except aiohttp.ClientResponseError:
+                    raise
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    error = e
+
+            if attempt < HTTP_MAX_RETRIES:
+                await asyncio.sleep(HTTP_BACKOFF_FACTOR * (2 ** attempt))
+
+        raise aiohttp.ClientError(f"Запрос {endpoint} не выполнен после {HTTP_MAX_RETRIES + 1} попыток: {error}")
+
+    async def _make_request(self, endpoint: str, params: dict = None) -> dict:
+        """Выполняет запрос к API ИНСАЙДЕР"""
+        method = 'POST' if endpoint == '/api/activities/find' else 'GET'
+        try:
+            result = await self._request(method, endpoint, params or {})
+            logger.debug(f"API Response for {endpoint}: {result}")
+            return result
+        except aiohttp.ClientError as e:
+            logger.error(f"Ошибка при запросе к API {endpoint}: {e}")
+            return None
+
+    async def get_employees(self) -> list:
+        """Получает список сотрудников"""
+        response = await self._make_request('/api/users/find')
+        return InsiderService._parse_employees(response)
+
+    async def get_screenshots(self, user_id: str, start_date: datetime = None, end_date: datetime = None,
+                              offset: int = 0) -> list:
+        """Получает список скриншотов для сотрудника"""
+        params = InsiderService._screenshot_params(user_id, start_date, end_date, offset)
+        response = await self._make_request('/api/activities/find', params)
+
+        if not response or 'data' not in response:
+            logger.error(f"Неожиданный ответ API для пользователя {user_id}: {response}")
+            return []
+
+        logger.info(f"Получено {len(response['data'])} скриншотов для пользователя {user_id}")
+        return response['data']
+
+    async def get_all_screenshots(self, user_id: str, start_date: datetime = None) -> list:
+        """Постранично получает все скриншоты сотрудника начиная с start_date"""
+        end_date = datetime.now()
+        screenshots = []
+        seen = set()
+        offset = 0
+        while True:
+            page = await self.get_screenshots(user_id, start_date, end_date, offset=offset)
+            fresh = [item for item in page if item['data']['file'] not in seen]
+            screenshots.extend(fresh)
+            if len(page) < BATCH_SIZE or not fresh:
+                return screenshots
+            seen.update(item['data']['file'] for item in fresh)
+            offset += len(page)
+
+    async def download_screenshot(self, file_id: str) -> bytes:
+        """Скачивает скриншот по его ID и возвращает содержимое файла"""
+        try:
+            return await self._request('GET', '/api/resources/get', {'id': file_id}, read_json=False)
+        except aiohttp.ClientError as e:
+            logger.error(f"Ошибка при скачивании скриншота {file_id}: {e}")
+            return None
+
+
+class AsyncScreenshotCrawler:
+    """Асинхронный обход всех сотрудников: сеть в event loop, OCR в отдельном исполнителе.
+
+    Между скачиванием и записью в буфер одновременно находится не больше max_in_flight
+    скриншотов, поэтому память не растёт с числом сотрудников и скриншотов. Вся работа
+    с сессией БД идёт в одном отдельном потоке и не блокирует event loop.
+    """
+
+    def __init__(self, processor, ocr_workers: int = ASYNC_OCR_WORKERS, max_in_flight: int = ASYNC_MAX_IN_FLIGHT):
+        self.processor = processor
+        self.ocr_workers = max(1, ocr_workers)
+        self.max_in_flight = max(1, max_in_flight or ASYNC_CONCURRENCY)
+        self._executor = None
+        self._db_executor = None
+        self._in_flight = None
+        self.hash_index = processor.hash_index
+        # file_id, пропущенные как дубликаты: отметка синхронизации может их обогнать
+        self.duplicates = set()
+        # file_id скриншотов с прошлых обходов, уже обработанных в этом обходе
+        self.resumed = set()
+
+    def _employees(self) -> list:
+        """id и insider_id сотрудников: после commit объекты сессии нельзя читать из event loop"""
+        return [
+            SimpleNamespace(id=employee.id, insider_id=employee.insider_id)
+            for employee in self.processor.ordered_employees()
+        ]
+
+    async def _db(self, func, *args, **kwargs):
+        """Выполняет обращение к БД в потоке сессии"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, functools.partial(func, *args, **kwargs))
+
+    def _recognize(self, file_id: str, content: bytes, image, frame_key: str) -> str:
+        """OCR и NLP одного скриншота (выполняется в исполнителе)"""
+        if self.processor.ocr_pool is not None:
+            [(_, processed_text)] = self.processor.ocr_pool.process_batch([(file_id, content, frame_key)])
+            return processed_text
+        return self.processor.image_processor.process_image(image, file_id, frame_key)
+
+    @staticmethod
+    def _decode_and_hash(content: bytes):
+        image = ImageProcessor.load_image(content)
+        return image, ImageProcessor.calculate_image_hash(image)
+
+    async def _process_screenshot(self, api: AsyncInsiderService, job: ScreenshotJob) -> bool:
+        # Слот держится от скачивания до записи в буфер
+        async with self._in_flight:
+            if not self.processor.sweep_running:
+                return False
+            if self.processor.checkpoints is not None:
+                await self._db(self.processor.checkpoints.start, job)
+            return await self._download_and_recognize(api, job)
+
+    async def _record_failure(self, job: ScreenshotJob, reason: str):
+        await self._db(self.processor.record_failure, job, reason)
+
+    async def _download_and_recognize(self, api: AsyncInsiderService, job: ScreenshotJob) -> bool:
+        file_id = job.file_id
+        content = await api.download_screenshot(file_id)
+        if not content:
+            logger.warning(f"Не удалось скачать скриншот {file_id}")
+            await self._record_failure(job, "download: скриншот не скачан")
+            return False
+
+        loop = asyncio.get_running_loop()
+        image, image_hash = await loop.run_in_executor(self._executor, self._decode_and_hash, content)
+        if not image_hash:
+            logger.warning(f"Не удалось вычислить хеш для скриншота {file_id}")
+            await self._record_failure(job, "hash: хеш не вычислен")
+            return False
+
+        hash_value = int(image_hash, 16)
+        duplicate = self.hash_index.check_and_reserve(hash_value, file_id)
+        if duplicate is not None:
+            logger.debug(f"Скриншот {file_id} является дубликатом {duplicate}")
+            self.duplicates.add(file_id)
+            if self.processor.checkpoints is not None:
+                await self._db(self.processor.checkpoints.checkpoint_duplicate, job)
+            return False
+
+        try:
+            processed_text = await loop.run_in_executor(
+                self._executor, self._recognize, file_id, content, image, job.employee_insider_id
+            )
+            if not processed_text:
+                logger.warning(f"Не удалось обработать скриншот {file_id}")
+                self._release(file_id)
+                await self._record_failure(job, "ocr+nlp: скриншот не обработан")
+                return False
+
+            await self._db(
+                self.processor.writer.add,
+                insider_id=file_id,
+                employee_id=job.employee_id,
+                file_path=ImageProcessor.annotated_path(file_id),
+                processed_text=processed_text,
+                image_hash=image_hash,
+                hash_value=to_signed64(hash_value),
+                hash_algorithm=self.hash_index.algorithm,
+                file_size=len(content),
+                captured_at=job.captured_at
+            )
+        except Exception:
+            self._release(file_id)
+            raise
+        return True
+
+    def _release(self, file_id: str):
+        """Снимает резерв хеша несохранённого скриншота"""
+        dependents = self.hash_index.release(file_id)
+        if dependents:
+            # Отметка синхронизации остановится перед ними, и они будут запрошены снова
+            self.duplicates.difference_update(dependents)
+            logger.info(f"Скриншот {file_id} не сохранён: {len(dependents)} его дубликатов будут обработаны заново")
+
+    async def _process_jobs(self, api: AsyncInsiderService, jobs: list) -> int:
+        pending = iter(jobs)
+        processed_count = 0
+
+        async def worker():
+            nonlocal processed_count
+            # Задачи берутся из общего итератора, поэтому задач asyncio не больше max_in_flight
+            for job in pending:
+                try:
+                    if await self._process_screenshot(api, job):
+                        processed_count += 1
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке скриншота {job.file_id}: {e}")
+                    await self._record_failure(job, str(e))
+
+        await asyncio.gather(*(worker() for _ in range(min(self.max_in_flight, len(jobs)))))
+        return processed_count
+
+    def _resumed_jobs(self) -> list:
+        """Скриншоты, прерванные в прошлых обходах или возвращённые из dead letter"""
+        duplicates = set()
+        jobs = self.processor.resumed_screenshot_jobs()
+        self.resumed = {job.file_id for job in jobs}
+        prepared = list(self.processor.checkpoints.track(jobs, duplicates=duplicates))
+        self.duplicates.update(duplicates)
+        return prepared
+
+    async def _process_resumed(self, api: AsyncInsiderService) -> int:
+        """Скриншоты с прошлых обходов обрабатываются до сотрудников: отметка синхронизации могла их обогнать.
+
+        Сохранённые этапы не используются, скриншот скачивается и распознаётся заново.
+        """
+        jobs = await self._db(self._resumed_jobs)
+        if not jobs:
+            return 0
+        processed_count = await self._process_jobs(api, jobs)
+        try:
+            await self._db(self.processor.writer.flush)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить скриншоты с прошлых обходов: {e}")
+        return processed_count
+
+    async def _process_employee(self, api: AsyncInsiderService, employee: Employee) -> int:
+        try:
+            start_date = await self._db(self.processor.insider_service.sync_start_date, employee)
+            screenshots = await api.get_all_screenshots(employee.insider_id, start_date=start_date)
+            file_ids = [item['data']['file'] for item in screenshots]
+        except KeyError as e:
+            logger.error(f"Ошибка в структуре данных скриншота: {e}")
+            return 0
+
+        existing = await self._db(self.processor.existing_insider_ids, file_ids)
+        # С чекпоинтами ведутся попытки и ошибки; завершённые ранее скриншоты и dead letter пропускаются
+        duplicates = set()
+        tracked = await self._db(
+            self.processor.tracked_jobs, employee, screenshots, existing | self.resumed, duplicates
+        )
+        self.duplicates.update(duplicates)
+        if tracked is not None:
+            jobs = list(tracked.values())
+        else:
+            jobs = [
+                ScreenshotJob(item['data']['file'], employee.id, employee.insider_id, activity_time(item))
+                for item in screenshots if item['data']['file'] not in existing
+            ]
+        processed_count = await self._process_jobs(api, jobs)
+
+        logger.info(f"Обработано {processed_count} скриншотов для сотрудника {employee.insider_id}")
+        # Отметка синхронизации не должна опережать запись скриншотов
+        try:
+            await self._db(self.processor.writer.flush)
+        except Exception as e:
+            logger.error(f"Скриншоты сотрудника {employee.insider_id} не записаны, отметка не сдвигается: {e}")
+            return processed_count
+        if self.processor.sweep_running:
+            # Дубликат скриншота, который ещё обрабатывается другим сотрудником, пока не считается обработанным
+            duplicates = self.duplicates - self.hash_index.waiting()
+            unfinished = await self._db(self.processor.unfinished_ids, screenshots, duplicates)
+            await self._db(self.processor.insider_service.save_sync_state, employee.id, screenshots, unfinished)
+            self.processor.finished_employees.add(employee.id)
+        return processed_count
+
+    async def run(self) -> int:
+        """Синхронизирует сотрудников и параллельно обрабатывает их скриншоты"""
+        self._executor = ThreadPoolExecutor(max_workers=self.ocr_workers)
+        self._db_executor = ThreadPoolExecutor(max_workers=1)
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        started = time.monotonic()
+        try:
+            async with AsyncInsiderService() as api:
+                employees = await api.get_employees()
+                await self._db(self.processor.insider_service.sync_employees, employees)
+
+                employees = await self._db(self._employees)
+                logger.info(f"Найдено {len(employees)} сотрудников для обработки")
+
+                resumed = 0
+                if self.processor.checkpoints is not None:
+                    resumed = await self._process_resumed(api)
+                # Ошибка одного сотрудника не прерывает обход остальных; его отметка синхронизации не сдвигается
+                results = await asyncio.gather(
+                    *(self._process_employee(api, employee) for employee in employees), return_exceptions=True
+                )
+                counts = []
+                for employee, result in zip(employees, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Ошибка при обработке скриншотов сотрудника {employee.insider_id}: {result}")
+                    elif isinstance(result, BaseException):
+                        raise result
+                    else:
+                        counts.append(result)
+                if self.processor.checkpoints is not None:
+                    await self._db(self.processor.checkpoints.settle)
+        finally:
+            self._executor.shutdown(wait=True)
+            self._db_executor.shutdown(wait=True)
+
+        total = resumed + sum(counts)
+        logger.info(f"Асинхронный обход завершён за {time.monotonic() - started:.1f} с, обработано {total} скриншотов")
+        return total
@@ -0,0 +1,381 @@
+# -состояние обработки каждого скриншота и результаты этапов для продолжения после сбоя
+import json
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from loguru import logger
+from sqlalchemy import bindparam, case, delete, exists, select, update
+from config import CHECKPOINT_DIR, CHECKPOINT_MAX_ATTEMPTS, CHECKPOINT_SPOOL
+from db.database import insert_ignoring_conflicts
+from hash_index import from_signed64, to_signed64
+from models import QueueItem, Screenshot, ScreenshotState
+from work_queue import FAILED, PENDING
+
+DISCOVERED = 'discovered'
+DOWNLOADED = 'downloaded'
+RECOGNIZED = 'recognized'
+ANALYZED = 'analyzed'
+STORED = 'stored'
+DUPLICATE = 'duplicate'
+
+# Порядок этапов: задача продолжается с этапа после последнего завершённого
+STAGE_ORDER = {DISCOVERED: 0, DOWNLOADED: 1, RECOGNIZED: 2, ANALYZED: 3, STORED: 4, DUPLICATE: 4}
+FINISHED = (STORED, DUPLICATE)
+
+# Результаты этапов, которые больше не нужны после сохранения скриншота
+_CLEARED = {'raw_text': None, 'processed_text': None, 'entities': None}
+
+
+def reached(job, stage: str) -> bool:
+    """Задача уже прошла этап stage (в этом или в прошлом запуске)"""
+    return job.stage is not None and STAGE_ORDER[job.stage] >= STAGE_ORDER[stage]
+
+
+class CheckpointStore:
+    """Записи screenshot_states: этап, попытки, ошибка и промежуточные результаты.
+
+    Хеш, сырой и итоговый текст хранятся в строке состояния, после перезапуска задача
+    продолжается с последнего завершённого этапа. Результаты этапов копятся в памяти и
+    записываются в транзакции ScreenshotWriter вместе с очередной пачкой скриншотов.
+    Попытка засчитывается пачкой при подготовке задач; задачи, так и не взятые в работу,
+    получают попытку обратно в settle(). Скриншот, обработка которого начиналась
+    max_attempts раз, попадает в список dead letter и больше не обрабатывается.
+    Со spool скачанный файл хранится в spool_dir до сохранения в базу, без него
+    задача с этапа downloaded скачивает файл заново.
+    """
+
+    def __init__(self, session_factory, spool_dir=CHECKPOINT_DIR, max_attempts: int = CHECKPOINT_MAX_ATTEMPTS,
+                 chunk_size: int = 100, spool: bool = CHECKPOINT_SPOOL):
+        self.session = session_factory()
+        self.spool_dir = str(spool_dir)
+        self.spool = spool
+        self.max_attempts = max(1, max_attempts)
+        self.chunk_size = max(1, chunk_size)
+        self.resumed = Counter()
+        self._lock = threading.Lock()
+        self._stages = {}  # insider_id -> ещё не записанные значения этапа
+        self._unstarted = Counter()  # insider_id -> попытки, засчитанные без начала обработки
+        if self.spool:
+            os.makedirs(self.spool_dir, exist_ok=True)
+
+    def track(self, jobs, duplicates: set = None):
+        """Регистрирует задачи и восстанавливает их результаты; пропускает завершённые и dead letter.
+
+        file_id задач, ранее отброшенных как дубликаты, добавляются в duplicates.
+        """
+        chunk = []
+        for job in jobs:
+            chunk.append(job)
+            if len(chunk) >= self.chunk_size:
+                yield from self._prepare(chunk, duplicates)
+                chunk = []
+        if chunk:
+            yield from self._prepare(chunk, duplicates)
+
+    def _prepare(self, jobs: list, duplicates: set = None) -> list:
+        now = datetime.utcnow()
+        with self._lock:
+            insert_ignoring_conflicts(self.session, ScreenshotState, [
+                {'insider_id': job.file_id, 'employee_id': job.employee_id, 'captured_at': job.captured_at,
+                 'stage': DISCOVERED, 'attempts': 0, 'dead_letter': False, 'created_at': now, 'updated_at': now}
+                for job in jobs
+            ], 'insider_id')
+            states = {
+                state.insider_id: state for state in self.session.execute(
+                    select(ScreenshotState).where(ScreenshotState.insider_id.in_([job.file_id for job in jobs]))
+                ).scalars()
+            }
+
+            prepared, dead = [], []
+            for job in jobs:
+                state = states[job.file_id]
+                if state.stage == DUPLICATE and duplicates is not None:
+                    duplicates.add(job.file_id)
+                if state.stage in FINISHED or state.dead_letter:
+                    continue
+                if state.attempts >= self.max_attempts:
+                    # Обработка начиналась max_attempts раз и не завершилась (в том числе из-за падения процесса)
+                    dead.append(state.insider_id)
+                    continue
+                self._restore(job, state)
+                prepared.append(job)
+
+            if dead:
+                self.session.execute(
+                    update(ScreenshotState).where(ScreenshotState.insider_id.in_(dead))
+                    .values(dead_letter=True, updated_at=now).execution_options(synchronize_session=False)
+                )
+                logger.warning(f"В dead letter перенесено {len(dead)} скриншотов, исчерпавших {self.max_attempts} попыток")
+            counted = {job.file_id for job in prepared}
+            if counted:
+                # Попытка засчитывается до начала обработки: падение процесса на скриншоте тоже её расходует
+                self.session.execute(
+                    update(ScreenshotState).where(ScreenshotState.insider_id.in_(counted))
+                    .values(attempts=ScreenshotState.attempts + 1, updated_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                self._unstarted.update(counted)
+            self.session.commit()
+            # Объекты состояний больше не нужны сессии
+            self.session.expunge_all()
+        return prepared
+
+    def _restore(self, job, state: ScreenshotState):
+        job.stage = state.stage
+        job.captured_at = job.captured_at or state.captured_at
+        if state.stage != DISCOVERED:
+            self.resumed[state.stage] += 1
+        if reached(job, DOWNLOADED):
+            job.image_hash = state.image_hash
+            job.hash_value = from_signed64(state.hash_value)
+            job.file_size = state.file_size
+        if reached(job, RECOGNIZED):
+            job.raw_text = state.raw_text
+        if reached(job, ANALYZED):
+            from image_processor import AnalysisResult
+            job.processed_text = AnalysisResult(state.processed_text, json.loads(state.entities or '[]'))
+
+    def spool_path(self, file_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{file_id}.jpg")
+
+    def save_download(self, job):
+        """Со spool сохраняет скачанный файл, чтобы после сбоя не скачивать его повторно"""
+        if not self.spool:
+            return
+        tmp_path = f"{self.spool_path(job.file_id)}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(job.content)
+        os.replace(tmp_path, self.spool_path(job.file_id))
+
+    def load_download(self, job):
+        if not self.spool:
+            return None
+        try:
+            with open(self.spool_path(job.file_id), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def start(self, job):
+        """Обработка задачи началась: засчитанная при подготовке попытка больше не возвращается"""
+        with self._lock:
+            self._unstarted[job.file_id] -= 1
+            if self._unstarted[job.file_id] <= 0:
+                del self._unstarted[job.file_id]
+
+    def checkpoint(self, job, stage: str, **values):
+        """Отмечает завершение этапа; результат запишется со следующей пачкой ScreenshotWriter"""
+        job.stage = stage
+        with self._lock:
+            self._stages.setdefault(job.file_id, {}).update(stage=stage, last_error=None, **values)
+
+    def checkpoint_downloaded(self, job):
+        self.checkpoint(job, DOWNLOADED, image_hash=job.image_hash, hash_value=to_signed64(job.hash_value),
+                        file_size=job.file_size)
+
+    def checkpoint_recognized(self, job):
+        self.checkpoint(job, RECOGNIZED, raw_text=job.raw_text)
+
+    def checkpoint_analyzed(self, job):
+        entities = getattr(job.processed_text, 'entities', None) or []
+        self.checkpoint(job, ANALYZED, processed_text=str(job.processed_text),
+                        entities=json.dumps(entities, ensure_ascii=False))
+
+    def checkpoint_duplicate(self, job):
+        self.checkpoint(job, DUPLICATE, **_CLEARED)
+        self.remove_spool([job.file_id])
+
+    def reopen(self, insider_ids: list):
+        """Кадры, отброшенные как дубликаты несохранённого скриншота, снова ждут обработки"""
+        with self._lock:
+            for file_id in insider_ids:
+                values = self._stages.get(file_id)
+                if values is not None and values.get('stage') == DUPLICATE:
+                    values['stage'] = DISCOVERED
+            self.session.execute(
+                update(ScreenshotState)
+                .where(ScreenshotState.insider_id.in_(insider_ids), ScreenshotState.stage == DUPLICATE)
+                .values(stage=DISCOVERED, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            self.session.commit()
+
+    def fail(self, job, reason: str):
+        """Неудачная попытка: задача продолжится с последнего этапа, пока не исчерпаны попытки.
+
+        Записывается сразу вместе с ещё не записанными результатами этапов задачи.
+        """
+        with self._lock:
+            values = self._stages.pop(job.file_id, {})
+            attempts = self.session.scalar(
+                select(ScreenshotState.attempts).where(ScreenshotState.insider_id == job.file_id)
+            ) or 0
+            dead = attempts >= self.max_attempts
+            self.session.execute(
+                update(ScreenshotState).where(ScreenshotState.insider_id == job.file_id)
+                .values({**values, 'last_error': reason[:1000], 'dead_letter': dead, 'updated_at': datetime.utcnow()})
+                .execution_options(synchronize_session=False)
+            )
+            self.session.commit()
+        if dead:
+            logger.warning(f"Скриншот {job.file_id} перенесён в dead letter после {attempts} попыток: {reason}")
+            self.remove_spool([job.file_id])
+
+    def take(self) -> dict:
+        """Забирает накопленные результаты этапов для записи в транзакции ScreenshotWriter"""
+        with self._lock:
+            stages, self._stages = self._stages, {}
+            return stages
+
+    def put_back(self, stages: dict):
+        """Возвращает результаты этапов, транзакция с которыми откатилась; более новые не затираются"""
+        with self._lock:
+            for file_id, values in stages.items():
+                self._stages[file_id] = {**values, **self._stages.get(file_id, {})}
+
+    @staticmethod
+    def write(session, stages: dict):
+        """Записывает результаты этапов в текущей транзакции session, по одному запросу на набор полей"""
+        table = ScreenshotState.__table__
+        now = datetime.utcnow()
+        groups = {}
+        for file_id, values in stages.items():
+            groups.setdefault(tuple(sorted(values)), []).append(
+                {'b_insider_id': file_id, **{f"b_{key}": value for key, value in values.items()}}
+            )
+        for keys, params in groups.items():
+            session.execute(
+                table.update().where(table.c.insider_id == bindparam('b_insider_id'))
+                .values({**{key: bindparam(f"b_{key}") for key in keys}, 'updated_at': now}),
+                params
+            )
+
+    def settle(self):
+        """Конец прохода: возвращает попытки задачам, не взятым в работу, и записывает оставшиеся этапы"""
+        with self._lock:
+            unstarted, self._unstarted = self._unstarted, Counter()
+            stages, self._stages = self._stages, {}
+            try:
+                refunds = {}
+                for file_id, count in unstarted.items():
+                    refunds.setdefault(count, []).append(file_id)
+                for count, file_ids in refunds.items():
+                    for chunk in range(0, len(file_ids), 500):
+                        self.session.execute(
+                            update(ScreenshotState)
+                            .where(ScreenshotState.insider_id.in_(file_ids[chunk:chunk + 500]))
+                            .values(attempts=case((ScreenshotState.attempts > count, ScreenshotState.attempts - count), else_=0))
+                            .execution_options(synchronize_session=False)
+                        )
+                if stages:
+                    self.write(self.session, stages)
+                self.session.commit()
+            except Exception as e:
+                # Попытки останутся засчитанными, результаты этапов запишутся со следующей пачкой
+                logger.error(f"Не удалось записать состояние чекпоинтов: {e}")
+                self.session.rollback()
+                self._stages = {**stages, **self._stages}
+
+    @staticmethod
+    def mark_stored(session, insider_ids: list):
+        """Выполняется в транзакции ScreenshotWriter вместе со вставкой скриншотов"""
+        session.execute(
+            update(ScreenshotState).where(ScreenshotState.insider_id.in_(insider_ids))
+            .values(stage=STORED, last_error=None, updated_at=datetime.utcnow(), **_CLEARED)
+            .execution_options(synchronize_session=False)
+        )
+
+    def remove_spool(self, insider_ids: list):
+        if not self.spool:
+            return
+        for file_id in insider_ids:
+            try:
+                os.remove(self.spool_path(file_id))
+            except FileNotFoundError:
+                pass
+
+    def report(self):
+        """Пишет в лог, сколько задач продолжено с каждого этапа, и сбрасывает счётчики"""
+        if self.resumed:
+            logger.info(f"Продолжено с чекпоинтов: {dict(self.resumed)}")
+            self.resumed.clear()
+
+    def close(self):
+        self.settle()
+        with self._lock:
+            self.session.close()
+
+
+def unfinished_states(session, max_attempts: int = CHECKPOINT_MAX_ATTEMPTS) -> list:
+    """(insider_id, employee_id, captured_at) скриншотов, обработка которых прервалась и ещё не исчерпала попытки"""
+    return session.execute(
+        select(ScreenshotState.insider_id, ScreenshotState.employee_id, ScreenshotState.captured_at)
+        .where(
+            ScreenshotState.dead_letter.is_(False),
+            ScreenshotState.stage.notin_(FINISHED),
+            ScreenshotState.attempts < max_attempts,
+            ~exists().where(Screenshot.insider_id == ScreenshotState.insider_id),
+        )
+        .order_by(ScreenshotState.id)
+    ).all()
+
+
+def dead_letters(session, limit: int = 100, cursor: int = None) -> list:
+    statement = select(
+        ScreenshotState.id, ScreenshotState.insider_id, ScreenshotState.employee_id, ScreenshotState.stage,
+        ScreenshotState.attempts, ScreenshotState.last_error, ScreenshotState.updated_at,
+    ).where(ScreenshotState.dead_letter.is_(True)).order_by(ScreenshotState.id.desc()).limit(limit)
+    if cursor is not None:
+        statement = statement.where(ScreenshotState.id < cursor)
+    return [dict(row._mapping) for row in session.execute(statement)]
+
+
+def dead_letter_ids(session, insider_ids: list) -> set:
+    """insider_id из списка, попавшие в dead letter"""
+    if not insider_ids:
+        return set()
+    return set(session.scalars(select(ScreenshotState.insider_id).where(
+        ScreenshotState.insider_id.in_(insider_ids), ScreenshotState.dead_letter.is_(True)
+    )))
+
+
+def requeue_dead_letters(session, insider_ids: list = None) -> int:
+    """Возвращает скриншоты из dead letter в обработку с новым запасом попыток.
+
+    В той же транзакции исчерпавшие попытки задачи общей очереди снова становятся pending:
+    отметка синхронизации их сотрудника уже сдвинута, и без очереди они бы не обработались.
+    """
+    statement = select(ScreenshotState.insider_id).where(ScreenshotState.dead_letter.is_(True))
+    if insider_ids:
+        statement = statement.where(ScreenshotState.insider_id.in_(insider_ids))
+    requeued = list(session.scalars(statement))
+    if not requeued:
+        return 0
+    now = datetime.utcnow()
+    for chunk in range(0, len(requeued), 500):
+        ids = requeued[chunk:chunk + 500]
+        session.execute(
+            update(ScreenshotState).where(ScreenshotState.insider_id.in_(ids))
+            .values(dead_letter=False, attempts=0, last_error=None, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        session.execute(
+            update(QueueItem).where(QueueItem.insider_id.in_(ids), QueueItem.status == FAILED)
+            .values(status=PENDING, attempts=0, lease_owner=None, lease_expires_at=None, not_before=None,
+                    updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+    session.commit()
+    return len(requeued)
+
+
+def purge_finished_states(session, older_than: timedelta) -> int:
+    """Удаляет записи сохранённых скриншотов и дубликатов старше older_than"""
+    removed = session.execute(
+        delete(ScreenshotState)
+        .where(ScreenshotState.stage.in_(FINISHED), ScreenshotState.updated_at < datetime.utcnow() - older_than)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    session.commit()
+    return removed
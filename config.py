@@ -13,15 +13,164 @@ INSIDER_API_URL = os.getenv('INSIDER_API_URL')
 INSIDER_API_KEY = os.getenv('INSIDER_API_KEY')
 
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///screenshots.db')
+# Настройки SQLite: WAL позволяет просмотрщику читать, пока обработчик пишет
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_SIZE_MB = int(os.getenv('SQLITE_CACHE_SIZE_MB', 64))
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 30000))  # мс ожидания блокировки
+# Инкрементальное освобождение места после удаления (auto_vacuum=INCREMENTAL)
+SQLITE_INCREMENTAL_VACUUM = os.getenv('SQLITE_INCREMENTAL_VACUUM', 'true').lower() in ('1', 'true', 'yes')
+# Полнотекстовый поиск по processed_text (SQLite FTS5)
+FTS_ENABLED = os.getenv('FTS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+FTS_TOKENIZER = os.getenv('FTS_TOKENIZER', 'unicode61')
+FTS_PREFIX_LENGTHS = os.getenv('FTS_PREFIX_LENGTHS', '2 3')  # длины префиксов с отдельным индексом
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 200))
+# Постраничный API и потоковая выгрузка просмотрщика
+PAGE_MAX_LIMIT = int(os.getenv('PAGE_MAX_LIMIT', 500))
+EXPORT_YIELD_PER = int(os.getenv('EXPORT_YIELD_PER', 1000))
+SUMMARY_LAST_N = int(os.getenv('SUMMARY_LAST_N', 10))
+# Общая очередь скриншотов для нескольких узлов OCR на одной базе.
+# Роль узла: all - ставит задачи и обрабатывает, producer - только ставит, worker - только обрабатывает
+WORK_QUEUE_ENABLED = os.getenv('WORK_QUEUE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+WORK_QUEUE_ROLE = os.getenv('WORK_QUEUE_ROLE', 'all')
+WORK_QUEUE_BATCH_SIZE = int(os.getenv('WORK_QUEUE_BATCH_SIZE', 64))
+WORK_QUEUE_LEASE_SECONDS = int(os.getenv('WORK_QUEUE_LEASE_SECONDS', 600))
+WORK_QUEUE_HEARTBEAT_SECONDS = int(os.getenv('WORK_QUEUE_HEARTBEAT_SECONDS', 0))  # 0 - треть срока аренды
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv('WORK_QUEUE_MAX_ATTEMPTS', 3))
+# Пауза перед повтором неудачной задачи; удваивается с каждой попыткой
+WORK_QUEUE_RETRY_SECONDS = int(os.getenv('WORK_QUEUE_RETRY_SECONDS', 60))
+# Чекпоинты обработки каждого скриншота: после сбоя обработка продолжается с последнего завершённого этапа
+CHECKPOINT_ENABLED = os.getenv('CHECKPOINT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Скачанные файлы хранятся на диске до сохранения в базу, чтобы после сбоя не скачивать их заново
+CHECKPOINT_SPOOL = os.getenv('CHECKPOINT_SPOOL', 'false').lower() in ('1', 'true', 'yes')
+CHECKPOINT_DIR = TEMP_DIR / os.getenv('CHECKPOINT_DIR', 'checkpoints')  # скачанные, но ещё не сохранённые скриншоты
+CHECKPOINT_MAX_ATTEMPTS = int(os.getenv('CHECKPOINT_MAX_ATTEMPTS', 3))  # после стольких попыток - dead letter
+# Хранение скриншотов: срок в днях (0 - не удалять), размер пачки удаления, потоки удаления файлов
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 30))
+CLEANUP_CHUNK_SIZE = int(os.getenv('CLEANUP_CHUNK_SIZE', 1000))
+CLEANUP_FILE_WORKERS = int(os.getenv('CLEANUP_FILE_WORKERS', 8))
+CLEANUP_VACUUM_PAGES = int(os.getenv('CLEANUP_VACUUM_PAGES', 0))  # страниц за раз, 0 - все свободные
+# Пакетная запись скриншотов: транзакция на N строк или раз в T секунд
+DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 100))
+DB_WRITE_FLUSH_INTERVAL = float(os.getenv('DB_WRITE_FLUSH_INTERVAL', 5))
 
 BATCH_SIZE = int(os.getenv('BATCH_SIZE', 20))
-SCHEDULE_INTERVAL = int(os.getenv('SCHEDULE_INTERVAL', 60)) 
+SYNC_INITIAL_DAYS = int(os.getenv('SYNC_INITIAL_DAYS', 30))  # глубина первой синхронизации сотрудника
+# Число сотрудников в одном запросе /api/activities/find (1 - по одному запросу на сотрудника)
+ACTIVITY_USERS_PER_REQUEST = int(os.getenv('ACTIVITY_USERS_PER_REQUEST', 50))
+ACTIVITY_USERS_PER_REQUEST_MAX = int(os.getenv('ACTIVITY_USERS_PER_REQUEST_MAX', 200))
+ACTIVITY_MAX_PAGES_PER_REQUEST = int(os.getenv('ACTIVITY_MAX_PAGES_PER_REQUEST', 4))
+SCHEDULE_INTERVAL = int(os.getenv('SCHEDULE_INTERVAL', 60))  # секунд между обходами в режиме демона
+# Режим демона: процесс не завершается, модели остаются загруженными, обходы идут по расписанию
+DAEMON_ENABLED = os.getenv('DAEMON_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+SWEEP_MAX_DURATION = int(os.getenv('SWEEP_MAX_DURATION', 0))  # секунд на обход, 0 - без ограничения
+SWEEP_STATUS_PATH = BASE_DIR / os.getenv('SWEEP_STATUS_PATH', 'sweep_status.json')
+
+# HTTP-клиент API ИНСАЙДЕР
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 16))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 60))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 3))
+HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5))
+HTTP_DOWNLOAD_CONCURRENCY = int(os.getenv('HTTP_DOWNLOAD_CONCURRENCY', 8))
+
+# Асинхронный обход сотрудников
+ASYNC_ENABLED = os.getenv('ASYNC_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+ASYNC_CONCURRENCY = int(os.getenv('ASYNC_CONCURRENCY', 32))
+ASYNC_RATE_LIMIT = float(os.getenv('ASYNC_RATE_LIMIT', 20))  # запросов в секунду на хост
+ASYNC_OCR_WORKERS = int(os.getenv('ASYNC_OCR_WORKERS', 1))
+# Скриншотов одновременно между скачиванием и записью в буфер; 0 - по числу запросов
+ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', 0))
+
+# Конвейерная обработка скриншотов (скачивание -> хеш -> OCR -> NLP -> БД)
+PIPELINE_ENABLED = os.getenv('PIPELINE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 32))
+PIPELINE_DOWNLOAD_WORKERS = int(os.getenv('PIPELINE_DOWNLOAD_WORKERS', 8))
+PIPELINE_OCR_WORKERS = int(os.getenv('PIPELINE_OCR_WORKERS', 0))  # 0 - по числу ядер / наличию GPU
+PIPELINE_NLP_WORKERS = int(os.getenv('PIPELINE_NLP_WORKERS', 1))
+PIPELINE_DB_BATCH_SIZE = int(os.getenv('PIPELINE_DB_BATCH_SIZE', 50))
+
+# Режим выполнения OCR: thread - модели в основном процессе, process - пул процессов
+OCR_EXECUTION_MODE = os.getenv('OCR_EXECUTION_MODE', 'thread')
+OCR_POOL_WORKERS = int(os.getenv('OCR_POOL_WORKERS', os.cpu_count() or 1))
+OCR_POOL_TORCH_THREADS = int(os.getenv('OCR_POOL_TORCH_THREADS', 1))  # 0 - не ограничивать
+OCR_POOL_BATCH_SIZE = int(os.getenv('OCR_POOL_BATCH_SIZE', 4))
+
+# Хеш изображений для поиска дубликатов: ahash, dhash или phash
+IMAGE_HASH_ALGORITHM = os.getenv('IMAGE_HASH_ALGORITHM', 'ahash')
+# Максимальное расстояние Хэмминга, при котором скриншот считается дубликатом (0 - точное совпадение)
+NEAR_DUPLICATE_DISTANCE = int(os.getenv('NEAR_DUPLICATE_DISTANCE', 4))
+
+# Движок OCR: easyocr (GPU) или tesseract (быстрее на узлах без GPU)
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'easyocr').lower()
+OCR_GPU = os.getenv('OCR_GPU', 'true').lower() in ('1', 'true', 'yes')
+OCR_TESSERACT_LANG = os.getenv('OCR_TESSERACT_LANG', 'rus+eng')
+OCR_TESSERACT_CONFIG = os.getenv('OCR_TESSERACT_CONFIG', '--oem 1 --psm 3')
+
+# Предобработка кадра перед OCR: профиль off, quality, balanced или fast; отдельные параметры переопределяют профиль
+OCR_PREPROCESS_PROFILE = os.getenv('OCR_PREPROCESS_PROFILE', 'off').lower()
+OCR_PREPROCESS_GRAYSCALE = (
+    os.getenv('OCR_PREPROCESS_GRAYSCALE').lower() in ('1', 'true', 'yes')
+    if os.getenv('OCR_PREPROCESS_GRAYSCALE') else None
+)
+OCR_PREPROCESS_MAX_SIDE = int(os.getenv('OCR_PREPROCESS_MAX_SIDE')) if os.getenv('OCR_PREPROCESS_MAX_SIDE') else None
+OCR_PREPROCESS_BINARIZE = os.getenv('OCR_PREPROCESS_BINARIZE', '').lower() or None  # none, contrast, otsu, adaptive
+
+# Поиск областей с текстом перед OCR: модель YOLO, а без неё - морфология OpenCV
+TEXT_REGION_ENABLED = os.getenv('TEXT_REGION_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+TEXT_REGION_MODEL = BASE_DIR / os.getenv('TEXT_REGION_MODEL', 'ml/text_regions.pt')
+TEXT_REGION_CONF = float(os.getenv('TEXT_REGION_CONF', 0.25))
+TEXT_REGION_IGNORE_TOP = int(os.getenv('TEXT_REGION_IGNORE_TOP', 0))  # пикселей сверху (заголовки окон)
+TEXT_REGION_IGNORE_BOTTOM = int(os.getenv('TEXT_REGION_IGNORE_BOTTOM', 48))  # пикселей снизу (панель задач)
+TEXT_REGION_PADDING = int(os.getenv('TEXT_REGION_PADDING', 8))
+TEXT_REGION_MAX_AREA_RATIO = float(os.getenv('TEXT_REGION_MAX_AREA_RATIO', 0.6))  # больше - OCR всего кадра
+
+# Пакетный OCR: сколько скриншотов одного размера детектировать за раз и размер батча распознавания
+OCR_IMAGE_BATCH = int(os.getenv('OCR_IMAGE_BATCH', 4))
+OCR_BATCH_SIZE = int(os.getenv('OCR_BATCH_SIZE', 16))
+
+# Анализ текста Natasha: синтаксический разбор (false - только NER) и число текстов в одном проходе
+NLP_SYNTAX_ENABLED = os.getenv('NLP_SYNTAX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+NLP_BATCH_SIZE = int(os.getenv('NLP_BATCH_SIZE', 8))
+# Сущности хранятся в screenshot_entities; true - дописывать в текст и прежнюю сводку "Морфологический анализ"
+NLP_APPEND_SUMMARY = os.getenv('NLP_APPEND_SUMMARY', 'false').lower() in ('1', 'true', 'yes')
+ENTITY_MAX_LENGTH = 255
+ENTITY_TOP_MAX_LIMIT = int(os.getenv('ENTITY_TOP_MAX_LIMIT', 200))
+
+# Кэш исправлений орфографии Hunspell (слово -> исправление)
+SPELL_CACHE_SIZE = int(os.getenv('SPELL_CACHE_SIZE', 100000))
+SPELL_CACHE_PATH = BASE_DIR / os.getenv('SPELL_CACHE_PATH', 'spell_cache.json')
+
+# Повторное распознавание только изменившихся областей между скриншотами сотрудника
+REGION_DIFF_ENABLED = os.getenv('REGION_DIFF_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+REGION_DIFF_TILE_SIZE = int(os.getenv('REGION_DIFF_TILE_SIZE', 64))
+REGION_DIFF_PIXEL_THRESHOLD = int(os.getenv('REGION_DIFF_PIXEL_THRESHOLD', 24))
+REGION_DIFF_MAX_CHANGED_RATIO = float(os.getenv('REGION_DIFF_MAX_CHANGED_RATIO', 0.4))
+REGION_DIFF_FULL_EVERY = int(os.getenv('REGION_DIFF_FULL_EVERY', 20))  # полное распознавание каждые N кадров
+REGION_DIFF_MAX_FRAMES = int(os.getenv('REGION_DIFF_MAX_FRAMES', 32))  # ~2 МБ на кадр 1920x1080 в каждом процессе
+
+# Кэш результатов OCR по содержимому изображения
+OCR_CACHE_ENABLED = os.getenv('OCR_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+OCR_CACHE_PATH = BASE_DIR / os.getenv('OCR_CACHE_PATH', 'ocr_cache.db')
+OCR_CACHE_MAX_ENTRIES = int(os.getenv('OCR_CACHE_MAX_ENTRIES', 200000))
+OCR_CACHE_VERSION = os.getenv('OCR_CACHE_VERSION', '1')  # сменить, чтобы сбросить кэш вручную
+
+# Сохранять изображения с рамками вокруг распознанного текста
+SAVE_ANNOTATED_IMAGES = os.getenv('SAVE_ANNOTATED_IMAGES', 'false').lower() in ('1', 'true', 'yes')
+ANNOTATED_DIR = BASE_DIR / os.getenv('ANNOTATED_DIR', 'outputs')
 
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 LOG_FILE = BASE_DIR / 'app.log'
 
-if not all([INSIDER_API_URL, INSIDER_API_KEY]):
-    raise ValueError("Необходимо указать INSIDER_API_URL и INSIDER_API_KEY в .env файле")
+# Модели загружаются в фоне параллельно с синхронизацией сотрудников (false - при первом обращении)
+MODEL_PRELOAD = os.getenv('MODEL_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+
+def require_insider_credentials():
+    """Проверяется клиентами API, а не при импорте: просмотрщику БД ключи не нужны"""
+    if not all([INSIDER_API_URL, INSIDER_API_KEY]):
+        raise ValueError("Необходимо указать INSIDER_API_URL и INSIDER_API_KEY в .env файле")
+
 
 UPLOAD_FOLDER = "static/uploads"
 PROCESSED_FOLDER = "static/processed"
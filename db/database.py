@@ -1,11 +1,108 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, select, text
 from sqlalchemy.orm import sessionmaker, declarative_base
-from config import DATABASE_URL
+from sqlalchemy.schema import CreateIndex
+from loguru import logger
+from config import (
+    DATABASE_URL,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_CACHE_SIZE_MB,
+    SQLITE_BUSY_TIMEOUT,
+    SQLITE_INCREMENTAL_VACUUM
+)
+
+
+def apply_sqlite_pragmas(engine):
+    """Настраивает каждое новое соединение SQLite: журнал, синхронизация, кэш страниц"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if SQLITE_INCREMENTAL_VACUUM:
+            # До journal_mode: новая база сразу создаётся в этом режиме, на существующей действует только после VACUUM
+            cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        cursor.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_MB * 1024}')
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.close()
+
 
 engine = create_engine(DATABASE_URL)
+apply_sqlite_pragmas(engine)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
 def init_db():
-    from models import Employee, Screenshot
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    from models import Employee, Screenshot, SyncState, ScreenshotEntity, QueueItem, ScreenshotState
+    check_incremental_vacuum()
+    Base.metadata.create_all(engine)
+    add_missing_columns()
+    add_missing_indexes()
+    from text_search import ensure_fts_index
+    ensure_fts_index(engine)
+
+def check_incremental_vacuum():
+    """Предупреждает, если существующая база ещё не переведена в auto_vacuum=INCREMENTAL"""
+    if engine.dialect.name != 'sqlite' or not SQLITE_INCREMENTAL_VACUUM:
+        return
+    with engine.connect() as conn:
+        if conn.execute(text('PRAGMA auto_vacuum')).scalar() == 2 or not inspect(conn).get_table_names():
+            return
+    logger.warning(
+        "База данных не в режиме auto_vacuum=INCREMENTAL: место после очистки не возвращается. "
+        "Перевод (однократный VACUUM): python utilscripts/enable_incremental_vacuum.py"
+    )
+
+def enable_incremental_vacuum() -> bool:
+    """Переводит базу в auto_vacuum=INCREMENTAL однократным VACUUM; False, если она уже в этом режиме"""
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if conn.execute(text('PRAGMA auto_vacuum')).scalar() == 2:
+            return False
+        conn.execute(text('PRAGMA auto_vacuum=INCREMENTAL'))
+        conn.execute(text('VACUUM'))
+        return True
+
+def insert_ignoring_conflicts(session, model, rows: list, key: str) -> int:
+    """Вставляет строки, пропуская уже существующие по уникальной колонке key; возвращает число новых"""
+    if not rows:
+        return 0
+    dialect = session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        from sqlalchemy.dialects import postgresql, sqlite
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        # RETURNING отдаёт только действительно вставленные строки
+        return len(session.execute(
+            insert(model).on_conflict_do_nothing(index_elements=[key]).returning(model.id), rows
+        ).all())
+
+    column = getattr(model, key)
+    present = set(session.scalars(select(column).where(column.in_([row[key] for row in rows]))))
+    rows = [row for row in rows if row[key] not in present]
+    if rows:
+        session.execute(model.__table__.insert(), rows)
+    return len(rows)
+
+def add_missing_columns():
+    """Добавляет в существующие таблицы колонки, появившиеся в моделях позже"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+def add_missing_indexes():
+    """Создаёт в существующих таблицах индексы, появившиеся в моделях позже"""
+    # Отражение SQLite не видит индексы по выражениям, поэтому проверку делает сама БД
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
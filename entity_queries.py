@@ -0,0 +1,80 @@
+# -агрегаты по сущностям скриншотов из индексов screenshot_entities
+from datetime import date
+from typing import Optional
+from sqlalchemy import func, select
+from models import Screenshot, ScreenshotEntity
+
+ENTITY_TYPES = ('PER', 'LOC', 'ORG', 'DATE', 'SUBJ', 'OBJ')
+
+
+def _filtered(statement, employee_id: Optional[int], day_from: Optional[date], day_to: Optional[date],
+              entity_type: Optional[str]):
+    if employee_id is not None:
+        statement = statement.where(ScreenshotEntity.employee_id == employee_id)
+    if day_from is not None:
+        statement = statement.where(ScreenshotEntity.day >= day_from)
+    if day_to is not None:
+        statement = statement.where(ScreenshotEntity.day <= day_to)
+    if entity_type is not None:
+        statement = statement.where(ScreenshotEntity.type == entity_type)
+    return statement
+
+
+def top_entities(db, employee_id: Optional[int] = None, day_from: Optional[date] = None,
+                 day_to: Optional[date] = None, entity_type: Optional[str] = None,
+                 by_day: bool = False, limit: int = 20) -> list:
+    """Самые частые сущности: число упоминаний и скриншотов.
+
+    С by_day топ считается отдельно для каждого сотрудника и дня (limit на группу).
+    Фильтры по сотруднику, дню и типу идут по idx_entity_employee_day без чтения текста.
+    """
+    groups = [ScreenshotEntity.employee_id, ScreenshotEntity.day] if by_day else []
+    mentions = func.count().label('mentions')
+    counts = _filtered(
+        select(
+            *groups,
+            ScreenshotEntity.type,
+            ScreenshotEntity.lemma,
+            mentions,
+            func.count(ScreenshotEntity.screenshot_id.distinct()).label('screenshots'),
+        ).group_by(*groups, ScreenshotEntity.type, ScreenshotEntity.lemma),
+        employee_id, day_from, day_to, entity_type
+    )
+
+    if not by_day:
+        rows = db.execute(counts.order_by(mentions.desc(), ScreenshotEntity.lemma).limit(limit))
+        return [dict(row._mapping) for row in rows]
+
+    counts = counts.subquery()
+    ranked = select(
+        counts,
+        func.row_number().over(
+            partition_by=(counts.c.employee_id, counts.c.day),
+            order_by=(counts.c.mentions.desc(), counts.c.lemma)
+        ).label('position')
+    ).subquery()
+    rows = db.execute(
+        select(ranked).where(ranked.c.position <= limit)
+        .order_by(ranked.c.day, ranked.c.employee_id, ranked.c.position)
+    )
+    return [dict(row._mapping) for row in rows]
+
+
+def screenshots_with_entity(db, lemma: str, entity_type: Optional[str] = None, employee_id: Optional[int] = None,
+                            day_from: Optional[date] = None, day_to: Optional[date] = None,
+                            limit: int = 50) -> list:
+    """Скриншоты, где упоминается сущность (например, организация), по индексу type/lemma"""
+    statement = _filtered(
+        select(
+            Screenshot.id, Screenshot.insider_id, Screenshot.employee_id, Screenshot.captured_at,
+            Screenshot.processed_at, func.count().label('mentions'),
+        )
+        .select_from(ScreenshotEntity)
+        .join(Screenshot, Screenshot.id == ScreenshotEntity.screenshot_id)
+        .where(ScreenshotEntity.lemma == lemma.lower())
+        .group_by(Screenshot.id)
+        .order_by(Screenshot.id.desc())
+        .limit(limit),
+        employee_id, day_from, day_to, entity_type
+    )
+    return [dict(row._mapping) for row in db.execute(statement)]
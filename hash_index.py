@@ -0,0 +1,157 @@
+# -индекс перцептивных хешей для поиска почти одинаковых скриншотов
+import threading
+from loguru import logger
+from config import IMAGE_HASH_ALGORITHM, NEAR_DUPLICATE_DISTANCE
+from models import Screenshot
+
+
+def to_signed64(value: int) -> int:
+    """64-битный хеш в знаковое целое для хранения в INTEGER/BIGINT"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def from_signed64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """BK-дерево по расстоянию Хэмминга: поиск хешей в радиусе k без полного перебора"""
+
+    def __init__(self):
+        # Узел: [хеш, данные, {расстояние: дочерний узел}]
+        self.root = None
+        self.size = 0
+
+    def add(self, value: int, payload) -> bool:
+        if self.root is None:
+            self.root = [value, payload, {}]
+            self.size = 1
+            return True
+
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return False
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, payload, {}]
+                self.size += 1
+                return True
+            node = child
+
+    def search(self, value: int, max_distance: int) -> list:
+        """Все (расстояние, данные) в радиусе max_distance"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[1]))
+            # По неравенству треугольника нужны только ветви в [d - k, d + k]
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return found
+
+    def find(self, value: int, max_distance: int):
+        """Ближайший найденный элемент в радиусе max_distance или None"""
+        found = self.search(value, max_distance)
+        if not found:
+            return None
+        return min(found, key=lambda item: item[0])[1]
+
+
+class NearDuplicateIndex:
+    """Потокобезопасный индекс хешей сохранённых скриншотов.
+
+    Хеши скриншотов, которые ещё обрабатываются, лежат отдельно в резерве: в дерево они
+    попадают только после записи скриншота в базу (confirm), а при неудаче снимаются
+    (release). Кадры, признанные дубликатами снятого хеша, возвращаются вызывающему,
+    чтобы их можно было обработать заново.
+    """
+
+    def __init__(self, max_distance: int = NEAR_DUPLICATE_DISTANCE, algorithm: str = IMAGE_HASH_ALGORITHM):
+        self.max_distance = max_distance
+        self.algorithm = algorithm
+        self._tree = BKTree()
+        self._pending = {}  # insider_id -> хеш скриншота в обработке
+        self._dependents = {}  # insider_id в обработке -> дубликаты, найденные по его хешу
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._tree.size
+
+    def load(self, session):
+        """Перестраивает индекс по хешам из базы; резерв сохраняется"""
+        tree = BKTree()
+        query = session.query(
+            Screenshot.insider_id, Screenshot.image_hash, Screenshot.hash_value, Screenshot.hash_algorithm
+        ).yield_per(10000)
+        for insider_id, image_hash, hash_value, algorithm in query:
+            # Записи без алгоритма созданы до появления индекса и хешированы aHash
+            if (algorithm or 'ahash') != self.algorithm:
+                continue
+            if hash_value is not None:
+                tree.add(from_signed64(hash_value), insider_id)
+            elif image_hash:
+                tree.add(int(image_hash, 16), insider_id)
+
+        with self._lock:
+            self._tree = tree
+        logger.info(f"Индекс хешей построен: {tree.size} записей, алгоритм {self.algorithm}, радиус {self.max_distance}")
+
+    def find(self, value: int):
+        """insider_id почти одинакового сохранённого скриншота или None"""
+        with self._lock:
+            return self._tree.find(value, self.max_distance)
+
+    def check_and_reserve(self, value: int, payload):
+        """Атомарно ищет почти одинаковый хеш среди сохранённых и обрабатываемых скриншотов.
+
+        Возвращает insider_id найденного скриншота или None; во втором случае хеш payload
+        резервируется до confirm или release. Собственный хеш payload (повторная попытка)
+        дубликатом не считается.
+        """
+        with self._lock:
+            if payload in self._pending:
+                return None
+            found = [item for item in self._tree.search(value, self.max_distance) if item[1] != payload]
+            if found:
+                return min(found, key=lambda item: item[0])[1]
+            for other, other_value in self._pending.items():
+                if hamming_distance(value, other_value) <= self.max_distance:
+                    self._dependents.setdefault(other, []).append(payload)
+                    return other
+            self._pending[payload] = value
+            return None
+
+    def reserve(self, value: int, payload):
+        """Резервирует хеш, уже проверенный на дубликаты (продолжение после сбоя)"""
+        with self._lock:
+            self._pending[payload] = value
+
+    def confirm(self, payloads):
+        """Скриншоты сохранены в базу: их хеши переходят из резерва в дерево"""
+        with self._lock:
+            for payload in payloads:
+                value = self._pending.pop(payload, None)
+                self._dependents.pop(payload, None)
+                if value is not None:
+                    self._tree.add(value, payload)
+
+    def release(self, payload) -> list:
+        """Снимает резерв неудавшегося скриншота; возвращает кадры, отброшенные как его дубликаты"""
+        with self._lock:
+            self._pending.pop(payload, None)
+            return self._dependents.pop(payload, [])
+
+    def waiting(self) -> set:
+        """Кадры, отброшенные как дубликаты ещё не сохранённых скриншотов"""
+        with self._lock:
+            return {payload for dependents in self._dependents.values() for payload in dependents}
@@ -0,0 +1,86 @@
+# -предобработка кадра перед OCR: оттенки серого, уменьшение, контраст и бинаризация
+import cv2
+import numpy as np
+from config import (
+    OCR_PREPROCESS_PROFILE,
+    OCR_PREPROCESS_GRAYSCALE,
+    OCR_PREPROCESS_MAX_SIDE,
+    OCR_PREPROCESS_BINARIZE
+)
+
+# Профили от качества к скорости; max_side - длинная сторона кадра, которую видит детектор
+PROFILES = {
+    'off': {'grayscale': False, 'max_side': 0, 'binarize': 'none'},
+    'quality': {'grayscale': True, 'max_side': 2560, 'binarize': 'none'},
+    'balanced': {'grayscale': True, 'max_side': 1920, 'binarize': 'contrast'},
+    'fast': {'grayscale': True, 'max_side': 1280, 'binarize': 'otsu'},
+}
+
+BINARIZE_MODES = ('none', 'contrast', 'otsu', 'adaptive')
+
+# Средняя яркость, ниже которой кадр считается тёмной темой и инвертируется
+DARK_THEME_BRIGHTNESS = 110
+
+
+class ImagePreprocessor:
+    """Готовит кадр для OCR и возвращает коэффициент масштаба для пересчёта рамок"""
+
+    def __init__(self, profile: str = OCR_PREPROCESS_PROFILE, grayscale: bool = OCR_PREPROCESS_GRAYSCALE,
+                 max_side: int = OCR_PREPROCESS_MAX_SIDE, binarize: str = OCR_PREPROCESS_BINARIZE):
+        if profile not in PROFILES:
+            raise ValueError(f"Неизвестный профиль предобработки: {profile}. Доступны: {', '.join(PROFILES)}")
+        settings = PROFILES[profile]
+        self.profile = profile
+        # Отдельные настройки из окружения переопределяют профиль
+        self.grayscale = settings['grayscale'] if grayscale is None else grayscale
+        self.max_side = settings['max_side'] if max_side is None else max_side
+        self.binarize = settings['binarize'] if binarize is None else binarize
+        if self.binarize not in BINARIZE_MODES:
+            raise ValueError(f"Неизвестный режим бинаризации: {self.binarize}")
+        if self.binarize != 'none':
+            # Бинаризация и контраст работают с яркостью
+            self.grayscale = True
+
+    @property
+    def enabled(self) -> bool:
+        return self.grayscale or self.max_side > 0 or self.binarize != 'none'
+
+    @property
+    def version(self) -> str:
+        """Строка настроек для ключа кэша OCR"""
+        return f"{int(self.grayscale)}:{self.max_side}:{self.binarize}"
+
+    def apply(self, image: np.ndarray):
+        """(обработанный кадр, масштаб относительно исходного)"""
+        scale = 1.0
+        height, width = image.shape[:2]
+        if self.max_side and max(height, width) > self.max_side:
+            scale = self.max_side / max(height, width)
+            image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+        if self.grayscale and image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        if self.binarize != 'none':
+            # Светлый текст на тёмной теме переводится в тёмный на светлом
+            if image.mean() < DARK_THEME_BRIGHTNESS:
+                image = cv2.bitwise_not(image)
+            if self.binarize == 'contrast':
+                image = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(image)
+            elif self.binarize == 'otsu':
+                _, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+            elif self.binarize == 'adaptive':
+                image = cv2.adaptiveThreshold(
+                    image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15
+                )
+        return image, scale
+
+    @staticmethod
+    def rescale(detections: list, scale: float) -> list:
+        """Пересчитывает рамки из координат обработанного кадра в координаты исходного"""
+        if scale == 1.0:
+            return detections
+        return [
+            [[[x / scale, y / scale] for x, y in detection[0]], *detection[1:]]
+            for detection in detections
+        ]
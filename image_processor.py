@@ -1,4 +1,3 @@
-import easyocr
 import cv2
 import numpy as np
 from natasha import (
@@ -8,47 +7,311 @@ from natasha import (
     NewsMorphTagger,
     NewsSyntaxParser,
     NewsNERTagger,
+    DatesExtractor,
     Doc
 )
+from natasha.doc import DocSpan
 from loguru import logger
 from PIL import Image
 import re
 import os
 from difflib import get_close_matches
-from config import TEMP_DIR 
+from config import (
+    TEMP_DIR,
+    SAVE_ANNOTATED_IMAGES,
+    ANNOTATED_DIR,
+    IMAGE_HASH_ALGORITHM,
+    REGION_DIFF_ENABLED,
+    REGION_DIFF_TILE_SIZE,
+    REGION_DIFF_PIXEL_THRESHOLD,
+    REGION_DIFF_MAX_CHANGED_RATIO,
+    REGION_DIFF_FULL_EVERY,
+    REGION_DIFF_MAX_FRAMES,
+    OCR_CACHE_ENABLED,
+    OCR_CACHE_VERSION,
+    OCR_IMAGE_BATCH,
+    NLP_SYNTAX_ENABLED,
+    NLP_APPEND_SUMMARY,
+    ENTITY_MAX_LENGTH,
+    SPELL_CACHE_SIZE,
+    SPELL_CACHE_PATH,
+    TEXT_REGION_ENABLED
+)
+from ocr_cache import OCRResultCache, content_digest
+from ocr_engine import create_ocr_engine
+from text_regions import TextRegionDetector
+from image_preprocessing import ImagePreprocessor
+from lazy_loader import LazyModel, preload as preload_models
+import threading
+from collections import OrderedDict
 import hashlib 
+import json
+import time
 from pyaspeller import YandexSpeller
 import hunspell
 
+class AnalysisResult(str):
+    """Итоговый текст скриншота и извлечённые из него сущности.
+
+    Остаётся строкой, поэтому кэш, пул процессов и проверки на пустой текст работают
+    с ним как раньше; ScreenshotWriter записывает entities в таблицу screenshot_entities.
+    """
+
+    def __new__(cls, text: str, entities: list = None):
+        result = super().__new__(cls, text)
+        result.entities = entities or []
+        return result
+
+    def __reduce__(self):
+        # Результаты возвращаются из пула процессов через pickle
+        return AnalysisResult, (str(self), self.entities)
+
+
+class MergedDetections(list):
+    """Результаты OCR кадра, собранные из изменившихся областей и блоков предыдущего кадра.
+
+    Они приблизительны, поэтому в кэш OCR по содержимому кадра не записываются.
+    """
+
+
 class ImageProcessor:
     
     def __init__(self):
         with open('ru.txt', 'r', encoding='utf-8') as f:
             self.custom_vocab = [line.strip().lower() for line in f]
 
-        self.reader = easyocr.Reader(
-            lang_list=['ru', 'en'],
-            gpu=True
-            )
-        
-        
+        self.preprocessor = ImagePreprocessor()
         self.segmenter = Segmenter()
-        self.morph_vocab = MorphVocab()
-        self.emb = NewsEmbedding()
-        self.morph_tagger = NewsMorphTagger(self.emb)
-        self.syntax_parser = NewsSyntaxParser(self.emb)
-        self.ner_tagger = NewsNERTagger(self.emb)
+
+        # Модели загружаются при первом обращении или заранее через preload()
+        self._ocr_engine = LazyModel("движок OCR", self._create_ocr_engine)
+        self._region_detector = LazyModel("поиск областей текста", TextRegionDetector) if TEXT_REGION_ENABLED else None
+        self._morph_vocab = LazyModel("словарь pymorphy", MorphVocab)
+        self._emb = LazyModel("эмбеддинги Natasha", NewsEmbedding)
+        self._morph_tagger = LazyModel("морфология Natasha", lambda: NewsMorphTagger(self.emb))
+        self._syntax_parser = LazyModel("синтаксис Natasha", lambda: NewsSyntaxParser(self.emb))
+        self._ner_tagger = LazyModel("NER Natasha", lambda: NewsNERTagger(self.emb))
+        self._dates_extractor = LazyModel("даты Natasha", lambda: DatesExtractor(self.morph_vocab))
+        self._text_corrector = LazyModel("словари Hunspell", lambda: self.TextCorrector(
+            './pn/ru_RU.dic', './pn/ru_RU.aff', './pn/en_US.dic', './pn/en_US.aff',
+            custom_vocab=self.custom_vocab
+        ))
+        self._ocr_cache = LazyModel("кэш OCR", lambda: OCRResultCache(self.cache_version())) if OCR_CACHE_ENABLED else None
 
         self.temp_dir = TEMP_DIR
+        self.annotated_dir = ANNOTATED_DIR
+        # Предыдущий кадр сотрудника: ключ -> (серое изображение, результаты OCR, кадров с полного распознавания)
+        self._previous_frames = OrderedDict()
+        self._frames_lock = threading.Lock()
         self.allowlist = 'АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюяABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_,.?!:;/()@_&%+–—"\''
-        self.textCorrector = self.TextCorrector('./pn/ru_RU.dic', './pn/ru_RU.aff', './pn/en_US.dic', './pn/en_US.aff')
-        
-    def data_in_image(self, image_path: str) -> dict:
+
+    def _create_ocr_engine(self):
+        engine = create_ocr_engine()
+        if self.preprocessor.max_side:
+            # Детектор не должен заново увеличивать уменьшенный кадр
+            engine.canvas_size = self.preprocessor.max_side
+        return engine
+
+    def preload(self, wait: bool = False):
+        """Параллельно загружает все модели; без wait - в фоновом потоке"""
+        return preload_models([
+            self._ocr_engine, self._region_detector, self._morph_vocab, self._emb,
+            self._morph_tagger, self._syntax_parser, self._ner_tagger, self._dates_extractor,
+            self._text_corrector, self._ocr_cache
+        ], wait=wait)
+
+    def loaded(self, name: str) -> bool:
+        """Загружена ли модель (ocr_engine, text_corrector, ocr_cache, ...), без её загрузки"""
+        model = getattr(self, f'_{name}', None)
+        return model is not None and model.loaded
+
+    @property
+    def ocr_engine(self):
+        return self._ocr_engine.get()
+
+    @property
+    def region_detector(self):
+        return self._region_detector.get() if self._region_detector is not None else None
+
+    @property
+    def morph_vocab(self):
+        return self._morph_vocab.get()
+
+    @property
+    def emb(self):
+        return self._emb.get()
+
+    @property
+    def morph_tagger(self):
+        return self._morph_tagger.get()
+
+    @property
+    def syntax_parser(self):
+        return self._syntax_parser.get()
+
+    @property
+    def ner_tagger(self):
+        return self._ner_tagger.get()
+
+    @property
+    def dates_extractor(self):
+        return self._dates_extractor.get()
+
+    @property
+    def textCorrector(self):
+        return self._text_corrector.get()
+
+    @property
+    def ocr_cache(self):
+        return self._ocr_cache.get() if self._ocr_cache is not None else None
+
+    @staticmethod
+    def load_image(image) -> np.ndarray:
+        """Возвращает декодированное изображение из пути, байтов или готового массива."""
+        if isinstance(image, np.ndarray):
+            return image
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            decoded = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+        else:
+            decoded = cv2.imread(str(image))
+        if decoded is None:
+            raise ValueError("Не удалось декодировать изображение")
+        return decoded
+
+    def data_in_image(self, image) -> dict:
         """Обнаружение и извлечение текстовых данных из изображения с помощью OCR."""
-        image = cv2.imread(image_path)
-        results = self.reader.readtext(image, paragraph=True)
+        image = self.load_image(image)
+        if self.region_detector is not None:
+            regions = self.region_detector.detect(image)
+            if regions is not None:
+                return self._ocr_regions(image, regions)
+        results = self._readtext(image)
+        return results
+
+    def data_in_images(self, images: list) -> list:
+        """Пакетный OCR: кадры одного размера детектируются и распознаются одним батчем."""
+        images = [self.load_image(image) for image in images]
+        if self.region_detector is not None:
+            # Области текста у каждого кадра свои, батч по кадрам не собрать
+            return [self.data_in_image(image) for image in images]
+        results = [None] * len(images)
+
+        groups = {}
+        for index, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(index)
+
+        for indexes in groups.values():
+            for start in range(0, len(indexes), OCR_IMAGE_BATCH):
+                chunk = indexes[start:start + OCR_IMAGE_BATCH]
+                prepared = [self.preprocessor.apply(images[index]) for index in chunk]
+                batch = self.ocr_engine.readtext_batched([frame for frame, _ in prepared])
+                for index, result, (_, scale) in zip(chunk, batch, prepared):
+                    results[index] = self.preprocessor.rescale(result, scale)
+        return results
+
+
+    def data_in_changed_regions(self, image: np.ndarray, frame_key: str) -> list:
+        """OCR только изменившихся с предыдущего кадра сотрудника областей."""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        with self._frames_lock:
+            previous = self._previous_frames.get(frame_key)
+
+        regions = None
+        if previous is not None and previous[0].shape == gray.shape and previous[2] < REGION_DIFF_FULL_EVERY:
+            regions = self._changed_regions(previous[0], gray, previous[1])
+
+        if regions is None:
+            results = self.data_in_image(image)
+            frames_since_full = 0
+        else:
+            kept = [
+                detection for detection in previous[1]
+                if not any(self._boxes_overlap(self._detection_rect(detection), region) for region in regions)
+            ]
+            found = self._ocr_regions(image, regions)
+            # Порядок чтения как при полном распознавании: сверху вниз, слева направо
+            results = MergedDetections(
+                sorted(kept + found, key=lambda d: (self._detection_rect(d)[1], self._detection_rect(d)[0]))
+            )
+            frames_since_full = previous[2] + 1
+            logger.debug(f"Распознано {len(regions)} изменившихся областей, переиспользовано {len(kept)} блоков текста")
+
+        with self._frames_lock:
+            self._previous_frames[frame_key] = (gray, results, frames_since_full)
+            self._previous_frames.move_to_end(frame_key)
+            while len(self._previous_frames) > REGION_DIFF_MAX_FRAMES:
+                self._previous_frames.popitem(last=False)
         return results
 
+    def _readtext(self, image: np.ndarray) -> list:
+        """OCR кадра после предобработки; рамки возвращаются в координатах исходного кадра."""
+        prepared, scale = self.preprocessor.apply(image)
+        return self.preprocessor.rescale(self.ocr_engine.readtext(prepared), scale)
+
+    def _ocr_regions(self, image: np.ndarray, regions: list) -> list:
+        """OCR прямоугольных областей кадра с пересчётом рамок в координаты всего кадра."""
+        found = []
+        for x0, y0, x1, y1 in regions:
+            for detection in self._readtext(image[y0:y1, x0:x1]):
+                bbox = [[x + x0, y + y0] for x, y in detection[0]]
+                found.append([bbox, *detection[1:]])
+        return found
+
+    def _changed_regions(self, previous: np.ndarray, current: np.ndarray, detections: list) -> list:
+        """Прямоугольники изменившихся плиток; None - изменилось слишком много, нужен полный OCR."""
+        tile = REGION_DIFF_TILE_SIZE
+        height, width = current.shape
+        changed = (cv2.absdiff(previous, current) > REGION_DIFF_PIXEL_THRESHOLD).astype(np.uint8)
+
+        rows, cols = -(-height // tile), -(-width // tile)
+        padded = np.zeros((rows * tile, cols * tile), np.uint8)
+        padded[:height, :width] = changed
+        tiles = padded.reshape(rows, tile, cols, tile).any(axis=(1, 3)).astype(np.uint8)
+
+        if tiles.mean() > REGION_DIFF_MAX_CHANGED_RATIO:
+            return None
+        if not tiles.any():
+            return []
+
+        # Соседние изменившиеся плитки объединяются в одну область
+        tiles = cv2.dilate(tiles, np.ones((3, 3), np.uint8))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(tiles, connectivity=8)
+        regions = []
+        for x, y, w, h, _ in stats[1:count]:
+            region = [x * tile, y * tile, min((x + w) * tile, width), min((y + h) * tile, height)]
+            # Блок текста, задетый изменением, распознаётся целиком
+            for detection in detections:
+                rect = self._detection_rect(detection)
+                if self._boxes_overlap(rect, region):
+                    region = [min(region[0], rect[0]), min(region[1], rect[1]),
+                              max(region[2], rect[2]), max(region[3], rect[3])]
+            regions.append([max(0, region[0]), max(0, region[1]), min(width, region[2]), min(height, region[3])])
+
+        # После расширения области могут пересечься: сливаем, чтобы текст не распознавался дважды
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a, b = regions[i], regions[j]
+                    if self._boxes_overlap(a, b):
+                        regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return regions
+
+    @staticmethod
+    def _detection_rect(detection) -> list:
+        xs = [int(x) for x, _ in detection[0]]
+        ys = [int(y) for _, y in detection[0]]
+        return [min(xs), min(ys), max(xs), max(ys)]
+
+    @staticmethod
+    def _boxes_overlap(a, b) -> bool:
+        return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
 
     def extract_text(self, results: list) -> str:
         """Извлекает и объединяет текст из результатов OCR."""
@@ -57,9 +320,16 @@ class ImageProcessor:
         return full_text
 
 
-    def selected_text_in_box(self, results: list, image_path: str) -> None:
+    @staticmethod
+    def annotated_path(name: str):
+        """Путь размеченного изображения для записи в базу; None, если размеченные изображения не сохраняются"""
+        if not SAVE_ANNOTATED_IMAGES:
+            return None
+        return os.path.join(ANNOTATED_DIR, f'selected_{name}.jpg')
+
+    def selected_text_in_box(self, results: list, image, name: str) -> None:
         """Рисует рамки вокруг текста и сохраняет изображение."""
-        image = cv2.imread(image_path)
+        image = self.load_image(image).copy()
         
         for detection in results:
             bbox = [[int(x), int(y)] for [x, y] in detection[0]]
@@ -67,67 +337,166 @@ class ImageProcessor:
             bottom_right = tuple(bbox[2])
             cv2.rectangle(image, top_left, bottom_right, (0, 255, 0), 2)
 
-        base_name = os.path.basename(image_path)
-        output_path = os.path.join(self.temp_dir, f'selected_{base_name}')
+        os.makedirs(self.annotated_dir, exist_ok=True)
+        output_path = os.path.join(self.annotated_dir, f'selected_{name}.jpg')
         
         if not cv2.imwrite(output_path, image):
             raise ValueError("Не удалось сохранить изображение")
         
 
-    def process_text(self, text: str) -> str:
-        try:
-            doc = Doc(text)
+    def analyze_documents(self, texts: list, syntax: bool = NLP_SYNTAX_ENABLED) -> list:
+        """Один проход Natasha по пачке текстов: сегментация, морфология, синтаксис и NER.
+
+        Предложения всех текстов размечаются моделями вместе; syntax=False пропускает
+        синтаксический разбор, если нужны только именованные сущности.
+        """
+        docs = [Doc(text) for text in texts]
+        for doc in docs:
             doc.segment(self.segmenter)
-            doc.tag_morph(self.morph_tagger)
-            doc.parse_syntax(self.syntax_parser)
-            doc.tag_ner(self.ner_tagger)
 
-            for span in doc.spans:
-                span.normalize(self.morph_vocab)
+        # Нумерация предложений внутри документа такая же, как в Doc.parse_syntax
+        sents = [(sent_id, sent) for doc in docs for sent_id, sent in enumerate(doc.sents, 1)]
+        chunk = [[token.text for token in sent.tokens] for _, sent in sents]
+        if chunk:
+            for (_, sent), markup in zip(sents, self.morph_tagger.map(chunk)):
+                for token, source in zip(sent.tokens, markup.tokens):
+                    token.pos = source.pos
+                    token.feats = source.feats
 
-            return " ".join([
-                token.text for token in doc.tokens
-                if not token.pos in {'PUNCT', 'SYMB'}
-            ])
-        except Exception as e:
-            logger.error(f"Ошибка при обработке текста: {e}")
-            return text
-        
-    def morphological_analysis(self, text):
-        """Проводит морфологический анализ"""
-        doc = Doc(text)
-        doc.segment(self.segmenter)
-        doc.tag_morph(self.morph_tagger)
-        doc.parse_syntax(self.syntax_parser)
-        doc.tag_ner(self.ner_tagger)
-        
+            if syntax:
+                for (sent_id, sent), markup in zip(sents, self.syntax_parser.map(chunk)):
+                    for token, source in zip(sent.tokens, markup.tokens):
+                        token.id = f'{sent_id}_{source.id}'
+                        token.head_id = f'{sent_id}_{source.head_id}'
+                        token.rel = source.rel
+
+        for doc in docs:
+            doc.spans = []
+        tagged = [doc for doc in docs if doc.text.strip()]
+        if tagged:
+            for doc, markup in zip(tagged, self.ner_tagger.map([doc.text for doc in tagged])):
+                doc.spans = [DocSpan(start, stop, type, doc.text[start:stop]) for start, stop, type in markup.spans]
+                doc.envelop_span_tokens()
+                doc.envelop_sent_spans()
+                for span in doc.spans:
+                    span.normalize(self.morph_vocab)
+        return docs
+
+    def analyze_document(self, text: str, syntax: bool = NLP_SYNTAX_ENABLED):
+        return self.analyze_documents([text], syntax)[0]
+
+    @staticmethod
+    def document_tokens(doc) -> list:
+        """Токены итогового текста (без знаков препинания и символов) и их позиции в нём: (токен, начало, конец)"""
+        kept = []
+        offset = 0
         for token in doc.tokens:
-            token.lemmatize(self.morph_vocab)
-        
+            if token.pos in {'PUNCT', 'SYMB'}:
+                continue
+            kept.append((token, offset, offset + len(token.text)))
+            offset += len(token.text) + 1
+        return kept
+
+    @staticmethod
+    def document_text(doc) -> str:
+        """Текст документа без знаков препинания и символов"""
+        return " ".join(token.text for token, _, _ in ImageProcessor.document_tokens(doc))
+
+    def document_dates(self, doc) -> list:
+        """Даты в тексте документа: (начало, конец, нормальная форма ГГГГ-ММ-ДД, неизвестные части - ?)"""
+        dates = []
+        for match in self.dates_extractor(doc.text):
+            fact = match.fact
+            normal = (f"{fact.year or '????'}-{f'{fact.month:02d}' if fact.month else '??'}-"
+                      f"{f'{fact.day:02d}' if fact.day else '??'}")
+            dates.append((match.start, match.stop, normal))
+        return dates
+
+    def document_summary(self, doc) -> str:
+        """Сводка по сущностям, субъектам и объектам размеченного документа"""
         objects = "Объекты: "
         subjects = "Субъекты: "
         date = "Даты:"
         name = "Имена:"
-        
+
         for span in doc.spans:
-            if span.type == 'PER':  
+            if span.type == 'PER':
                 name += f'{span.text}, '
-            elif span.type == 'LOC': 
+            elif span.type == 'LOC':
                 objects += f'{span.text}, '
-            elif span.type == 'ORG': 
+            elif span.type == 'ORG':
                 subjects += f'{span.text}, '
-            elif span.type == 'DATE':
-                date += f'{span.text}, '
-        
+
+        for start, stop, _ in self.document_dates(doc):
+            date += f'{doc.text[start:stop]}, '
+
+        # Без синтаксического разбора rel не заполнен и остаются только сущности
         for token in doc.tokens:
             if token.rel == 'nsubj':
                 subjects += f'{token.text}, '
-            elif token.rel in ('obj', 'obl'):  
+            elif token.rel in ('obj', 'obl'):
                 objects += f'{token.text}, '
-        
-        results = f"\nМорфологический анализ: {objects}; {subjects}; {name}; {date}."
-        
-        return results
+
+        return f"\nМорфологический анализ: {objects}; {subjects}; {name}; {date}."
+
+    def document_entities(self, doc) -> list:
+        """Именованные сущности, даты и субъекты/объекты документа с нормальными формами.
+
+        start/stop - позиции в итоговом тексте (document_text), а не в исходном doc.text;
+        сущность, от которой в итоговом тексте ничего не осталось, пропускается.
+        """
+        kept = self.document_tokens(doc)
+        text = " ".join(token.text for token, _, _ in kept)
+        entities = []
+        for span in doc.spans:
+            entities.append(self._entity(span.type, text, kept, span.start, span.stop, span.normal or span.text))
+        for start, stop, normal in self.document_dates(doc):
+            entities.append(self._entity('DATE', text, kept, start, stop, normal))
+
+        # Без синтаксического разбора rel не заполнен и остаются только сущности
+        for token, _, _ in kept:
+            if token.rel == 'nsubj':
+                entity_type = 'SUBJ'
+            elif token.rel in ('obj', 'obl'):
+                entity_type = 'OBJ'
+            else:
+                continue
+            token.lemmatize(self.morph_vocab)
+            entities.append(self._entity(entity_type, text, kept, token.start, token.stop, token.lemma or token.text))
+        return [entity for entity in entities if entity is not None]
+
+    @staticmethod
+    def _entity(entity_type: str, text: str, kept: list, start: int, stop: int, lemma: str) -> dict:
+        # Позиции в doc.text пересчитываются в позиции итогового текста по токенам внутри сущности
+        inside = [(token_start, token_stop) for token, token_start, token_stop in kept
+                  if token.start >= start and token.stop <= stop]
+        if not inside:
+            return None
+        start, stop = inside[0][0], inside[-1][1]
+        return {
+            'type': entity_type,
+            'text': text[start:stop][:ENTITY_MAX_LENGTH],
+            'lemma': lemma.lower()[:ENTITY_MAX_LENGTH],
+            'start': start,
+            'stop': stop,
+        }
+
+    def analysis_result(self, doc) -> AnalysisResult:
+        text = self.document_text(doc)
+        if NLP_APPEND_SUMMARY:
+            text += self.document_summary(doc)
+        return AnalysisResult(text, self.document_entities(doc))
+
+    def process_text(self, text: str) -> str:
+        try:
+            return self.document_text(self.analyze_document(text))
+        except Exception as e:
+            logger.error(f"Ошибка при обработке текста: {e}")
+            return text
+
+    def morphological_analysis(self, text):
+        """Проводит морфологический анализ"""
+        return self.document_summary(self.analyze_document(text))
 
     def clean_ocr_text(self, text: str) -> str:
         text = re.sub(r'(\w)-\s*(\w)', r'\1\2', text)
@@ -147,23 +516,49 @@ class ImageProcessor:
             text = re.sub(pattern, fix, text, flags=re.IGNORECASE)
         return text.strip()
 
-    def calculate_image_hash(self, image_path: str) -> str:
+    @staticmethod
+    def _hash_bits_to_int(bits: np.ndarray) -> int:
+        return int.from_bytes(np.packbits(bits.flatten()).tobytes(), 'big')
+
+    @staticmethod
+    def average_hash(gray: np.ndarray) -> int:
+        """aHash: пиксели 8x8 ярче среднего"""
+        img = cv2.resize(gray, (8, 8))
+        return ImageProcessor._hash_bits_to_int(img > img.mean())
+
+    @staticmethod
+    def difference_hash(gray: np.ndarray) -> int:
+        """dHash: знак разности соседних пикселей по горизонтали на сетке 9x8"""
+        img = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+        return ImageProcessor._hash_bits_to_int(img[:, 1:] > img[:, :-1])
+
+    @staticmethod
+    def perceptual_hash(gray: np.ndarray) -> int:
+        """pHash: низкочастотные коэффициенты DCT 8x8 больше медианы"""
+        img = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+        low = cv2.dct(img)[:8, :8]
+        return ImageProcessor._hash_bits_to_int(low > np.median(low.flatten()[1:]))
+
+    @staticmethod
+    def calculate_image_hash(image, algorithm: str = IMAGE_HASH_ALGORITHM) -> str:
         """Вычисляет хеш изображения для определения дубликатов"""
         try:
-            img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-            if img is None:
-                raise ValueError(f"Не удалось прочитать изображение: {image_path}")
-                
-            img = cv2.resize(img, (8, 8))
-            avg = img.mean()
-            hash_bits = img > avg
-            hash_str = ''.join(['1' if bit else '0' for bit in hash_bits.flatten()])
-            hash_hex = hex(int(hash_str, 2))[2:].zfill(16)
-            
-            return hash_hex
+            img = ImageProcessor.load_image(image)
+            if img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+            hash_functions = {
+                'ahash': ImageProcessor.average_hash,
+                'dhash': ImageProcessor.difference_hash,
+                'phash': ImageProcessor.perceptual_hash,
+            }
+            if algorithm not in hash_functions:
+                raise ValueError(f"Неизвестный алгоритм хеширования: {algorithm}")
+
+            return format(hash_functions[algorithm](img), '016x')
             
         except Exception as e:
-            logger.error(f"Ошибка при вычислении хеша изображения {image_path}: {e}")
+            logger.error(f"Ошибка при вычислении хеша изображения: {e}")
             return None
             
     def is_duplicate(self, image_path: str, image_hash: str) -> bool:
@@ -178,40 +573,160 @@ class ImageProcessor:
             logger.error(f"Ошибка при проверке дубликата {image_path}: {e}")
             return False
 
-    def process_image(self, image_path: str) -> str:
-        """Обрабатывает изображение и возвращает распознанный текст"""
-        try:
-            if not os.path.exists(image_path):
-                raise FileNotFoundError(f"Файл не найден: {image_path}")
-            file_size = os.path.getsize(image_path)
-            image_hash = self.calculate_image_hash(image_path)
-            if not image_hash:
-                raise ValueError("Не удалось вычислить хеш изображения")
+    def cache_version(self) -> str:
+        """Ключ версии кэша OCR: при смене моделей или настроек старые записи не используются"""
+        version = f"{OCR_CACHE_VERSION}:{self.ocr_engine.version}"
+        if self.preprocessor.enabled:
+            version += f":prep-{self.preprocessor.version}"
+        if self.region_detector is not None:
+            version += f":regions-{self.region_detector.version}"
+        # Вид итогового текста: со сводкой анализа или без (сущности хранятся отдельно)
+        version += ":summary" if NLP_APPEND_SUMMARY else ":entities-v2"
+        return version
 
-            
-            data = self.data_in_image(image_path)
-            text = self.extract_text(data)
+    def cached_result(self, image: np.ndarray):
+        """(digest, итоговый текст с сущностями из кэша или None)"""
+        if self.ocr_cache is None:
+            return None, None
+        digest = content_digest(image)
+        cached = self.ocr_cache.get(digest)
+        if not cached:
+            return digest, None
+        processed_text, _, entities = cached
+        return digest, AnalysisResult(processed_text, entities) if processed_text else None
 
-            self.selected_text_in_box(data, image_path)
-            raw_text = self.clean_ocr_text(text)
-            
-            corrected_text_tesseract = self.textCorrector.correct_text(raw_text)
-            processed_text_tesseract = self.process_text(corrected_text_tesseract)
-            morh_text = self.morphological_analysis(processed_text_tesseract)
+    def store_result(self, digest: str, processed_text: str, detections: list):
+        # Текст, собранный по изменившимся областям, не подставляется другим кадрам с тем же содержимым
+        if isinstance(detections, MergedDetections):
+            return
+        if self.ocr_cache is not None and digest and processed_text:
+            self.ocr_cache.put(digest, processed_text, detections, getattr(processed_text, 'entities', None))
+
+    def ocr_detections(self, image, name: str = None, frame_key: str = None) -> list:
+        """OCR-этап: результаты распознавания (рамка, текст) для изображения.
+
+        frame_key (например, ID сотрудника) включает распознавание только изменившихся областей.
+        """
+        if name is None and isinstance(image, (str, os.PathLike)):
+            name = os.path.splitext(os.path.basename(image))[0]
+        image = self.load_image(image)
+        if REGION_DIFF_ENABLED and frame_key is not None:
+            data = self.data_in_changed_regions(image, frame_key)
+        else:
+            data = self.data_in_image(image)
+
+        # Диск используется только если размеченные изображения явно запрошены
+        if SAVE_ANNOTATED_IMAGES:
+            self.selected_text_in_box(data, image, name or 'image')
+        return data
 
-            processed_text_tesseract += morh_text
+    def ocr_detections_batch(self, images: list, names: list = None) -> list:
+        """OCR-этап для пачки изображений: результаты распознавания для каждого."""
+        images = [self.load_image(image) for image in images]
+        names = names or [None] * len(images)
+        results = self.data_in_images(images)
+        if SAVE_ANNOTATED_IMAGES:
+            for data, image, name in zip(results, images, names):
+                self.selected_text_in_box(data, image, name or 'image')
+        return results
+
+    def recognize_image(self, image, name: str = None, frame_key: str = None) -> str:
+        """OCR-этап: распознаёт текст на изображении и возвращает очищенный текст"""
+        data = self.ocr_detections(image, name, frame_key)
+        return self.clean_ocr_text(self.extract_text(data))
+
+    def analyze_text(self, raw_text: str) -> str:
+        """NLP-этап: исправляет орфографию и проводит лингвистический анализ текста"""
+        return self.analyze_texts([raw_text])[0]
 
-            return processed_text_tesseract
+    def analyze_texts(self, raw_texts: list) -> list:
+        """NLP-этап для пачки текстов: один проход Natasha на все тексты"""
+        corrected = [self.textCorrector.correct_text(raw_text) for raw_text in raw_texts]
+        try:
+            docs = self.analyze_documents(corrected)
         except Exception as e:
-            logger.error(f"Ошибка при обработке изображения {image_path}: {e}")
+            if len(corrected) == 1:
+                raise
+            # Ошибка в одном тексте не должна терять всю пачку
+            logger.warning(f"Пакетный анализ текста не удался, обработка по одному: {e}")
+            docs = []
+            for text in corrected:
+                try:
+                    docs.append(self.analyze_document(text))
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке текста: {e}")
+                    docs.append(None)
+        return [self.analysis_result(doc) if doc else None for doc in docs]
+
+    def process_image(self, image, name: str = None, frame_key: str = None) -> str:
+        """Обрабатывает изображение (путь, байты или массив) и возвращает распознанный текст"""
+        try:
+            if isinstance(image, (str, os.PathLike)) and not os.path.exists(image):
+                raise FileNotFoundError(f"Файл не найден: {image}")
+
+            if name is None and isinstance(image, (str, os.PathLike)):
+                name = os.path.splitext(os.path.basename(image))[0]
+            image = self.load_image(image)
+            digest, processed_text = self.cached_result(image)
+            if processed_text:
+                return processed_text
+
+            data = self.ocr_detections(image, name, frame_key)
+            processed_text = self.analyze_text(self.clean_ocr_text(self.extract_text(data)))
+            self.store_result(digest, processed_text, data)
+            return processed_text
+        except Exception as e:
+            label = name or (image if isinstance(image, (str, os.PathLike)) else '')
+            logger.error(f"Ошибка при обработке изображения {label}: {e}")
             return None
 
-    def cleanup(self):
+    def process_images(self, images: list, names: list = None) -> list:
+        """Пакетная обработка: итоговый текст для каждого изображения (None при ошибке)"""
+        names = names or [None] * len(images)
+        results = [None] * len(images)
+        pending = []
+        for index, (image, name) in enumerate(zip(images, names)):
+            try:
+                image = self.load_image(image)
+            except ValueError as e:
+                logger.error(f"Ошибка при обработке изображения {name or index}: {e}")
+                continue
+            digest, processed_text = self.cached_result(image)
+            if processed_text:
+                results[index] = processed_text
+            else:
+                pending.append((index, image, name, digest))
+
+        if not pending:
+            return results
+
+        try:
+            batch = self.ocr_detections_batch([item[1] for item in pending], [item[2] for item in pending])
+        except Exception as e:
+            # При сбое пакетного OCR обрабатываем изображения по одному
+            logger.warning(f"Пакетный OCR не удался, обработка по одному: {e}")
+            for index, image, name, _ in pending:
+                results[index] = self.process_image(image, name)
+            return results
+
+        try:
+            texts = self.analyze_texts([self.clean_ocr_text(self.extract_text(data)) for data in batch])
+        except Exception as e:
+            logger.error(f"Ошибка при анализе текста пачки изображений: {e}")
+            return results
+
+        for (index, _, name, digest), data, processed_text in zip(pending, batch, texts):
+            self.store_result(digest, processed_text, data)
+            results[index] = processed_text
+        return results
+
+    @staticmethod
+    def cleanup(temp_dir=TEMP_DIR):
         """Очищает временные файлы"""
         
         try:
-            for file in os.listdir(self.temp_dir):
-                file_path = os.path.join(self.temp_dir, file)
+            for file in os.listdir(temp_dir):
+                file_path = os.path.join(temp_dir, file)
                 try:
                     if os.path.isfile(file_path):
                         os.remove(file_path)
@@ -221,35 +736,122 @@ class ImageProcessor:
             logger.error(f"Ошибка при очистке временных файлов: {e}")
 
 
-    class TextCorrector: 
-            def __init__(self, dic_path_ru, aff_path_ru, dic_path_en, aff_path_en):
+    class TextCorrector:
+            """Исправление орфографии Hunspell с общим LRU-кэшем слово -> исправление"""
+
+            # Числа, идентификаторы, почта и пути не исправляются
+            SKIP_PATTERN = re.compile(r'[\d@/_#]|^\W+$')
+
+            def __init__(self, dic_path_ru, aff_path_ru, dic_path_en, aff_path_en, custom_vocab=None,
+                         cache_size: int = SPELL_CACHE_SIZE, cache_path=SPELL_CACHE_PATH):
                 self.hunspell_ru = hunspell.HunSpell(dic_path_ru, aff_path_ru)
                 self.hunspell_en = hunspell.HunSpell(dic_path_en, aff_path_en)
+                custom_vocab = [word for word in (custom_vocab or []) if word]
+                for word in custom_vocab:
+                    (self.hunspell_ru if self.is_russian(word) else self.hunspell_en).add(word)
 
-            def correct_vocub(self, text: str) -> str:
-                words = text.split()
-                corrected = []
+                self.cache_size = cache_size
+                self.cache_path = cache_path
+                self._cache = OrderedDict()
+                # Hunspell не потокобезопасен, поэтому общий замок и на кэш, и на словари
+                self._lock = threading.Lock()
+                self.hits = 0
+                self.misses = 0
+                self.skipped = 0
+                self.lookup_time = 0.0
+
+                # Кэш годится, только пока не изменились словари и пользовательский словарь
+                version = hashlib.md5('\n'.join(sorted(custom_vocab)).encode())
+                for path in (dic_path_ru, aff_path_ru, dic_path_en, aff_path_en):
+                    version.update(str(os.path.getsize(path)).encode())
+                self.version = version.hexdigest()
+                if cache_path:
+                    self.load()
+
+            def _lookup(self, word: str) -> str:
+                speller = self.hunspell_ru if self.is_russian(word) else self.hunspell_en
+                if speller.spell(word):
+                    return word
+                suggestions = speller.suggest(word)
+                return suggestions[0] if suggestions else word
+
+            def correct_word(self, word: str) -> str:
+                if self.SKIP_PATTERN.search(word):
+                    self.skipped += 1
+                    return word
 
-                for word in words:
-                    if self.is_russian(word):
-                        if self.hunspell_ru.spell(word):
-                            corrected.append(word)
-                        else:
-                            suggestions = self.hunspell_ru.suggest(word)
-                            corrected.append(suggestions[0] if suggestions else word)
-                    else:
-                        if self.hunspell_en.spell(word):
-                            corrected.append(word)
-                        else:
-                            suggestions = self.hunspell_en.suggest(word)
-                            corrected.append(suggestions[0] if suggestions else word)
+                with self._lock:
+                    correction = self._cache.get(word)
+                    if correction is not None:
+                        self._cache.move_to_end(word)
+                        self.hits += 1
+                        return correction
 
-                return ' '.join(corrected)
+                    started = time.perf_counter()
+                    correction = self._lookup(word)
+                    self.lookup_time += time.perf_counter() - started
+                    self.misses += 1
 
+                    self._cache[word] = correction
+                    if len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+                return correction
+
+            def correct_text(self, text: str) -> str:
+                # Каждое уникальное слово текста проверяется один раз
+                words = text.split()
+                corrections = {word: self.correct_word(word) for word in dict.fromkeys(words)}
+                return ' '.join(corrections[word] for word in words)
+
+            def correct_vocub(self, text: str) -> str:
+                return self.correct_text(text)
 
             def is_russian(self, word: str) -> bool:
                 return any('а' <= char <= 'я' or 'А' <= char <= 'Я' for char in word)
 
+            def stats(self) -> dict:
+                lookups = self.hits + self.misses
+                return {
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'skipped': self.skipped,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    # Среднее время Hunspell на слово, которого не было в кэше
+                    'miss_ms': self.lookup_time / self.misses * 1000 if self.misses else 0.0,
+                    'size': len(self._cache),
+                }
+
+            def load(self, path=None):
+                """Загружает кэш исправлений с диска, если он построен по тем же словарям"""
+                path = path or self.cache_path
+                if not path or not os.path.exists(path):
+                    return
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Не удалось загрузить кэш орфографии {path}: {e}")
+                    return
+                if data.get('version') != self.version:
+                    logger.info("Словари изменились, кэш орфографии не загружен")
+                    return
+                with self._lock:
+                    for word, correction in data.get('words', [])[-self.cache_size:]:
+                        self._cache[word] = correction
+                logger.info(f"Загружен кэш орфографии: {len(self._cache)} слов")
+
+            def save(self, path=None):
+                """Сохраняет кэш исправлений на диск (от давно использованных к недавним)"""
+                path = path or self.cache_path
+                if not path:
+                    return
+                with self._lock:
+                    data = {'version': self.version, 'words': list(self._cache.items())}
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+
 
 
     """class TextCorrector:
@@ -1,42 +1,142 @@
 # -сервис для работы с API ИНСАЙДЕР
 import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 from loguru import logger
-from config import INSIDER_API_URL, INSIDER_API_KEY, BATCH_SIZE
-from models import Employee, Screenshot
+from config import (
+    INSIDER_API_URL,
+    INSIDER_API_KEY,
+    BATCH_SIZE,
+    SYNC_INITIAL_DAYS,
+    ACTIVITY_USERS_PER_REQUEST,
+    ACTIVITY_USERS_PER_REQUEST_MAX,
+    ACTIVITY_MAX_PAGES_PER_REQUEST,
+    TEMP_DIR,
+    HTTP_POOL_SIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_FACTOR,
+    HTTP_DOWNLOAD_CONCURRENCY,
+    RETENTION_DAYS,
+    CLEANUP_CHUNK_SIZE,
+    CLEANUP_FILE_WORKERS,
+    CLEANUP_VACUUM_PAGES,
+    SQLITE_INCREMENTAL_VACUUM,
+    require_insider_credentials
+)
+from models import Employee, Screenshot, SyncState, ScreenshotEntity
+from sqlalchemy import delete
 from sqlalchemy.orm import Session
 import os
 
+_http_session = None
+_http_session_lock = threading.Lock()
+
+# Ответы API на слишком длинный запрос: только после них пачка сотрудников уменьшается насовсем
+PAYLOAD_TOO_LARGE = (413, 414, 431)
+
+
+def get_http_session() -> requests.Session:
+    """Общая сессия с пулом keep-alive соединений и повторами запросов"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            retry = Retry(
+                total=HTTP_MAX_RETRIES,
+                connect=HTTP_MAX_RETRIES,
+                read=HTTP_MAX_RETRIES,
+                backoff_factor=HTTP_BACKOFF_FACTOR,
+                status_forcelist=(500, 502, 503, 504),
+                # /api/activities/find вызывается через POST, но только читает данные
+                allowed_methods=frozenset({'GET', 'POST'}),
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=retry
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+        return _http_session
+
+
+def activity_time(activity: dict) -> datetime:
+    """Время активности из записи /api/activities/find"""
+    for key in ('date', 'createdAt', 'created_at', 'time', 'startDate'):
+        value = activity.get(key)
+        if not value:
+            continue
+        try:
+            return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            try:
+                return datetime.fromisoformat(value).replace(tzinfo=None)
+            except ValueError:
+                continue
+    return None
+
+
+def activity_user_id(activity: dict) -> str:
+    """ID сотрудника из записи /api/activities/find"""
+    for key in ('userId', 'user_id', 'usersId'):
+        if activity.get(key) is not None:
+            return str(activity[key])
+    user = activity.get('user')
+    if isinstance(user, dict) and user.get('id') is not None:
+        return str(user['id'])
+    return None
+
+
 class InsiderService:
     def __init__(self, db_session: Session):
+        require_insider_credentials()
         self.db = db_session
         self.base_url = INSIDER_API_URL
         self.api_key = INSIDER_API_KEY
+        self.http = get_http_session()
+        self.timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        self.users_per_request = ACTIVITY_USERS_PER_REQUEST
+        self.last_status = None  # HTTP-код последнего неудачного запроса
         
     def _make_request(self, endpoint: str, params: dict = None) -> dict:
         """Выполняет запрос к API ИНСАЙДЕР"""
         if params is None:
             params = {}
         params['key'] = self.api_key
+        self.last_status = None
         
         try:
     
             if endpoint == '/api/activities/find':
-                response = requests.post(f"{self.base_url}{endpoint}", params=params)
+                response = self.http.post(f"{self.base_url}{endpoint}", params=params, timeout=self.timeout)
             else:
-                response = requests.get(f"{self.base_url}{endpoint}", params=params)
+                response = self.http.get(f"{self.base_url}{endpoint}", params=params, timeout=self.timeout)
             
             response.raise_for_status()
             result = response.json()
             logger.debug(f"API Response for {endpoint}: {result}")
             return result
         except requests.exceptions.RequestException as e:
+            if e.response is not None:
+                self.last_status = e.response.status_code
             logger.error(f"Ошибка при запросе к API {endpoint}: {e}")
             return None
 
     def get_employees(self) -> list:
         """Получает список сотрудников"""
         response = self._make_request('/api/users/find')
+        return self._parse_employees(response)
+
+    @staticmethod
+    def _parse_employees(response: dict) -> list:
+        """Преобразует ответ /api/users/find в объекты Employee"""
         if not response or 'data' not in response:
             return []
         
@@ -52,21 +152,10 @@ class InsiderService:
         
         return employees
 
-    def get_screenshots(self, user_id: str, start_date: datetime = None, end_date: datetime = None) -> list:
+    def get_screenshots(self, user_id: str, start_date: datetime = None, end_date: datetime = None,
+                        offset: int = 0) -> list:
         """Получает список скриншотов для сотрудника"""
-        if not start_date:
-            start_date = datetime.now() - timedelta(days=1)
-        if not end_date:
-            end_date = datetime.now()
-            
-        params = {
-            'usersId': user_id,
-            'startDate': start_date.strftime('%Y-%m-%d %H:%M:%S'),
-            'endDate': end_date.strftime('%Y-%m-%d %H:%M:%S'),
-            'type': 'screen',
-            'limit': BATCH_SIZE
-        }
-        
+        params = self._screenshot_params(user_id, start_date, end_date, offset)
         
         logger.info(f"Запрос скриншотов для пользователя {user_id} с параметрами: {params}")
         response = self._make_request('/api/activities/find', params)
@@ -83,27 +172,246 @@ class InsiderService:
         logger.info(f"Получено {len(screenshots)} скриншотов для пользователя {user_id}")
         return screenshots
 
+    def iter_screenshots(self, user_id: str, start_date: datetime = None, end_date: datetime = None):
+        """Постранично получает все скриншоты сотрудника за период"""
+        if not end_date:
+            # Фиксируем конец периода, чтобы новые записи не сдвигали страницы
+            end_date = datetime.now()
+        offset = 0
+        seen = set()
+        while True:
+            page = self.get_screenshots(user_id, start_date, end_date, offset=offset)
+            fresh = [item for item in page if item['data']['file'] not in seen]
+            yield from fresh
+            # Страница неполная или API проигнорировал offset и вернул ту же страницу
+            if len(page) < BATCH_SIZE or not fresh:
+                return
+            seen.update(item['data']['file'] for item in fresh)
+            offset += len(page)
+
+    def get_new_screenshots(self, employee: Employee) -> list:
+        """Получает скриншоты сотрудника, появившиеся после последней синхронизации"""
+        return list(self.iter_screenshots(employee.insider_id, self.sync_start_date(employee)))
+
+    def get_new_screenshots_batch(self, employees: list):
+        """Получает новые скриншоты пачками сотрудников и отдаёт (сотрудник, скриншоты)"""
+        if self.users_per_request <= 1:
+            for employee in employees:
+                yield employee, self.get_new_screenshots(employee)
+            return
+
+        # Близкие отметки синхронизации попадают в одну пачку и дают узкий общий период
+        pending = sorted(
+            ((self.sync_start_date(employee), employee) for employee in employees),
+            key=lambda pair: pair[0]
+        )
+        size = self.users_per_request
+        while pending:
+            if self.users_per_request <= 1:
+                for _, employee in pending:
+                    yield employee, self.get_new_screenshots(employee)
+                return
+            if size <= 1:
+                # Повторы пачкой не удались: первый сотрудник запрашивается отдельно
+                (_, employee), pending = pending[0], pending[1:]
+                yield employee, self.get_new_screenshots(employee)
+                size = self.users_per_request
+                continue
+
+            chunk, rest = pending[:size], pending[size:]
+            grouped = self._fetch_users_chunk(chunk)
+            if grouped is None:
+                if self.last_status in PAYLOAD_TOO_LARGE:
+                    # Запрос слишком длинный: пачка уменьшается для всех следующих запросов
+                    self.users_per_request = max(1, len(chunk) // 2)
+                    size = self.users_per_request
+                    logger.warning(f"Размер пачки сотрудников уменьшен до {self.users_per_request}")
+                else:
+                    # Временная ошибка: меньшей пачкой повторяется только этот запрос
+                    size = max(1, len(chunk) // 2)
+                    logger.warning(f"Запрос пачки из {len(chunk)} сотрудников не удался, повтор пачкой из {size}")
+                continue
+
+            pending = rest
+            # После успешного запроса - снова текущий размер пачки
+            size = self.users_per_request
+            for start_date, employee in chunk:
+                yield employee, [
+                    item for item in grouped.get(employee.insider_id, [])
+                    if (activity_time(item) or start_date) >= start_date
+                ]
+
+    def _fetch_users_chunk(self, chunk: list) -> dict:
+        """Постранично запрашивает активности пачки сотрудников и раскладывает их по сотрудникам"""
+        start_date = chunk[0][0]
+        end_date = datetime.now()
+        user_ids = [employee.insider_id for _, employee in chunk]
+        limit = BATCH_SIZE * len(user_ids)
+
+        grouped = {}
+        seen = set()
+        offset = 0
+        pages = 0
+        while True:
+            params = self._screenshot_params(user_ids, start_date, end_date, offset)
+            params['limit'] = limit
+            response = self._make_request('/api/activities/find', params)
+            if not response or 'data' not in response:
+                return None
+            page = response['data']
+            if not page:
+                break
+            pages += 1
+            fresh = [item for item in page if item['data']['file'] not in seen]
+            for item in fresh:
+                user_id = activity_user_id(item)
+                if user_id is None:
+                    if len(user_ids) > 1:
+                        # Без ID сотрудника в записи разложить ответ нельзя
+                        logger.warning("Ответ API не содержит ID сотрудника, пакетные запросы отключены")
+                        self.users_per_request = 1
+                        return None
+                    user_id = user_ids[0]
+                grouped.setdefault(user_id, []).append(item)
+
+            # API может ограничивать limit сильнее запрошенного, поэтому короткая страница
+            # не означает конец: читаем до пустой страницы или повтора уже полученных записей
+            if not fresh:
+                break
+            seen.update(item['data']['file'] for item in fresh)
+            offset += len(page)
+
+        # Подстройка размера пачки: много страниц - уменьшаем, одна страница - увеличиваем
+        if pages > ACTIVITY_MAX_PAGES_PER_REQUEST:
+            self.users_per_request = max(1, len(user_ids) // 2)
+        elif pages == 1 and len(user_ids) == self.users_per_request:
+            self.users_per_request = min(ACTIVITY_USERS_PER_REQUEST_MAX, self.users_per_request * 2)
+
+        logger.info(f"Получено {sum(map(len, grouped.values()))} скриншотов для {len(user_ids)} сотрудников за {pages} запрос(ов)")
+        return grouped
+
+    def sync_start_date(self, employee: Employee) -> datetime:
+        """Начало периода запроса: отметка последней синхронизации или глубина первой синхронизации"""
+        state = self.db.query(SyncState).filter_by(employee_id=employee.id).first()
+        if state and state.last_activity_at:
+            return state.last_activity_at
+        return datetime.now() - timedelta(days=SYNC_INITIAL_DAYS)
+
+    def save_sync_state(self, employee_id: int, screenshots: list, unfinished: set = None):
+        """Сдвигает отметку синхронизации сотрудника на самую позднюю обработанную активность.
+
+        unfinished - file_id, которые не сохранены и не отброшены как дубликаты. Отметка
+        останавливается на активности перед самым ранним из них, чтобы следующий обход
+        запросил их снова.
+        """
+        activities = [(activity_time(item), item['data']['file']) for item in screenshots]
+        if unfinished:
+            blocked = [item_time for item_time, file_id in activities if file_id in unfinished]
+            if None in blocked:
+                # Место необработанного скриншота во времени неизвестно
+                logger.warning(f"Отметка синхронизации сотрудника {employee_id} не сдвигается: есть необработанные скриншоты")
+                return
+            cutoff = min(blocked)
+            activities = [(item_time, file_id) for item_time, file_id in activities if item_time and item_time < cutoff]
+            logger.info(f"Отметка синхронизации сотрудника {employee_id} остановлена перед {len(blocked)} необработанными скриншотами")
+
+        latest = None
+        for item_time, file_id in activities:
+            if item_time and (latest is None or item_time >= latest[0]):
+                latest = (item_time, file_id)
+        if latest is None:
+            return
+
+        state = self.db.query(SyncState).filter_by(employee_id=employee_id).first()
+        if state is None:
+            state = SyncState(employee_id=employee_id)
+            self.db.add(state)
+        if state.last_activity_at is None or latest[0] >= state.last_activity_at:
+            state.last_activity_at, state.last_file_id = latest
+        self.db.commit()
+
+    @staticmethod
+    def _screenshot_params(user_id, start_date: datetime = None, end_date: datetime = None,
+                           offset: int = 0) -> dict:
+        """Параметры запроса /api/activities/find для скриншотов сотрудника"""
+        if not start_date:
+            start_date = datetime.now() - timedelta(days=1)
+        if not end_date:
+            end_date = datetime.now()
+            
+        return {
+            'usersId': user_id,
+            'startDate': start_date.strftime('%Y-%m-%d %H:%M:%S'),
+            'endDate': end_date.strftime('%Y-%m-%d %H:%M:%S'),
+            'type': 'screen',
+            'order': 'asc',
+            'limit': BATCH_SIZE,
+            'offset': offset
+        }
+
     def download_screenshot(self, file_id: str, save_path: str) -> bool:
         """Скачивает скриншот по его ID"""
         try:
-            response = requests.get(
+            with self.http.get(
                 f"{self.base_url}/api/resources/get",
                 params={'id': file_id, 'key': self.api_key},
-                stream=True
-            )
-            response.raise_for_status()
-            folder_path = os.path.join("image", f"screenshot_{file_id}.jpg")
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+                stream=True,
+                timeout=self.timeout
+            ) as response:
+                response.raise_for_status()
+                with open(save_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        f.write(chunk)
             return True
         except Exception as e:
             logger.error(f"Ошибка при скачивании скриншота {file_id}: {e}")
             return False
 
-    def sync_employees(self):
+    def fetch_screenshot(self, file_id: str) -> bytes:
+        """Скачивает скриншот по его ID в память"""
+        try:
+            response = self.http.get(
+                f"{self.base_url}/api/resources/get",
+                params={'id': file_id, 'key': self.api_key},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            return response.content
+        except Exception as e:
+            logger.error(f"Ошибка при скачивании скриншота {file_id}: {e}")
+            return None
+
+    def download_screenshots(self, file_ids: list, save_dir=TEMP_DIR, max_workers: int = HTTP_DOWNLOAD_CONCURRENCY):
+        """Параллельно скачивает скриншоты и отдаёт результаты по мере готовности.
+
+        С save_dir отдаёт (file_id, путь или None), без него - (file_id, байты или None).
+        """
+        if save_dir is not None:
+            os.makedirs(save_dir, exist_ok=True)
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            futures = {}
+            for file_id in file_ids:
+                if save_dir is None:
+                    futures[executor.submit(self.fetch_screenshot, file_id)] = (file_id, None)
+                else:
+                    save_path = os.path.join(save_dir, f"{file_id}.jpg")
+                    futures[executor.submit(self.download_screenshot, file_id, save_path)] = (file_id, save_path)
+
+            for future in as_completed(futures):
+                file_id, save_path = futures[future]
+                if save_path is None:
+                    yield file_id, future.result()
+                else:
+                    yield file_id, save_path if future.result() else None
+        finally:
+            # Если потребитель прервал перебор, ещё не начатые скачивания отменяются
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def sync_employees(self, employees: list = None):
         """Синхронизирует список сотрудников с базой данных"""
-        employees = self.get_employees()
+        if employees is None:
+            employees = self.get_employees()
         for emp in employees:
             existing = self.db.query(Employee).filter_by(insider_id=emp.insider_id).first()
             if existing:
@@ -115,17 +423,63 @@ class InsiderService:
         self.db.commit()
         logger.info(f"Синхронизировано {len(employees)} сотрудников")
 
-    def cleanup_old_screenshots(self):
-        """Удаляет устаревшие скриншоты из базы данных"""
-        old_date = datetime.now() - timedelta(days=30)
-        old_screenshots = self.db.query(Screenshot).filter(
-            Screenshot.created_at < old_date
-        ).all()
-        
-        for screenshot in old_screenshots:
-            if screenshot.file_path and os.path.exists(screenshot.file_path):
-                os.remove(screenshot.file_path)
-            self.db.delete(screenshot)
-        
-        self.db.commit()
-        logger.info(f"Удалено {len(old_screenshots)} устаревших скриншотов") 
\ No newline at end of file
+    def cleanup_old_screenshots(self, retention_days: int = RETENTION_DAYS, chunk_size: int = CLEANUP_CHUNK_SIZE) -> int:
+        """Удаляет скриншоты старше срока хранения пачками по индексу processed_at"""
+        if retention_days <= 0:
+            return 0
+        old_date = datetime.utcnow() - timedelta(days=retention_days)
+        deleted = 0
+
+        with ThreadPoolExecutor(max_workers=CLEANUP_FILE_WORKERS) as executor:
+            while True:
+                rows = self.db.query(Screenshot.id, Screenshot.file_path).filter(
+                    Screenshot.processed_at < old_date
+                ).order_by(Screenshot.processed_at).limit(chunk_size).all()
+                if not rows:
+                    break
+
+                ids = [row.id for row in rows]
+                # Внешние ключи SQLite не проверяет, поэтому сущности удаляются явно
+                self.db.execute(
+                    delete(ScreenshotEntity).where(ScreenshotEntity.screenshot_id.in_(ids)),
+                    execution_options={'synchronize_session': False}
+                )
+                self.db.execute(
+                    delete(Screenshot).where(Screenshot.id.in_(ids)),
+                    execution_options={'synchronize_session': False}
+                )
+                self.db.commit()
+                deleted += len(rows)
+
+                # Файлы удаляются в фоне, пока выбирается следующая пачка
+                for row in rows:
+                    if row.file_path:
+                        executor.submit(self._remove_file, row.file_path)
+
+        if deleted:
+            self.reclaim_free_pages()
+        logger.info(f"Удалено {deleted} устаревших скриншотов (срок хранения {retention_days} дн.)")
+        return deleted
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Не удалось удалить файл {path}: {e}")
+
+    def reclaim_free_pages(self):
+        """Возвращает освободившиеся страницы SQLite файловой системе (auto_vacuum=INCREMENTAL)"""
+        if self.db.get_bind().dialect.name != 'sqlite' or not SQLITE_INCREMENTAL_VACUUM:
+            return
+        pages = f"({CLEANUP_VACUUM_PAGES})" if CLEANUP_VACUUM_PAGES > 0 else ""
+        raw = self.db.get_bind().raw_connection()
+        try:
+            # executescript выполняет прагму до конца; execute освобождает только одну страницу
+            raw.driver_connection.executescript(f"PRAGMA incremental_vacuum{pages};")
+        except Exception as e:
+            logger.warning(f"Не удалось освободить страницы базы данных: {e}")
+        finally:
+            raw.close()
\ No newline at end of file
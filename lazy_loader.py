@@ -0,0 +1,61 @@
+# -ленивая и фоновая загрузка тяжёлых моделей (OCR, Natasha, Hunspell)
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+
+class LazyModel:
+    """Модель, загружаемая при первом обращении или заранее в фоновом потоке.
+
+    Пока модель загружается, остальные потоки ждут её в get(); при ошибке загрузки
+    следующий get() пробует загрузить её снова.
+    """
+
+    def __init__(self, name: str, factory):
+        self.name = name
+        self._factory = factory
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                # Время включает импорт модулей, которые фабрика подключает при первом вызове
+                started = time.perf_counter()
+                self._value = self._factory()
+                self._loaded = True
+                logger.info(f"Загружено: {self.name} за {time.perf_counter() - started:.2f} с")
+        return self._value
+
+
+def preload(models: list, wait: bool = False):
+    """Загружает модели параллельно; без wait - в фоне, пока идёт синхронизация и скачивание"""
+    models = [model for model in models if model is not None and not model.loaded]
+    if not models:
+        return None
+    started = time.perf_counter()
+
+    def load_all():
+        with ThreadPoolExecutor(max_workers=len(models), thread_name_prefix='preload') as executor:
+            futures = [executor.submit(model.get) for model in models]
+            for model, future in zip(models, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Не удалось загрузить {model.name}: {e}")
+        logger.info(f"Загрузка моделей завершена за {time.perf_counter() - started:.2f} с")
+
+    if wait:
+        load_all()
+        return None
+    thread = threading.Thread(target=load_all, name='model-preload', daemon=True)
+    thread.start()
+    return thread
@@ -1,18 +1,25 @@
-import schedule
 import time
+started = time.perf_counter()
+
 import sys
 from loguru import logger
 from db.database import init_db
 from screenshot_processor import ScreenshotProcessor
+from config import DAEMON_ENABLED
 
 # Настройка логирования
 logger.add("screenshot_processor.log", rotation="1 day", retention="7 days", level="INFO")
 
 if __name__ == "__main__":
     try:
+        logger.info(f"Импорт модулей за {time.perf_counter() - started:.2f} с")
         init_db()
         processor = ScreenshotProcessor()
-        processor.run()
+        logger.info(f"Сервис запущен за {time.perf_counter() - started:.2f} с")
+        if DAEMON_ENABLED:
+            processor.run_daemon()
+        else:
+            processor.run()
     except Exception as e:
         logger.critical(f"Критическая ошибка при запуске программы: {e}")
         sys.exit(1)
\ No newline at end of file
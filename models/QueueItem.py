@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from datetime import datetime
+from db.database import Base
+
+
+class QueueItem(Base):
+    __tablename__ = 'screenshot_queue'
+
+    id = Column(Integer, primary_key=True)
+    insider_id = Column(String(50), unique=True, nullable=False)
+    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False)
+    status = Column(String(16), nullable=False, default='pending')  # pending, leased, done, failed
+    lease_owner = Column(String(100))
+    lease_expires_at = Column(DateTime)
+    attempts = Column(Integer, nullable=False, default=0)
+    not_before = Column(DateTime)  # неудачная задача не выдаётся раньше этого времени
+    captured_at = Column(DateTime)  # время активности скриншота
+    enqueued_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index('idx_queue_status_employee', 'status', 'employee_id', 'id'),
+        Index('idx_queue_lease', 'status', 'lease_expires_at'),
+        Index('idx_queue_owner', 'lease_owner', 'status'),
+    )
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Index
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, ForeignKey, Index, func
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from db.database import Base
@@ -13,16 +14,30 @@ class Screenshot(Base):
     file_path = Column(String(255))
     processed_text = Column(Text)
     image_hash = Column(String(64))  
+    hash_value = Column(BigInteger)  # тот же хеш как знаковое 64-битное целое
+    hash_algorithm = Column(String(16))
     file_size = Column(Integer) 
+    captured_at = Column(DateTime)  # время активности в API ИНСАЙДЕР (когда сделан скриншот)
     processed_at = Column(DateTime, default=datetime.utcnow)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     employee = relationship("Employee", back_populates="screenshots")
+
+    @hybrid_property
+    def activity_at(self):
+        """Время активности; у записей без него - время обработки"""
+        return self.captured_at or self.processed_at
+
+    @activity_at.expression
+    def activity_at(cls):
+        return func.coalesce(cls.captured_at, cls.processed_at)
     
     __table_args__ = (
         Index('idx_screenshot_insider_id', 'insider_id'),
         Index('idx_screenshot_employee_id', 'employee_id'),
         Index('idx_screenshot_processed_at', 'processed_at'),
+        # Фильтры по датам в поиске, выгрузке и просмотрщике идут по времени активности
+        Index('idx_screenshot_activity_at', func.coalesce(captured_at, processed_at)),
         Index('idx_screenshot_image_hash', 'image_hash'),
     )
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, Index
+from db.database import Base
+
+
+class ScreenshotEntity(Base):
+    __tablename__ = 'screenshot_entities'
+
+    id = Column(Integer, primary_key=True)
+    screenshot_id = Column(Integer, ForeignKey('screenshots.id', ondelete='CASCADE'), nullable=False)
+    # Копии полей скриншота: агрегаты по сотруднику и дню читаются из одного индекса
+    employee_id = Column(Integer)
+    day = Column(Date)
+    type = Column(String(8), nullable=False)  # PER, LOC, ORG, DATE, SUBJ, OBJ
+    text = Column(String(255))
+    lemma = Column(String(255), nullable=False)  # нормальная форма в нижнем регистре
+    start = Column(Integer)
+    stop = Column(Integer)
+
+    __table_args__ = (
+        Index('idx_entity_screenshot_id', 'screenshot_id'),
+        Index('idx_entity_type_lemma', 'type', 'lemma'),
+        Index('idx_entity_employee_day', 'employee_id', 'day', 'type', 'lemma'),
+    )
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, Boolean, ForeignKey, Index
+from datetime import datetime
+from db.database import Base
+
+
+class ScreenshotState(Base):
+    __tablename__ = 'screenshot_states'
+
+    id = Column(Integer, primary_key=True)
+    insider_id = Column(String(50), unique=True, nullable=False)
+    employee_id = Column(Integer, ForeignKey('employees.id'))
+    # Последний завершённый этап: discovered, downloaded, recognized, analyzed, stored, duplicate
+    stage = Column(String(16), nullable=False, default='discovered')
+    attempts = Column(Integer, nullable=False, default=0)
+    dead_letter = Column(Boolean, nullable=False, default=False)
+    captured_at = Column(DateTime)  # время активности скриншота
+    last_error = Column(Text)
+    # Результаты завершённых этапов; очищаются после сохранения скриншота
+    image_hash = Column(String(64))
+    hash_value = Column(BigInteger)
+    file_size = Column(Integer)
+    raw_text = Column(Text)
+    processed_text = Column(Text)
+    entities = Column(Text)  # JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index('idx_state_stage', 'dead_letter', 'stage'),
+        Index('idx_state_updated_at', 'updated_at'),
+    )
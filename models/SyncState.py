@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from datetime import datetime
+from db.database import Base
+
+
+class SyncState(Base):
+    __tablename__ = 'sync_state'
+    
+    id = Column(Integer, primary_key=True)
+    employee_id = Column(Integer, ForeignKey('employees.id'), unique=True, nullable=False)
+    last_activity_at = Column(DateTime)
+    last_file_id = Column(String(50))
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_sync_state_employee_id', 'employee_id'),
+    )
@@ -1,2 +1,6 @@
 from .Screenshot import Screenshot
-from .Employee import Employee
\ No newline at end of file
+from .Employee import Employee
+from .SyncState import SyncState
+from .ScreenshotEntity import ScreenshotEntity
+from .QueueItem import QueueItem
+from .ScreenshotState import ScreenshotState
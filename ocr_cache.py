@@ -0,0 +1,117 @@
+# -кэш результатов OCR по содержимому изображения, общий для сотрудников и запусков
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+from loguru import logger
+from config import OCR_CACHE_PATH, OCR_CACHE_MAX_ENTRIES
+
+# Как часто (в добавленных записях) проверять превышение размера кэша
+EVICT_EVERY = 500
+
+
+def content_digest(image: np.ndarray) -> str:
+    """Криптографический хеш декодированных пикселей (в отличие от aHash - без коллизий похожих кадров)"""
+    digest = hashlib.blake2b(digest_size=32)
+    digest.update(str(image.shape).encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+class OCRResultCache:
+    """Кэш digest -> (итоговый текст, сырые результаты OCR, сущности) в SQLite с LRU-вытеснением"""
+
+    def __init__(self, version: str, path=OCR_CACHE_PATH, max_entries: int = OCR_CACHE_MAX_ENTRIES):
+        self.version = version
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._inserts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                digest TEXT NOT NULL,
+                version TEXT NOT NULL,
+                processed_text TEXT,
+                detections TEXT,
+                entities TEXT,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (digest, version)
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache (last_used)')
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(ocr_cache)')}
+        if 'entities' not in columns:
+            self._conn.execute('ALTER TABLE ocr_cache ADD COLUMN entities TEXT')
+        # Записи, полученные другими моделями или настройками, больше не нужны
+        removed = self._conn.execute('DELETE FROM ocr_cache WHERE version != ?', (version,)).rowcount
+        self._conn.commit()
+        if removed:
+            logger.info(f"Из кэша OCR удалено {removed} записей устаревшей версии")
+
+    def get(self, digest: str):
+        """(processed_text, detections, entities) или None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT processed_text, detections, entities FROM ocr_cache WHERE digest = ? AND version = ?',
+                (digest, self.version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                'UPDATE ocr_cache SET last_used = ? WHERE digest = ? AND version = ?',
+                (time.time(), digest, self.version)
+            )
+            self._conn.commit()
+        return row[0], json.loads(row[1]) if row[1] else [], json.loads(row[2]) if row[2] else []
+
+    def put(self, digest: str, processed_text: str, detections: list, entities: list = None):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO ocr_cache (digest, version, processed_text, detections, entities, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (digest, self.version, str(processed_text), json.dumps(detections, default=self._to_json),
+                 json.dumps(entities or [], ensure_ascii=False), time.time())
+            )
+            self._inserts += 1
+            if self._inserts % EVICT_EVERY == 0:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute('SELECT COUNT(*) FROM ocr_cache').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                'DELETE FROM ocr_cache WHERE rowid IN (SELECT rowid FROM ocr_cache ORDER BY last_used LIMIT ?)',
+                (excess,)
+            )
+            logger.debug(f"Из кэша OCR вытеснено {excess} записей")
+
+    @staticmethod
+    def _to_json(value):
+        # Координаты и уверенность из EasyOCR приходят как типы numpy
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        raise TypeError(f"Тип {type(value)} не сериализуется")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,136 @@
+# -движки OCR: EasyOCR и Tesseract с одинаковым форматом результатов
+from abc import ABC, abstractmethod
+import cv2
+import numpy as np
+from loguru import logger
+from config import (
+    OCR_ENGINE,
+    OCR_GPU,
+    OCR_BATCH_SIZE,
+    OCR_TESSERACT_LANG,
+    OCR_TESSERACT_CONFIG
+)
+
+
+class OCREngine(ABC):
+    """Общий интерфейс движка OCR.
+
+    readtext возвращает список [рамка, текст, уверенность], где рамка - четыре точки
+    [[x, y], ...] по часовой стрелке от левого верхнего угла, как у EasyOCR.
+    """
+
+    name = None
+    # Размер холста детектора; None - значение движка по умолчанию
+    canvas_size = None
+
+    @property
+    @abstractmethod
+    def version(self) -> str:
+        """Строка версии движка и настроек для ключа кэша OCR"""
+
+    @abstractmethod
+    def readtext(self, image: np.ndarray) -> list:
+        """Распознаёт одно изображение"""
+
+    def readtext_batched(self, images: list) -> list:
+        """Пакетное распознавание; по умолчанию изображения обрабатываются по одному"""
+        return [self.readtext(image) for image in images]
+
+
+class EasyOCREngine(OCREngine):
+    name = 'easyocr'
+
+    def __init__(self, gpu: bool = OCR_GPU, batch_size: int = OCR_BATCH_SIZE):
+        import easyocr
+        self._easyocr_version = getattr(easyocr, '__version__', 'unknown')
+        self.batch_size = batch_size
+        self.reader = easyocr.Reader(
+            lang_list=['ru', 'en'],
+            gpu=gpu
+            )
+
+    @property
+    def version(self) -> str:
+        return f"easyocr-{self._easyocr_version}:ru,en:paragraph"
+
+    def _options(self) -> dict:
+        options = {'paragraph': True, 'batch_size': self.batch_size}
+        if self.canvas_size:
+            options['canvas_size'] = self.canvas_size
+        return options
+
+    @staticmethod
+    def _with_confidence(results: list) -> list:
+        # В режиме абзацев EasyOCR не возвращает уверенность
+        return [[bbox, text, None] for bbox, text, *_ in results]
+
+    def readtext(self, image: np.ndarray) -> list:
+        return self._with_confidence(self.reader.readtext(image, **self._options()))
+
+    def readtext_batched(self, images: list) -> list:
+        """Изображения одного размера детектируются одним батчем"""
+        if len(images) == 1:
+            return [self.readtext(images[0])]
+        batch = self.reader.readtext_batched(images, **self._options())
+        return [self._with_confidence(results) for results in batch]
+
+
+class TesseractEngine(OCREngine):
+    name = 'tesseract'
+
+    def __init__(self, lang: str = OCR_TESSERACT_LANG, config: str = OCR_TESSERACT_CONFIG):
+        import pytesseract
+        self._pytesseract = pytesseract
+        self.lang = lang
+        self.config = config
+        self._tesseract_version = str(pytesseract.get_tesseract_version())
+
+    @property
+    def version(self) -> str:
+        return f"tesseract-{self._tesseract_version}:{self.lang}:{self.config}"
+
+    def readtext(self, image: np.ndarray) -> list:
+        data = self._pytesseract.image_to_data(
+            cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if image.ndim == 3 else image,
+            lang=self.lang,
+            config=self.config,
+            output_type=self._pytesseract.Output.DICT
+        )
+
+        # Слова собираются в абзацы, как в режиме paragraph=True у EasyOCR; порядок чтения - как у Tesseract
+        paragraphs = {}
+        for i, word in enumerate(data['text']):
+            word = word.strip()
+            if not word:
+                continue
+            key = (data['block_num'][i], data['par_num'][i])
+            paragraphs.setdefault(key, []).append(i)
+
+        results = []
+        for indexes in paragraphs.values():
+            x0 = min(data['left'][i] for i in indexes)
+            y0 = min(data['top'][i] for i in indexes)
+            x1 = max(data['left'][i] + data['width'][i] for i in indexes)
+            y1 = max(data['top'][i] + data['height'][i] for i in indexes)
+            text = ' '.join(data['text'][i].strip() for i in indexes)
+            confidences = [float(data['conf'][i]) for i in indexes if float(data['conf'][i]) >= 0]
+            confidence = sum(confidences) / len(confidences) / 100 if confidences else None
+            results.append([[[x0, y0], [x1, y0], [x1, y1], [x0, y1]], text, confidence])
+        return results
+
+
+ENGINES = {
+    EasyOCREngine.name: EasyOCREngine,
+    TesseractEngine.name: TesseractEngine,
+}
+
+
+def create_ocr_engine(name: str = OCR_ENGINE) -> OCREngine:
+    """Создаёт движок OCR по имени из конфигурации"""
+    try:
+        engine_class = ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный движок OCR: {name}. Доступны: {', '.join(ENGINES)}")
+    engine = engine_class()
+    logger.info(f"Движок OCR: {engine.version}")
+    return engine
@@ -0,0 +1,172 @@
+# -пул процессов для OCR: модели загружаются один раз в каждом воркере
+import os
+import signal
+import threading
+import multiprocessing
+from collections import Counter
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from loguru import logger
+from config import OCR_POOL_WORKERS, OCR_POOL_TORCH_THREADS, OCR_POOL_BATCH_SIZE, REGION_DIFF_ENABLED
+
+# ImageProcessor текущего процесса-воркера
+_worker_processor = None
+# Счётчики кэшей воркера, уже переданные в основной процесс
+_reported = {}
+
+
+def _init_worker(torch_threads: int):
+    """Инициализатор воркера: ограничивает потоки torch и загружает модели"""
+    global _worker_processor
+
+    # Сигналы завершения обрабатывает основной процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if torch_threads:
+        os.environ['OMP_NUM_THREADS'] = str(torch_threads)
+        import torch
+        torch.set_num_threads(torch_threads)
+
+    from image_processor import ImageProcessor
+    _worker_processor = ImageProcessor()
+    _worker_processor.preload(wait=True)
+    # Выполняется при штатной остановке пула: atexit в процессах multiprocessing не вызывается
+    Finalize(None, _finalize_worker, exitpriority=10)
+    logger.info(f"OCR-воркер {os.getpid()} готов")
+
+
+def _finalize_worker():
+    """Сохраняет кэш орфографии воркера на диск"""
+    if _worker_processor is not None and _worker_processor.loaded('text_corrector'):
+        try:
+            _worker_processor.textCorrector.save()
+        except OSError as e:
+            logger.warning(f"OCR-воркер {os.getpid()} не сохранил кэш орфографии: {e}")
+
+
+def _worker_stats() -> dict:
+    """Прирост счётчиков кэша OCR и кэша орфографии воркера с прошлой пачки"""
+    current = {}
+    if _worker_processor.loaded('ocr_cache'):
+        cache = _worker_processor.ocr_cache
+        current.update(ocr_hits=cache.hits, ocr_misses=cache.misses)
+    if _worker_processor.loaded('text_corrector'):
+        corrector = _worker_processor.textCorrector
+        current.update(spell_hits=corrector.hits, spell_misses=corrector.misses,
+                       spell_skipped=corrector.skipped, spell_lookup_time=corrector.lookup_time)
+    delta = {key: value - _reported.get(key, 0) for key, value in current.items()}
+    _reported.update(current)
+    return delta
+
+
+def _process_one(key: str, source, frame_key: str = None) -> str:
+    return _worker_processor.process_image(source, key, frame_key)
+
+
+def _process_batch(items: list) -> tuple:
+    """Обрабатывает пачку (ключ, путь или байты[, ключ кадра]); возвращает [(ключ, текст)] и прирост счётчиков кэшей"""
+    return _recognize_batch(items), _worker_stats()
+
+
+def _recognize_batch(items: list) -> list:
+    if not REGION_DIFF_ENABLED:
+        keys = [item[0] for item in items]
+        texts = _worker_processor.process_images([item[1] for item in items], keys)
+        return list(zip(keys, texts))
+
+    results = []
+    for key, source, *frame_key in items:
+        try:
+            results.append((key, _process_one(key, source, *frame_key)))
+        except Exception as e:
+            logger.error(f"Ошибка при обработке изображения {key} в OCR-воркере: {e}")
+            results.append((key, None))
+    return results
+
+
+class OCRWorkerPool:
+    """Пул процессов, каждый из которых держит свои EasyOCR, Natasha и Hunspell"""
+
+    def __init__(self, workers: int = OCR_POOL_WORKERS, torch_threads: int = OCR_POOL_TORCH_THREADS,
+                 batch_size: int = OCR_POOL_BATCH_SIZE):
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        # spawn вместо fork: torch и CUDA не переносят fork после инициализации
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(torch_threads,)
+        )
+        # Счётчики кэшей всех воркеров за время жизни пула
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+        logger.info(f"Запущен пул OCR из {self.workers} процессов, потоков torch на воркер: {torch_threads or 'без ограничения'}")
+
+    def process_batch(self, items: list) -> list:
+        """Обрабатывает одну пачку в свободном воркере"""
+        return self._collect(self._executor.submit(_process_batch, list(items)))
+
+    def process(self, items):
+        """Обрабатывает (ключ, путь или байты) пачками и отдаёт результаты по мере готовности"""
+        items = iter(items)
+        pending = set()
+        exhausted = False
+
+        while pending or not exhausted:
+            # Не держим в работе больше двух пачек на воркер
+            while not exhausted and len(pending) < self.workers * 2:
+                batch = []
+                for item in items:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                if not batch:
+                    exhausted = True
+                    break
+                pending.add(self._executor.submit(_process_batch, batch))
+
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from self._collect(future)
+
+    def _collect(self, future) -> list:
+        results, stats = future.result()
+        with self._stats_lock:
+            self._stats.update(stats)
+        return results
+
+    def cache_stats(self) -> tuple:
+        """Сводные счётчики кэша OCR и кэша орфографии воркеров в формате OCRResultCache.stats и TextCorrector.stats"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        ocr_stats = spell_stats = None
+        if 'ocr_hits' in stats:
+            lookups = stats['ocr_hits'] + stats['ocr_misses']
+            ocr_stats = {
+                'hits': stats['ocr_hits'],
+                'misses': stats['ocr_misses'],
+                'hit_rate': stats['ocr_hits'] / lookups if lookups else 0.0,
+            }
+        if 'spell_hits' in stats:
+            lookups = stats['spell_hits'] + stats['spell_misses']
+            spell_stats = {
+                'hits': stats['spell_hits'],
+                'misses': stats['spell_misses'],
+                'skipped': stats['spell_skipped'],
+                'hit_rate': stats['spell_hits'] / lookups if lookups else 0.0,
+                'miss_ms': stats['spell_lookup_time'] / stats['spell_misses'] * 1000 if stats['spell_misses'] else 0.0,
+            }
+        return ocr_stats, spell_stats
+
+    def close(self):
+        # Воркеры сохраняют кэш орфографии при остановке
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
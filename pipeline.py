@@ -0,0 +1,492 @@
+# -конвейер обработки скриншотов: скачивание -> хеш -> OCR -> NLP -> БД
+import os
+import queue
+import threading
+import time
+from loguru import logger
+from config import (
+    PIPELINE_QUEUE_SIZE,
+    PIPELINE_DOWNLOAD_WORKERS,
+    PIPELINE_OCR_WORKERS,
+    PIPELINE_NLP_WORKERS,
+    PIPELINE_DB_BATCH_SIZE,
+    OCR_IMAGE_BATCH,
+    REGION_DIFF_ENABLED,
+    NLP_BATCH_SIZE,
+    OCR_ENGINE
+)
+from db.database import SessionLocal
+from screenshot_writer import ScreenshotWriter
+from image_processor import ImageProcessor
+from hash_index import NearDuplicateIndex, to_signed64
+from checkpoint import reached, DOWNLOADED
+
+# Маркер окончания потока задач между этапами
+_STOP = object()
+
+
+def default_ocr_workers() -> int:
+    """Подбирает число OCR-потоков под оборудование"""
+    if OCR_ENGINE == 'tesseract':
+        # Tesseract запускается отдельным процессом на каждый кадр, потоки не мешают друг другу
+        return os.cpu_count() or 1
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return 1
+    except ImportError:
+        pass
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+class ScreenshotJob:
+    """Скриншот, проходящий через этапы конвейера"""
+
+    def __init__(self, file_id: str, employee_id: int, employee_insider_id: str, captured_at=None):
+        self.file_id = file_id
+        self.employee_id = employee_id
+        self.employee_insider_id = employee_insider_id
+        self.captured_at = captured_at
+        # Скриншот хранится только в памяти; на диске бывает лишь размеченное изображение
+        self.file_path = ImageProcessor.annotated_path(file_id)
+        self.content = None
+        self.image = None
+        self.image_hash = None
+        self.hash_value = None
+        self.file_size = None
+        self.digest = None
+        self.detections = None
+        self.raw_text = None
+        self.processed_text = None
+        # Последний завершённый этап (checkpoint.py); None - чекпоинты не ведутся
+        self.stage = None
+
+
+class StageStats:
+    """Счётчики пропускной способности этапа"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed: float, processed: int = 0, skipped: int = 0, failed: int = 0):
+        with self._lock:
+            self.busy_time += elapsed
+            self.processed += processed
+            self.skipped += skipped
+            self.failed += failed
+
+    def report(self, wall_time: float):
+        rate = self.processed / wall_time if wall_time > 0 else 0.0
+        logger.info(
+            f"Этап {self.name}: обработано {self.processed}, пропущено {self.skipped}, "
+            f"ошибок {self.failed}, занятость {self.busy_time:.1f} с, {rate:.2f} шт/с"
+        )
+
+
+class Stage:
+    """Этап конвейера: пул потоков между входной и выходной очередью.
+
+    При batch_size > 1 функция этапа получает список задач и возвращает
+    список результатов той же длины (None - задача отброшена).
+    on_error(job, причина) вызывается для задач, на которых функция этапа упала.
+    """
+
+    def __init__(self, name: str, func, workers: int, in_queue: queue.Queue, out_queue: queue.Queue = None,
+                 batch_size: int = 1, on_error=None):
+        self.name = name
+        self.func = func
+        self.on_error = on_error
+        self.workers = max(1, workers)
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.batch_size = max(1, batch_size)
+        self.stats = StageStats(name)
+        self._threads = []
+        self._finisher = None
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._finisher = threading.Thread(target=self._finish, name=f"{self.name}-finish", daemon=True)
+        self._finisher.start()
+
+    def join(self, timeout: float = None):
+        self._finisher.join(timeout)
+
+    def is_alive(self) -> bool:
+        return self._finisher.is_alive()
+
+    def _work(self):
+        while True:
+            job = self.in_queue.get()
+            if job is _STOP:
+                # Возвращаем маркер, чтобы его увидели остальные потоки этапа
+                self.in_queue.put(_STOP)
+                return
+
+            batch = [job]
+            stop_seen = False
+            while len(batch) < self.batch_size:
+                try:
+                    job = self.in_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is _STOP:
+                    stop_seen = True
+                    break
+                batch.append(job)
+
+            self._run(batch)
+
+            if stop_seen:
+                self.in_queue.put(_STOP)
+                return
+
+    def _run(self, batch: list):
+        started = time.monotonic()
+        try:
+            if self.batch_size == 1:
+                results = [self.func(batch[0])]
+            else:
+                results = self.func(batch)
+        except Exception as e:
+            file_ids = ', '.join(job.file_id for job in batch)
+            logger.error(f"Ошибка на этапе {self.name} для скриншотов {file_ids}: {e}")
+            self.stats.record(time.monotonic() - started, failed=len(batch))
+            if self.on_error is not None:
+                for job in batch:
+                    self.on_error(job, f"{self.name}: {e}")
+            return
+
+        done = [result for result in results if result is not None]
+        self.stats.record(time.monotonic() - started, processed=len(done), skipped=len(batch) - len(done))
+        if self.out_queue is not None:
+            for result in done:
+                self.out_queue.put(result)
+
+    def _finish(self):
+        for thread in self._threads:
+            thread.join()
+        if self.out_queue is not None:
+            self.out_queue.put(_STOP)
+
+
+class ScreenshotPipeline:
+    """Многоэтапная обработка скриншотов с ограниченными очередями между этапами"""
+
+    def __init__(self, insider_service, image_processor=None, should_run=None, ocr_pool=None, hash_index=None,
+                 checkpoints=None, queue_size: int = PIPELINE_QUEUE_SIZE,
+                 download_workers: int = PIPELINE_DOWNLOAD_WORKERS,
+                 ocr_workers: int = PIPELINE_OCR_WORKERS,
+                 nlp_workers: int = PIPELINE_NLP_WORKERS,
+                 db_batch_size: int = PIPELINE_DB_BATCH_SIZE):
+        self.insider_service = insider_service
+        self.image_processor = image_processor
+        self.ocr_pool = ocr_pool
+        self.hash_index = hash_index
+        self.checkpoints = checkpoints
+        self.should_run = should_run or (lambda: True)
+        self.queue_size = queue_size
+        self.download_workers = download_workers
+        self.ocr_workers = ocr_workers or default_ocr_workers()
+        self.nlp_workers = nlp_workers
+        self.db_batch_size = max(1, db_batch_size)
+
+        self._write_session = None
+        self._writer = None
+        # file_id, пропущенные как дубликаты: для очереди это тоже выполненные задачи
+        self.duplicates = set()
+
+    def _download(self, job: ScreenshotJob):
+        # После сигнала завершения новые скачивания не начинаем,
+        # а уже скачанные скриншоты дорабатываются на следующих этапах
+        if not self.should_run():
+            return None
+        if self.checkpoints is not None:
+            self.checkpoints.start(job)
+        if job.processed_text or (job.raw_text is not None and self.ocr_pool is None):
+            # Продолжение после сбоя: кадр уже распознан, скачивать его не нужно
+            return job
+
+        if reached(job, DOWNLOADED):
+            job.content = self.checkpoints.load_download(job)
+        if not job.content:
+            job.content = self.insider_service.fetch_screenshot(job.file_id)
+            if not job.content:
+                logger.warning(f"Не удалось скачать скриншот {job.file_id}")
+                return self._fail(job, "download: скриншот не скачан")
+            if self.checkpoints is not None:
+                self.checkpoints.save_download(job)
+
+        # Декодирование выполняется здесь, в многопоточном этапе, а не в однопоточном этапе хеша
+        try:
+            job.image = ImageProcessor.load_image(job.content)
+        except ValueError as e:
+            logger.warning(f"Скриншот {job.file_id} не декодируется: {e}")
+            return self._fail(job, f"decode: {e}")
+        return job
+
+    def _fail(self, job: ScreenshotJob, reason: str):
+        """Отбрасывает задачу, записывая неудачную попытку в её состояние"""
+        self._release(job.file_id)
+        if self.checkpoints is not None:
+            self.checkpoints.fail(job, reason)
+        return None
+
+    def _release(self, file_id: str):
+        """Снимает резерв хеша несохранённого скриншота; его дубликаты снова ждут обработки"""
+        dependents = self.hash_index.release(file_id)
+        if not dependents:
+            return
+        self.duplicates.difference_update(dependents)
+        if self.checkpoints is not None:
+            self.checkpoints.reopen(dependents)
+        logger.info(f"Скриншот {file_id} не сохранён: {len(dependents)} его дубликатов будут обработаны заново")
+
+    def _hash(self, job: ScreenshotJob):
+        # У продолженной задачи хеш уже посчитан и проверен на дубликаты
+        if not reached(job, DOWNLOADED):
+            image_hash = ImageProcessor.calculate_image_hash(job.image)
+            if not image_hash:
+                logger.warning(f"Не удалось вычислить хеш для скриншота {job.file_id}")
+                return self._fail(job, "hash: хеш не вычислен")
+
+            # Хеш резервируется сразу, чтобы следующие кадры сравнивались и с ещё не сохранёнными
+            hash_value = int(image_hash, 16)
+            duplicate = self.hash_index.check_and_reserve(hash_value, job.file_id)
+            if duplicate is not None:
+                logger.debug(f"Скриншот {job.file_id} является дубликатом {duplicate}")
+                self.duplicates.add(job.file_id)
+                if self.checkpoints is not None:
+                    self.checkpoints.checkpoint_duplicate(job)
+                return None
+
+            job.image_hash = image_hash
+            job.hash_value = hash_value
+            job.file_size = len(job.content)
+            if self.checkpoints is not None:
+                self.checkpoints.checkpoint_downloaded(job)
+        elif job.hash_value is not None:
+            # Хеш прерванной задачи ещё не в базе: резервируем его для сравнения со следующими кадрами
+            self.hash_index.reserve(job.hash_value, job.file_id)
+
+        if self.ocr_pool is None:
+            # Дальше нужен только декодированный кадр
+            job.content = None
+        else:
+            # В пул процессов передаём сжатые байты, а не массив пикселей
+            job.image = None
+        return job
+
+    def _ocr(self, job: ScreenshotJob):
+        # Продолжение после сбоя: текст уже распознан
+        if job.processed_text or job.raw_text is not None:
+            return job
+        try:
+            job.digest, job.processed_text = self.image_processor.cached_result(job.image)
+            if job.processed_text:
+                return job
+            job.detections = self.image_processor.ocr_detections(job.image, job.file_id, job.employee_insider_id)
+            job.raw_text = self.image_processor.clean_ocr_text(self.image_processor.extract_text(job.detections))
+        finally:
+            job.image = None
+        if self.checkpoints is not None:
+            self.checkpoints.checkpoint_recognized(job)
+        return job
+
+    def _ocr_batch(self, jobs: list) -> list:
+        # Пакетный OCR для промахов кэша; попадания сразу идут дальше
+        try:
+            pending = []
+            for job in jobs:
+                if job.processed_text or job.raw_text is not None:
+                    continue
+                job.digest, job.processed_text = self.image_processor.cached_result(job.image)
+                if not job.processed_text:
+                    pending.append(job)
+            if pending:
+                batch = self.image_processor.ocr_detections_batch(
+                    [job.image for job in pending], [job.file_id for job in pending]
+                )
+                for job, detections in zip(pending, batch):
+                    job.detections = detections
+                    job.raw_text = self.image_processor.clean_ocr_text(self.image_processor.extract_text(detections))
+                    if self.checkpoints is not None:
+                        self.checkpoints.checkpoint_recognized(job)
+        finally:
+            for job in jobs:
+                job.image = None
+        return jobs
+
+    def _nlp(self, job: ScreenshotJob):
+        # Текст из кэша OCR уже прошёл NLP
+        if job.processed_text:
+            return job
+        job.processed_text = self.image_processor.analyze_text(job.raw_text)
+        if not job.processed_text:
+            logger.warning(f"Не удалось обработать скриншот {job.file_id}")
+            return self._fail(job, "nlp: текст не обработан")
+        self.image_processor.store_result(job.digest, job.processed_text, job.detections)
+        job.detections = None
+        if self.checkpoints is not None:
+            self.checkpoints.checkpoint_analyzed(job)
+        return job
+
+    def _nlp_batch(self, jobs: list) -> list:
+        # Тексты пачки размечаются Natasha за один проход
+        pending = [job for job in jobs if not job.processed_text]
+        if pending:
+            texts = self.image_processor.analyze_texts([job.raw_text for job in pending])
+            for job, processed_text in zip(pending, texts):
+                job.processed_text = processed_text
+                if processed_text:
+                    self.image_processor.store_result(job.digest, processed_text, job.detections)
+                    if self.checkpoints is not None:
+                        self.checkpoints.checkpoint_analyzed(job)
+                else:
+                    logger.warning(f"Не удалось обработать скриншот {job.file_id}")
+                    self._fail(job, "nlp: текст не обработан")
+                job.detections = None
+        return [job if job.processed_text else None for job in jobs]
+
+    def _ocr_pool_batch(self, jobs: list) -> list:
+        # В пуле процессов каждый воркер выполняет и OCR, и NLP
+        pending = [job for job in jobs if not job.processed_text]
+        try:
+            results = dict(self.ocr_pool.process_batch(
+                [(job.file_id, job.content, job.employee_insider_id) for job in pending]
+            )) if pending else {}
+        finally:
+            for job in jobs:
+                job.content = None
+
+        done = []
+        for job in jobs:
+            if job in pending:
+                job.processed_text = results.get(job.file_id)
+                if not job.processed_text:
+                    logger.warning(f"Не удалось обработать скриншот {job.file_id}")
+                    done.append(self._fail(job, "ocr+nlp: скриншот не обработан"))
+                    continue
+                if self.checkpoints is not None:
+                    self.checkpoints.checkpoint_analyzed(job)
+            done.append(job)
+        return done
+
+    def _write(self, job: ScreenshotJob):
+        self._writer.add(
+            insider_id=job.file_id,
+            employee_id=job.employee_id,
+            file_path=job.file_path,
+            processed_text=job.processed_text,
+            image_hash=job.image_hash,
+            hash_value=to_signed64(job.hash_value),
+            hash_algorithm=self.hash_index.algorithm,
+            file_size=job.file_size,
+            captured_at=job.captured_at
+        )
+        return job
+
+    def run(self, jobs) -> int:
+        """Прогоняет задачи через конвейер и возвращает число сохранённых скриншотов"""
+        self._write_session = SessionLocal()
+        if self.hash_index is None:
+            self.hash_index = NearDuplicateIndex()
+            self.hash_index.load(self._write_session)
+        self._writer = ScreenshotWriter(self._write_session, batch_size=self.db_batch_size,
+                                        checkpoints=self.checkpoints, hash_index=self.hash_index)
+        if self.checkpoints is not None:
+            jobs = self.checkpoints.track(jobs, duplicates=self.duplicates)
+
+        download_q = queue.Queue(maxsize=self.queue_size)
+        hash_q = queue.Queue(maxsize=self.queue_size)
+        ocr_q = queue.Queue(maxsize=self.queue_size)
+        nlp_q = queue.Queue(maxsize=self.queue_size)
+        write_q = queue.Queue(maxsize=self.queue_size)
+
+        if self.ocr_pool is not None:
+            ocr_workers = self.ocr_pool.workers
+            recognize_stages = [
+                Stage("ocr+nlp", self._ocr_pool_batch, ocr_workers, ocr_q, write_q,
+                      batch_size=self.ocr_pool.batch_size, on_error=self._fail),
+            ]
+        else:
+            ocr_workers = self.ocr_workers
+            # Распознавание по изменившимся областям требует обработки кадров по одному
+            if OCR_IMAGE_BATCH > 1 and not REGION_DIFF_ENABLED:
+                ocr_stage = Stage("ocr", self._ocr_batch, ocr_workers, ocr_q, nlp_q, batch_size=OCR_IMAGE_BATCH,
+                                  on_error=self._fail)
+            else:
+                ocr_stage = Stage("ocr", self._ocr, ocr_workers, ocr_q, nlp_q, on_error=self._fail)
+            if NLP_BATCH_SIZE > 1:
+                nlp_stage = Stage("nlp", self._nlp_batch, self.nlp_workers, nlp_q, write_q, batch_size=NLP_BATCH_SIZE,
+                                  on_error=self._fail)
+            else:
+                nlp_stage = Stage("nlp", self._nlp, self.nlp_workers, nlp_q, write_q, on_error=self._fail)
+            recognize_stages = [
+                ocr_stage,
+                nlp_stage,
+            ]
+        stages = [
+            Stage("download", self._download, self.download_workers, download_q, hash_q, on_error=self._fail),
+            Stage("hash", self._hash, 1, hash_q, ocr_q, on_error=self._fail),
+            *recognize_stages,
+            Stage("db", self._write, 1, write_q, on_error=self._fail),
+        ]
+        logger.info(
+            f"Запуск конвейера: скачивание x{self.download_workers}, OCR x{ocr_workers}, "
+            f"NLP x{self.nlp_workers}, очередь {self.queue_size}, пачка БД {self.db_batch_size}"
+        )
+
+        started = time.monotonic()
+        for stage in stages:
+            stage.start()
+
+        try:
+            for job in jobs:
+                if not self.should_run():
+                    break
+                self._put(download_q, job)
+        finally:
+            download_q.put(_STOP)
+            # Ожидание с таймаутом, чтобы главный поток продолжал обрабатывать сигналы
+            for stage in stages:
+                while stage.is_alive():
+                    stage.join(timeout=0.5)
+            try:
+                self._writer.flush()
+            except Exception:
+                # Писатель конвейера живёт один запуск: несохранённое обработается в следующем обходе
+                for file_id in self._writer.discard():
+                    self._release(file_id)
+                raise
+            finally:
+                self._write_session.close()
+                if self.checkpoints is not None:
+                    # Задачи, не дошедшие до скачивания, получают попытку обратно
+                    self.checkpoints.settle()
+
+        wall_time = time.monotonic() - started
+        for stage in stages:
+            stage.stats.report(wall_time)
+        if self.checkpoints is not None:
+            self.checkpoints.report()
+
+        logger.info(f"Конвейер завершён за {wall_time:.1f} с, сохранено {self._writer.saved} скриншотов")
+        return self._writer.saved
+
+    def _put(self, q: queue.Queue, job):
+        while True:
+            try:
+                q.put(job, timeout=0.5)
+                return
+            except queue.Full:
+                if not self.should_run():
+                    return
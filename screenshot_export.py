@@ -0,0 +1,88 @@
+# -постраничная выдача и потоковая выгрузка скриншотов без загрузки всей таблицы в память
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select
+from config import EXPORT_YIELD_PER
+from models import Screenshot
+
+EXPORT_COLUMNS = (
+    'id', 'insider_id', 'employee_id', 'file_path', 'image_hash',
+    'file_size', 'captured_at', 'processed_at', 'created_at', 'processed_text',
+)
+
+
+def _columns(include_text: bool) -> list:
+    names = EXPORT_COLUMNS if include_text else [name for name in EXPORT_COLUMNS if name != 'processed_text']
+    return [getattr(Screenshot, name) for name in names]
+
+
+def _filtered(statement, employee_id: Optional[int], date_from: Optional[datetime], date_to: Optional[datetime]):
+    # Период - по времени активности, как в поиске
+    if employee_id is not None:
+        statement = statement.where(Screenshot.employee_id == employee_id)
+    if date_from is not None:
+        statement = statement.where(Screenshot.activity_at >= date_from)
+    if date_to is not None:
+        statement = statement.where(Screenshot.activity_at < date_to)
+    return statement
+
+
+def _serialize(row) -> dict:
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in row._mapping.items()
+    }
+
+
+def page_screenshots(db, limit: int = 50, cursor: Optional[int] = None, employee_id: Optional[int] = None,
+                     date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                     include_text: bool = True) -> dict:
+    """Страница от новых к старым; cursor - id последней строки предыдущей страницы.
+
+    В отличие от OFFSET, условие id < cursor идёт по первичному ключу, и глубина
+    страницы не влияет на время запроса.
+    """
+    statement = select(*_columns(include_text)).order_by(Screenshot.id.desc()).limit(limit + 1)
+    if cursor is not None:
+        statement = statement.where(Screenshot.id < cursor)
+    rows = db.execute(_filtered(statement, employee_id, date_from, date_to)).all()
+
+    items = [_serialize(row) for row in rows[:limit]]
+    next_cursor = items[-1]['id'] if len(rows) > limit else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+def iter_screenshots(db, employee_id: Optional[int] = None, date_from: Optional[datetime] = None,
+                     date_to: Optional[datetime] = None, include_text: bool = True,
+                     yield_per: int = EXPORT_YIELD_PER):
+    """Отдаёт строки по мере чтения с серверного курсора, порциями по yield_per"""
+    statement = _filtered(
+        select(*_columns(include_text)).order_by(Screenshot.id),
+        employee_id, date_from, date_to
+    )
+    result = db.execute(statement.execution_options(stream_results=True, yield_per=yield_per))
+    for row in result:
+        yield _serialize(row)
+
+
+def to_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def to_csv(rows, include_text: bool = True):
+    buffer = io.StringIO()
+    columns = EXPORT_COLUMNS if include_text else [name for name in EXPORT_COLUMNS if name != 'processed_text']
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Заголовок пустой выгрузки
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -1,14 +1,41 @@
 import os
+import json
+import time
 import signal
+import asyncio
+import threading
+import schedule
 from datetime import datetime, timedelta
+from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker
 from loguru import logger
-from insider_service import InsiderService
+from insider_service import InsiderService, activity_time
 from image_processor import ImageProcessor
-from config import SCHEDULE_INTERVAL, TEMP_DIR
+from pipeline import ScreenshotPipeline, ScreenshotJob
+from ocr_pool import OCRWorkerPool
+from async_insider_service import AsyncScreenshotCrawler
+from hash_index import NearDuplicateIndex, to_signed64
+from screenshot_writer import ScreenshotWriter
+from work_queue import WorkQueue
+from checkpoint import CheckpointStore, dead_letter_ids, unfinished_states, purge_finished_states
+from config import (
+    SCHEDULE_INTERVAL,
+    TEMP_DIR,
+    PIPELINE_ENABLED,
+    OCR_EXECUTION_MODE,
+    ASYNC_ENABLED,
+    MODEL_PRELOAD,
+    SWEEP_MAX_DURATION,
+    SWEEP_STATUS_PATH,
+    SUMMARY_LAST_N,
+    RETENTION_DAYS,
+    WORK_QUEUE_ENABLED,
+    WORK_QUEUE_ROLE,
+    WORK_QUEUE_BATCH_SIZE,
+    CHECKPOINT_ENABLED
+)
 from db.database import SessionLocal, init_db
-from models import Employee, Screenshot
-import shutil
+from models import Employee, Screenshot, QueueItem
 
 class ScreenshotProcessor:
     def __init__(self):
@@ -16,10 +43,35 @@ class ScreenshotProcessor:
         self.session = SessionLocal()
         
         self.insider_service = InsiderService(self.session)
-        self.image_processor = ImageProcessor()
+        if OCR_EXECUTION_MODE == 'process':
+            # Модели загружаются в воркерах пула, а не в основном процессе
+            self.image_processor = None
+            self.ocr_pool = OCRWorkerPool()
+        else:
+            self.image_processor = ImageProcessor()
+            self.ocr_pool = None
         
         os.makedirs(TEMP_DIR, exist_ok=True)
 
+        # Индекс хешей для поиска почти одинаковых скриншотов строится по базе при запуске
+        self.hash_index = NearDuplicateIndex()
+        self.hash_index.load(self.session)
+
+        # Общая очередь: несколько узлов делят скриншоты одного обхода
+        self.work_queue = WorkQueue(SessionLocal) if WORK_QUEUE_ENABLED else None
+        # Состояние обработки каждого скриншота: попытки, ошибки, dead letter и продолжение после сбоя
+        self.checkpoints = CheckpointStore(SessionLocal) if CHECKPOINT_ENABLED else None
+        # Хеши скриншотов подтверждаются в индексе, а состояния переводятся в stored после записи в базу
+        self.writer = ScreenshotWriter(self.session, checkpoints=self.checkpoints, hash_index=self.hash_index)
+
+        # Состояние обходов по расписанию
+        self.sweep_deadline = None
+        self.finished_employees = set()
+        self.carry_over = []  # id сотрудников, не обработанных до конца в прошлом обходе
+        self.sweep_count = 0
+        self.skipped_sweeps = 0
+        self._sweep_lock = threading.Lock()
+
         signal.signal(signal.SIGINT, self.handle_shutdown)
         signal.signal(signal.SIGTERM, self.handle_shutdown)
 
@@ -28,26 +80,39 @@ class ScreenshotProcessor:
         logger.info("Получен сигнал завершения. Завершаем работу...")
         self.running = False
 
-    def process_employee_screenshots(self, employee: Employee):
-        """Обработка скриншотов для одного сотрудника"""
+    @property
+    def sweep_running(self) -> bool:
+        """Обход продолжается: нет сигнала завершения и не исчерпано время обхода"""
+        return self.running and (self.sweep_deadline is None or time.monotonic() < self.sweep_deadline)
+
+    def ordered_employees(self) -> list:
+        """Все сотрудники; не законченные в прошлом обходе идут первыми"""
+        employees = self.session.query(Employee).order_by(Employee.id).all()
+        carry_over = set(self.carry_over)
+        return sorted(employees, key=lambda employee: employee.id not in carry_over)
+
+    def process_employee_screenshots(self, employee: Employee, screenshots: list = None, skip: set = frozenset()):
+        """Обработка скриншотов для одного сотрудника; file_id из skip уже обработаны в этом обходе"""
         try:
             logger.info(f"Начало обработки скриншотов для сотрудника {employee.insider_id}")
             
-            # Получение скриншотов
-            screenshots = self.insider_service.get_screenshots(
-                employee.insider_id,
-                start_date=datetime.now() - timedelta(days=30)
-            )
+            # Получение скриншотов, появившихся после последней синхронизации
+            if screenshots is None:
+                screenshots = self.insider_service.get_new_screenshots(employee)
 
             if not screenshots:
                 logger.warning(f"Не найдено скриншотов для сотрудника {employee.insider_id}")
+                self.finished_employees.add(employee.id)
                 return
                 
             logger.info(f"Получено {len(screenshots)} скриншотов для обработки")
+            existing = self.existing_insider_ids([item['data']['file'] for item in screenshots])
+            duplicates = set()
+            tracked = self.tracked_jobs(employee, screenshots, existing | skip, duplicates)
             processed_count = 0
             
             for screenshot_data in screenshots:
-                if not self.running:
+                if not self.sweep_running:
                     break
                     
                 try:
@@ -55,126 +120,498 @@ class ScreenshotProcessor:
                     logger.debug(f"Обработка скриншота {file_id}")
                     
                     # Проверка на дубликаты по insider_id
-                    existing = self.session.query(Screenshot).filter_by(
-                        insider_id=file_id
-                    ).first()
-                    if existing:
+                    if file_id in existing:
                         logger.debug(f"Скриншот {file_id} уже существует в базе")
                         continue
-                    
-                    # Скачивание скриншота
-                    temp_path = os.path.join(TEMP_DIR, f"{file_id}.jpg")
-
-                    if not self.insider_service.download_screenshot(file_id, temp_path):
-                        logger.warning(f"Не удалось скачать скриншот {file_id}")
-                        continue
-                    
-                    # Вычисление хеша изображения
-                    image_hash = self.image_processor.calculate_image_hash(temp_path)
-                    if not image_hash:
-                        logger.warning(f"Не удалось вычислить хеш для скриншота {file_id}")
-                        continue
-                        
-                    # Проверка на дубликаты по хешу
-                    duplicate = self.session.query(Screenshot).filter_by(
-                        image_hash=image_hash
-                    ).first()
-                    if duplicate:
-                        logger.debug(f"Скриншот {file_id} является дубликатом {duplicate.insider_id}")
-                        os.remove(temp_path)
+                    if file_id in skip:
                         continue
-                    
-                    # Обработка изображения
-                    processed_text = self.image_processor.process_image(temp_path)
-                    if not processed_text:
-                        logger.warning(f"Не удалось обработать скриншот {file_id}")
-                        os.remove(temp_path)
-                        continue
-                    logger.debug("Before get size")
-                    # Получение размера файла
-                    file_size = os.path.getsize(temp_path)
-                    logger.debug("Before save to DB")
-                    # Сохранение в базу
-                    screenshot = Screenshot(
-                        insider_id=file_id,
-                        employee_id=employee.id,
-                        file_path=temp_path,
-                        processed_text=processed_text,
-                        image_hash=image_hash,
-                        file_size=file_size
-                    )
-                    self.session.add(screenshot)
-                    self.session.commit()
-                    
-                    # Удаление временного файла
-                    try:
-                        shutil.rmtree(TEMP_DIR)
-                    except OSError as e:
-                        logger.warning(f"Не удалось удалить временный файл {temp_path}: {e}")
-                    
-                    processed_count += 1
-                    logger.debug(f"Успешно обработан скриншот {file_id}")
-                    
+
+                    if tracked is not None:
+                        # Завершённые ранее скриншоты и dead letter не обрабатываются
+                        job = tracked.get(file_id)
+                        if job is None:
+                            continue
+                    else:
+                        job = ScreenshotJob(file_id, employee.id, employee.insider_id, activity_time(screenshot_data))
                 except KeyError as e:
                     logger.error(f"Ошибка в структуре данных скриншота: {e}")
                     continue
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке скриншота: {e}")
-                    continue
+
+                if self.process_screenshot(job, duplicates):
+                    processed_count += 1
                 
             logger.info(f"Обработано {processed_count} скриншотов для сотрудника {employee.insider_id}")
+
+            # Отметку сдвигаем только после полного прохода по списку и записи всех скриншотов
+            self.writer.flush()
+            if self.sweep_running:
+                self.insider_service.save_sync_state(
+                    employee.id, screenshots, self.unfinished_ids(screenshots, duplicates)
+                )
+                self.finished_employees.add(employee.id)
             
         except Exception as e:
             logger.error(f"Ошибка при обработке скриншотов сотрудника {employee.insider_id}: {e}")
             self.session.rollback()
 
+    def process_screenshot(self, job: ScreenshotJob, duplicates: set) -> bool:
+        """Последовательная обработка одного скриншота; True, если он добавлен в буфер записи.
+
+        Скриншот обрабатывается за один шаг, поэтому сохранённые этапы не используются:
+        продолженная задача скачивается и распознаётся заново.
+        """
+        file_id = job.file_id
+        try:
+            if self.checkpoints is not None:
+                self.checkpoints.start(job)
+
+            # Скачивание скриншота в память
+            content = self.insider_service.fetch_screenshot(file_id)
+            if not content:
+                logger.warning(f"Не удалось скачать скриншот {file_id}")
+                self.record_failure(job, "download: скриншот не скачан")
+                return False
+
+            # Изображение декодируется один раз и дальше передаётся массивом
+            image = self.image_processor.load_image(content)
+            
+            # Вычисление хеша изображения
+            image_hash = self.image_processor.calculate_image_hash(image)
+            if not image_hash:
+                logger.warning(f"Не удалось вычислить хеш для скриншота {file_id}")
+                self.record_failure(job, "hash: хеш не вычислен")
+                return False
+                
+            # Проверка на дубликаты и почти одинаковые скриншоты по индексу хешей
+            hash_value = int(image_hash, 16)
+            duplicate = self.hash_index.check_and_reserve(hash_value, file_id)
+            if duplicate is not None:
+                logger.debug(f"Скриншот {file_id} является дубликатом {duplicate}")
+                duplicates.add(file_id)
+                if self.checkpoints is not None:
+                    self.checkpoints.checkpoint_duplicate(job)
+                return False
+            
+            try:
+                # Обработка изображения
+                processed_text = self.image_processor.process_image(image, file_id, job.employee_insider_id)
+                if not processed_text:
+                    logger.warning(f"Не удалось обработать скриншот {file_id}")
+                    self.hash_index.release(file_id)
+                    self.record_failure(job, "ocr+nlp: скриншот не обработан")
+                    return False
+                # Сохранение в базу пачками
+                self.writer.add(
+                    insider_id=file_id,
+                    employee_id=job.employee_id,
+                    file_path=ImageProcessor.annotated_path(file_id),
+                    processed_text=processed_text,
+                    image_hash=image_hash,
+                    hash_value=to_signed64(hash_value),
+                    hash_algorithm=self.hash_index.algorithm,
+                    file_size=len(content),
+                    captured_at=job.captured_at
+                )
+            except Exception:
+                # Хеш несохранённого скриншота не должен отсекать следующие кадры
+                self.hash_index.release(file_id)
+                raise
+            
+            logger.debug(f"Успешно обработан скриншот {file_id}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Ошибка при обработке скриншота: {e}")
+            self.record_failure(job, str(e))
+            return False
+
+    def process_resumed_screenshots(self) -> set:
+        """Последовательный режим: скриншоты, прерванные в прошлых обходах или возвращённые из dead letter.
+
+        Отметка синхронизации могла их уже обогнать, поэтому они обрабатываются до обхода
+        сотрудников. Возвращает их file_id, чтобы не обрабатывать их в том же обходе повторно.
+        """
+        if self.checkpoints is None:
+            return set()
+        jobs = self.resumed_screenshot_jobs()
+        duplicates = set()
+        for job in self.checkpoints.track(jobs, duplicates=duplicates):
+            if not self.sweep_running:
+                break
+            self.process_screenshot(job, duplicates)
+        try:
+            self.writer.flush()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить скриншоты с прошлых обходов: {e}")
+            self.session.rollback()
+        return {job.file_id for job in jobs}
+
+    def existing_insider_ids(self, file_ids: list) -> set:
+        """Возвращает file_id, уже сохранённые в базе, одним запросом"""
+        if not file_ids:
+            return set()
+        return {
+            row.insider_id for row in self.session.query(Screenshot.insider_id).filter(
+                Screenshot.insider_id.in_(file_ids)
+            )
+        }
+
+    def tracked_jobs(self, employee, screenshots: list, existing: set, duplicates: set) -> dict:
+        """Регистрирует новые скриншоты в чекпоинтах: {file_id: задача} без завершённых и dead letter.
+
+        Без чекпоинтов возвращает None. file_id, ранее отброшенные как дубликаты, добавляются в duplicates.
+        """
+        if self.checkpoints is None:
+            return None
+        jobs = [
+            ScreenshotJob(item['data']['file'], employee.id, employee.insider_id, activity_time(item))
+            for item in screenshots if item['data']['file'] not in existing
+        ]
+        return {job.file_id: job for job in self.checkpoints.track(jobs, duplicates=duplicates)}
+
+    def record_failure(self, job, reason: str):
+        """Записывает неудачную попытку в состояние скриншота, если чекпоинты включены"""
+        if job is not None and self.checkpoints is not None:
+            self.checkpoints.fail(job, reason)
+
+    def unfinished_ids(self, screenshots: list, duplicates: set) -> set:
+        """file_id, которые не сохранены, не отброшены как дубликаты и не в dead letter"""
+        file_ids = [item['data']['file'] for item in screenshots]
+        unfinished = set(file_ids) - self.existing_insider_ids(file_ids) - duplicates
+        if unfinished and self.checkpoints is not None:
+            unfinished -= dead_letter_ids(self.session, list(unfinished))
+        return unfinished
+
+    def resumed_screenshot_jobs(self) -> list:
+        """Задачи, обработка которых прервалась в прошлых обходах (отметка синхронизации уже сдвинута)"""
+        states = unfinished_states(self.session)
+        if not states:
+            return []
+        employee_ids = {employee_id for _, employee_id, _ in states}
+        frame_keys = dict(self.session.query(Employee.id, Employee.insider_id).filter(Employee.id.in_(employee_ids)))
+        logger.info(f"Найдено {len(states)} незавершённых скриншотов с прошлых обходов")
+        return [
+            ScreenshotJob(insider_id, employee_id, frame_keys.get(employee_id), captured_at)
+            for insider_id, employee_id, captured_at in states
+        ]
+
+    def collect_screenshot_jobs(self, employees: list, synced: list):
+        """Формирует задачи конвейера для ещё не обработанных скриншотов"""
+        queued = set()
+        if self.checkpoints is not None:
+            for job in self.resumed_screenshot_jobs():
+                queued.add(job.file_id)
+                yield job
+
+        for employee, screenshots in self.insider_service.get_new_screenshots_batch(employees):
+            if not self.sweep_running:
+                return
+            try:
+                file_ids = [item['data']['file'] for item in screenshots]
+            except KeyError as e:
+                logger.error(f"Ошибка в структуре данных скриншота: {e}")
+                continue
+
+            if not file_ids:
+                logger.warning(f"Не найдено скриншотов для сотрудника {employee.insider_id}")
+                self.finished_employees.add(employee.id)
+                continue
+
+            synced.append((employee.id, screenshots))
+            existing = self.existing_insider_ids(file_ids)
+            for file_id, item in zip(file_ids, screenshots):
+                if file_id not in existing and file_id not in queued:
+                    yield ScreenshotJob(file_id, employee.id, employee.insider_id, activity_time(item))
+
+    def create_pipeline(self) -> ScreenshotPipeline:
+        return ScreenshotPipeline(
+            self.insider_service,
+            self.image_processor,
+            should_run=lambda: self.sweep_running,
+            ocr_pool=self.ocr_pool,
+            hash_index=self.hash_index,
+            checkpoints=self.checkpoints
+        )
+
+    def process_employees_pipeline(self, employees: list):
+        """Обработка скриншотов сотрудников в конвейерном режиме"""
+        pipeline = self.create_pipeline()
+        synced = []
+        pipeline.run(self.collect_screenshot_jobs(employees, synced))
+
+        # При прерывании отметки не сдвигаются: необработанное будет запрошено снова
+        if self.sweep_running:
+            for employee_id, screenshots in synced:
+                self.insider_service.save_sync_state(
+                    employee_id, screenshots, self.unfinished_ids(screenshots, pipeline.duplicates)
+                )
+                self.finished_employees.add(employee_id)
+
+    def enqueue_new_screenshots(self):
+        """Ставит в общую очередь новые скриншоты всех сотрудников и сдвигает отметки синхронизации"""
+        self.insider_service.sync_employees()
+        employees = self.ordered_employees()
+        added = 0
+        for employee, screenshots in self.insider_service.get_new_screenshots_batch(employees):
+            if not self.sweep_running:
+                break
+            try:
+                file_ids = [item['data']['file'] for item in screenshots]
+            except KeyError as e:
+                logger.error(f"Ошибка в структуре данных скриншота: {e}")
+                continue
+
+            if file_ids:
+                existing = self.existing_insider_ids(file_ids)
+                added += self.work_queue.enqueue(
+                    self.session, employee.id, [file_id for file_id in file_ids if file_id not in existing],
+                    {file_id: activity_time(item) for file_id, item in zip(file_ids, screenshots)}
+                )
+                # Отметку можно сдвигать сразу: задачи уже сохранены в очереди
+                self.insider_service.save_sync_state(employee.id, screenshots)
+            self.finished_employees.add(employee.id)
+        logger.info(f"В очередь добавлено {added} скриншотов")
+
+    def process_queue_batch(self) -> bool:
+        """Берёт в аренду и обрабатывает пачку задач очереди; False, если свободных задач нет"""
+        items = self.work_queue.claim(self.session, WORK_QUEUE_BATCH_SIZE)
+        if not items:
+            return False
+
+        queue_ids = {insider_id: item_id for item_id, insider_id, _ in items}
+        # Скриншот мог успеть сохранить узел, у которого истекла аренда
+        existing = self.existing_insider_ids(list(queue_ids))
+        employee_ids = {employee_id for _, _, employee_id in items}
+        frame_keys = dict(self.session.query(Employee.id, Employee.insider_id).filter(Employee.id.in_(employee_ids)))
+        captured = dict(self.session.query(QueueItem.id, QueueItem.captured_at).filter(
+            QueueItem.id.in_(list(queue_ids.values()))
+        ))
+        jobs = [
+            ScreenshotJob(insider_id, employee_id, frame_keys.get(employee_id), captured.get(item_id))
+            for item_id, insider_id, employee_id in items if insider_id not in existing
+        ]
+
+        pipeline = self.create_pipeline()
+        if jobs:
+            try:
+                pipeline.run(jobs)
+            except Exception as e:
+                # Несохранённые задачи ниже вернутся в очередь как неудачные
+                logger.error(f"Ошибка при обработке пачки очереди: {e}")
+                self.session.rollback()
+
+        done = existing | pipeline.duplicates | self.existing_insider_ids([job.file_id for job in jobs])
+        unfinished = [item_id for insider_id, item_id in queue_ids.items() if insider_id not in done]
+        self.work_queue.complete(self.session, [queue_ids[insider_id] for insider_id in done])
+        if self.sweep_running:
+            self.work_queue.fail(self.session, unfinished)
+        else:
+            # Остановка узла: недоделанное заберут другие узлы
+            self.work_queue.release(self.session, unfinished)
+        logger.info(f"Очередь: пачка из {len(items)} задач, выполнено {len(done)}, не выполнено {len(unfinished)}")
+        return True
+
+    def process_work_queue(self):
+        """Режим общей очереди: постановка новых скриншотов и обработка пачек, взятых в аренду"""
+        if WORK_QUEUE_ROLE in ('all', 'producer'):
+            self.enqueue_new_screenshots()
+        if WORK_QUEUE_ROLE in ('all', 'worker'):
+            self.work_queue.start_heartbeat()
+            try:
+                while self.sweep_running and self.process_queue_batch():
+                    pass
+            finally:
+                self.work_queue.stop_heartbeat()
+        logger.info(f"Состояние очереди: {self.work_queue.stats(self.session)}")
+
     def process_all_employees(self):
         """Обработка скриншотов для всех сотрудников"""
         try:
             logger.info("Начало обработки всех сотрудников")
-            # Синхронизация списка сотрудников
-            self.insider_service.sync_employees()
-            
-            # Получение всех сотрудников
-            employees = self.session.query(Employee).all()
-            logger.info(f"Найдено {len(employees)} сотрудников для обработки")
-            
-            for employee in employees:
-                if not self.running:
-                    break
-                self.process_employee_screenshots(employee)
+            if self.work_queue is not None:
+                self.process_work_queue()
+            elif ASYNC_ENABLED:
+                # Асинхронный обход сам синхронизирует сотрудников
+                asyncio.run(AsyncScreenshotCrawler(self).run())
+            else:
+                # Синхронизация списка сотрудников
+                self.insider_service.sync_employees()
+                
+                # Получение всех сотрудников
+                employees = self.ordered_employees()
+                logger.info(f"Найдено {len(employees)} сотрудников для обработки")
+                
+                if PIPELINE_ENABLED or self.ocr_pool is not None:
+                    self.process_employees_pipeline(employees)
+                else:
+                    resumed = self.process_resumed_screenshots()
+                    for employee, screenshots in self.insider_service.get_new_screenshots_batch(employees):
+                        if not self.sweep_running:
+                            break
+                        self.process_employee_screenshots(employee, screenshots, skip=resumed)
+                    if self.checkpoints is not None:
+                        self.checkpoints.settle()
             
-            # Очистка старых скриншотов
-            self.insider_service.cleanup_old_screenshots()
+            self.writer.flush()
+
+            # Очистка старых скриншотов и перестроение индекса хешей без удалённых записей
+            if self.insider_service.cleanup_old_screenshots():
+                self.hash_index.load(self.session)
+            if self.work_queue is not None and RETENTION_DAYS > 0:
+                self.work_queue.purge(self.session, timedelta(days=RETENTION_DAYS))
+            if self.checkpoints is not None and RETENTION_DAYS > 0:
+                purge_finished_states(self.session, timedelta(days=RETENTION_DAYS))
             
             # Очистка временных файлов
-            self.image_processor.cleanup()
+            ImageProcessor.cleanup()
+
+            ocr_stats, spell_stats = self.cache_stats()
+            if ocr_stats:
+                logger.info(
+                    f"Кэш OCR: попаданий {ocr_stats['hits']}, промахов {ocr_stats['misses']}, "
+                    f"доля попаданий {ocr_stats['hit_rate']:.1%}"
+                )
+            if spell_stats:
+                size = f"{spell_stats['size']} слов, " if 'size' in spell_stats else ''
+                logger.info(
+                    f"Кэш орфографии: {size}доля попаданий {spell_stats['hit_rate']:.1%}, "
+                    f"пропущено чисел и ID {spell_stats['skipped']}, Hunspell на новое слово {spell_stats['miss_ms']:.1f} мс"
+                )
             
             logger.info("Завершена обработка всех сотрудников")
             
         except Exception as e:
             logger.error(f"Ошибка при обработке всех сотрудников: {e}")
 
+    def cache_stats(self) -> tuple:
+        """Счётчики кэша OCR и кэша орфографии: свои или сводные по воркерам пула процессов.
+
+        Кэш орфографии своего ImageProcessor при этом сохраняется на диск; воркеры пула
+        сохраняют свой при остановке пула.
+        """
+        if self.ocr_pool is not None:
+            return self.ocr_pool.cache_stats()
+        ocr_stats = spell_stats = None
+        if self.image_processor.loaded('ocr_cache'):
+            ocr_stats = self.image_processor.ocr_cache.stats()
+        if self.image_processor.loaded('text_corrector'):
+            corrector = self.image_processor.textCorrector
+            corrector.save()
+            spell_stats = corrector.stats()
+        return ocr_stats, spell_stats
+
+    def preload_models(self):
+        if self.image_processor is not None and MODEL_PRELOAD:
+            # Модели загружаются, пока идут синхронизация сотрудников и первые скачивания
+            self.image_processor.preload()
+
+    def run_sweep(self):
+        """Один обход по расписанию; новый обход не начинается, пока не закончен предыдущий"""
+        if not self._sweep_lock.acquire(blocking=False):
+            self.skipped_sweeps += 1
+            logger.warning("Предыдущий обход ещё не завершён, запуск пропущен")
+            return
+
+        try:
+            started_at = datetime.now()
+            started = time.monotonic()
+            self.sweep_deadline = started + SWEEP_MAX_DURATION if SWEEP_MAX_DURATION else None
+            self.finished_employees = set()
+            last_id_before = self.session.query(func.max(Screenshot.id)).scalar() or 0
+            if self.carry_over:
+                logger.info(f"Продолжение обхода: {len(self.carry_over)} сотрудников не закончены в прошлый раз")
+
+            self.process_all_employees()
+
+            # Узел, который только обрабатывает очередь, сотрудников не обходит
+            employees = [] if self.work_queue is not None and WORK_QUEUE_ROLE == 'worker' else self.ordered_employees()
+            self.carry_over = [employee.id for employee in employees if employee.id not in self.finished_employees]
+            self.sweep_count += 1
+            duration = time.monotonic() - started
+            last_id_after = self.session.query(func.max(Screenshot.id)).scalar() or 0
+            self.write_sweep_status({
+                'sweep': self.sweep_count,
+                'started_at': started_at.isoformat(timespec='seconds'),
+                'duration': round(duration, 1),
+                'interval': SCHEDULE_INTERVAL,
+                # Обход дольше интервала - обработка не успевает за поступлением скриншотов
+                'behind': duration > SCHEDULE_INTERVAL,
+                'saved': max(0, last_id_after - last_id_before),
+                'employees': len(employees),
+                'unfinished_employees': len(self.carry_over),
+                'skipped_sweeps': self.skipped_sweeps,
+                **({'queue': self.work_queue.stats(self.session)} if self.work_queue is not None else {}),
+            })
+        except Exception as e:
+            logger.error(f"Ошибка при обходе по расписанию: {e}")
+            self.session.rollback()
+        finally:
+            self.sweep_deadline = None
+            self._sweep_lock.release()
+
+    def write_sweep_status(self, status: dict):
+        """Пишет метрики обхода в лог и в файл состояния для просмотрщика"""
+        log = logger.warning if status['behind'] or status['unfinished_employees'] else logger.info
+        log(
+            f"Обход #{status['sweep']} за {status['duration']} с (интервал {status['interval']} с), "
+            f"сохранено {status['saved']}, не закончено сотрудников {status['unfinished_employees']} из {status['employees']}"
+        )
+        try:
+            tmp_path = f"{SWEEP_STATUS_PATH}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(status, f, ensure_ascii=False)
+            os.replace(tmp_path, SWEEP_STATUS_PATH)
+        except OSError as e:
+            logger.error(f"Не удалось записать состояние обхода: {e}")
+
+    def run_daemon(self):
+        """Режим демона: модели загружаются один раз, обходы идут каждые SCHEDULE_INTERVAL секунд"""
+        logger.info(f"Запуск обработчика скриншотов в режиме демона, интервал {SCHEDULE_INTERVAL} с")
+        self.preload_models()
+
+        # Следующий обход отсчитывается от окончания предыдущего, поэтому обходы не накладываются
+        schedule.every(SCHEDULE_INTERVAL).seconds.do(self.run_sweep)
+        self.run_sweep()
+        while self.running:
+            schedule.run_pending()
+            time.sleep(1)
+
+        schedule.clear()
+        if self.ocr_pool is not None:
+            self.ocr_pool.close()
+        if self.checkpoints is not None:
+            self.checkpoints.close()
+        logger.info("Обработчик скриншотов остановлен")
+
     def run(self):
         """Запуск обработчика скриншотов"""
         logger.info("Запуск обработчика скриншотов")
+        self.preload_models()
         self.process_all_employees()
-        self.insider_service.cleanup_old_screenshots()
-        logger.info("Завершена обработка всех сотрудников")
+
+        if self.ocr_pool is not None:
+            self.ocr_pool.close()
+        if self.checkpoints is not None:
+            self.checkpoints.close()
         
-        # Вывод результатов обработки скриншотов
-        self.print_processed_screenshots()
+        # Краткая сводка вместо вывода всей таблицы
+        self.log_processed_summary()
 
-    def print_processed_screenshots(self):
-        """Вывод результатов обработки скриншотов"""
+    def log_processed_summary(self, last_n: int = SUMMARY_LAST_N):
+        """Сводка по базе: число скриншотов, диапазон дат и последние last_n записей с обрезанным текстом"""
         try:
-            screenshots = self.session.query(Screenshot).all()
-            
-            if not screenshots:
+            total, first_at, last_at = self.session.query(
+                func.count(Screenshot.id), func.min(Screenshot.processed_at), func.max(Screenshot.processed_at)
+            ).one()
+            if not total:
                 logger.info("Нет обработанных скриншотов в базе данных.")
                 return
-            logger.info("Результаты обработки скриншотов:")
-            for screenshot in screenshots:
-                logger.info(f"ID: {screenshot.insider_id}, Текст: {screenshot.processed_text}, Дата обработки: {screenshot.processed_at}")
+            logger.info(f"В базе {total} скриншотов за период {first_at} - {last_at}, за этот запуск сохранено {self.writer.saved}")
+
+            latest = self.session.query(
+                Screenshot.insider_id, Screenshot.processed_at, func.substr(Screenshot.processed_text, 1, 100)
+            ).order_by(Screenshot.id.desc()).limit(last_n)
+            for insider_id, processed_at, text in latest:
+                logger.info(f"ID: {insider_id}, Текст: {text}, Дата обработки: {processed_at}")
         except Exception as e:
-            logger.error(f"Ошибка при выводе результатов обработки скриншотов: {e}")
\ No newline at end of file
+            logger.error(f"Ошибка при выводе сводки по скриншотам: {e}")
\ No newline at end of file
@@ -0,0 +1,166 @@
+# -буферизованная запись новых скриншотов в БД пачками
+import threading
+import time
+from datetime import datetime
+from loguru import logger
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from config import DB_WRITE_BATCH_SIZE, DB_WRITE_FLUSH_INTERVAL
+from models import Screenshot, ScreenshotEntity
+
+
+class ScreenshotWriter:
+    """Копит новые строки screenshots и вставляет их одной транзакцией на N строк или T секунд.
+
+    Сущности из processed_text (AnalysisResult.entities) вставляются в screenshot_entities
+    в той же транзакции, что и сам скриншот. С checkpoints (CheckpointStore) в той же
+    транзакции записываются накопленные результаты этапов, а состояние сохранённых
+    скриншотов переводится в stored. После commit хеши сохранённых скриншотов
+    подтверждаются в hash_index (NearDuplicateIndex).
+    """
+
+    def __init__(self, session, batch_size: int = DB_WRITE_BATCH_SIZE, flush_interval: float = DB_WRITE_FLUSH_INTERVAL,
+                 checkpoints=None, hash_index=None):
+        self.session = session
+        self.checkpoints = checkpoints
+        self.hash_index = hash_index
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.saved = 0
+        self._rows = []
+        self._entities = {}
+        self._first_added = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, **row) -> bool:
+        """Добавляет строку в буфер; False, если скриншот с таким insider_id уже ждёт записи"""
+        with self._lock:
+            if row['insider_id'] in self._entities:
+                return False
+            self._entities[row['insider_id']] = getattr(row['processed_text'], 'entities', None) or []
+            row['processed_text'] = str(row['processed_text'])
+            row.setdefault('processed_at', datetime.utcnow())
+            self._rows.append(row)
+            if self._first_added is None:
+                self._first_added = time.monotonic()
+            if len(self._rows) >= self.batch_size or time.monotonic() - self._first_added >= self.flush_interval:
+                try:
+                    self._flush()
+                except Exception:
+                    # Строки остались в буфере; ошибку получит вызывающий flush()
+                    pass
+        return True
+
+    def flush(self) -> int:
+        """Записывает всё накопленное; возвращает число сохранённых строк.
+
+        При ошибке БД строки остаются в буфере, а исключение пробрасывается: вызывающий
+        не должен сдвигать отметку синхронизации.
+        """
+        with self._lock:
+            return self._flush()
+
+    def discard(self) -> list:
+        """Отбрасывает несохранённые строки и возвращает их insider_id"""
+        with self._lock:
+            insider_ids = [row['insider_id'] for row in self._rows]
+            self._rows, self._entities, self._first_added = [], {}, None
+            return insider_ids
+
+    def _flush(self) -> int:
+        stages = self.checkpoints.take() if self.checkpoints is not None else {}
+        if not self._rows and not stages:
+            return 0
+        rows, entities = self._rows, self._entities
+        self._rows, self._entities, self._first_added = [], {}, None
+        try:
+            if stages:
+                self.checkpoints.write(self.session, stages)
+            if rows:
+                self._insert(rows, entities)
+            self.session.commit()
+            saved = len(rows)
+        except IntegrityError:
+            # Скриншот уже сохранён другим процессом: вставляем по одному, пропуская дубликаты
+            self.session.rollback()
+            saved = self._insert_one_by_one(rows, entities, stages)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении пачки из {len(rows)} скриншотов: {e}")
+            self.session.rollback()
+            self._restore(rows, entities, stages)
+            raise
+
+        self._confirm(rows)
+        if self.checkpoints is not None:
+            self.checkpoints.remove_spool([row['insider_id'] for row in rows])
+        self.saved += saved
+        if rows:
+            logger.debug(f"Сохранено {saved} скриншотов")
+        return saved
+
+    def _insert(self, rows: list, entities: dict):
+        inserted = self.session.execute(
+            insert(Screenshot).returning(Screenshot.id, Screenshot.insider_id), rows
+        ).all()
+        by_insider_id = {row['insider_id']: row for row in rows}
+        entity_rows = []
+        for screenshot_id, insider_id in inserted:
+            row = by_insider_id[insider_id]
+            for entity in entities.get(insider_id, ()):
+                entity_rows.append({
+                    **entity,
+                    'screenshot_id': screenshot_id,
+                    'employee_id': row.get('employee_id'),
+                    # День активности; у записей без него - день обработки
+                    'day': (row.get('captured_at') or row['processed_at']).date(),
+                })
+        if entity_rows:
+            self.session.execute(insert(ScreenshotEntity), entity_rows)
+        if self.checkpoints is not None:
+            self.checkpoints.mark_stored(self.session, [insider_id for _, insider_id in inserted])
+
+    def _insert_one_by_one(self, rows: list, entities: dict, stages: dict) -> int:
+        if stages:
+            try:
+                self.checkpoints.write(self.session, stages)
+                self.session.commit()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении этапов обработки скриншотов: {e}")
+                self.session.rollback()
+                self._restore(rows, entities, stages)
+                raise
+        saved = 0
+        for index, row in enumerate(rows):
+            try:
+                self._insert([row], entities)
+                self.session.commit()
+                saved += 1
+            except IntegrityError:
+                self.session.rollback()
+                logger.debug(f"Скриншот {row['insider_id']} уже существует в базе")
+                if self.checkpoints is not None:
+                    self.checkpoints.mark_stored(self.session, [row['insider_id']])
+                    self.session.commit()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении скриншота {row['insider_id']}: {e}")
+                self.session.rollback()
+                self.saved += saved
+                self._confirm(rows[:index])
+                self._restore(rows[index:], entities)
+                raise
+        return saved
+
+    def _confirm(self, rows: list):
+        if self.hash_index is not None:
+            self.hash_index.confirm([row['insider_id'] for row in rows])
+
+    def _restore(self, rows: list, entities: dict, stages: dict = None):
+        """Возвращает несохранённые строки в начало буфера, а результаты этапов - в checkpoints"""
+        if stages:
+            self.checkpoints.put_back(stages)
+        self._rows = rows + self._rows
+        self._entities = {**{row['insider_id']: entities.get(row['insider_id'], []) for row in rows}, **self._entities}
+        self._first_added = time.monotonic()
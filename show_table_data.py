@@ -1,11 +1,20 @@
 from sqlalchemy import create_engine
-from config import DATABASE_URL, INSIDER_API_URL, INSIDER_API_KEY
+import json
+from datetime import date, datetime
+from typing import Optional
+from config import DATABASE_URL, INSIDER_API_URL, INSIDER_API_KEY, SWEEP_STATUS_PATH, SEARCH_MAX_LIMIT, PAGE_MAX_LIMIT, ENTITY_TOP_MAX_LIMIT
 from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, create_engine
-from fastapi import FastAPI, Request, Depends
+from fastapi import FastAPI, Request, Depends, HTTPException, Query
+from sqlalchemy.exc import OperationalError
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from models import Employee, Screenshot
 from db.database import SessionLocal
+from text_search import search_screenshots
+from screenshot_export import page_screenshots, iter_screenshots, to_ndjson, to_csv
+from entity_queries import ENTITY_TYPES, top_entities, screenshots_with_entity
+from checkpoint import dead_letters
 
 ### Для просмотра результата БД ### 
 app = FastAPI()
@@ -19,12 +28,122 @@ def get_db():
         db.close()
 
 @app.get("/")
-def read_screenshots(request: Request, db: Session = Depends(get_db)):
-    screenshots = db.query(Screenshot).order_by(Screenshot.id.desc()).limit(100).all()
+def read_screenshots(request: Request, cursor: Optional[int] = None, db: Session = Depends(get_db)):
+    query = db.query(Screenshot).order_by(Screenshot.id.desc())
+    if cursor is not None:
+        query = query.filter(Screenshot.id < cursor)
+    screenshots = query.limit(100).all()
     return templates.TemplateResponse("index.html", {
         "request": request, 
         "data": screenshots, 
+        "next_cursor": screenshots[-1].id if len(screenshots) == 100 else None,
         "url": INSIDER_API_URL,
         "key": INSIDER_API_KEY
         })
 
+
+@app.get("/api/screenshots")
+def list_screenshots(
+    limit: int = Query(50, ge=1, le=PAGE_MAX_LIMIT),
+    cursor: Optional[int] = None,
+    employee_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    include_text: bool = True,
+    db: Session = Depends(get_db),
+):
+    """Страница скриншотов от новых к старым; следующая страница - ?cursor=<next_cursor>"""
+    return page_screenshots(db, limit, cursor, employee_id, date_from, date_to, include_text)
+
+
+@app.get("/export")
+def export_screenshots(
+    format: str = Query('ndjson', pattern='^(ndjson|csv)$'),
+    employee_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    include_text: bool = True,
+):
+    """Потоковая выгрузка в NDJSON или CSV; память не растёт с размером таблицы"""
+    def stream():
+        # Своя сессия: ответ читается уже после выхода из обработчика
+        db = SessionLocal()
+        try:
+            rows = iter_screenshots(db, employee_id, date_from, date_to, include_text)
+            yield from (to_csv(rows, include_text) if format == 'csv' else to_ndjson(rows))
+        finally:
+            db.close()
+
+    media_type = 'text/csv; charset=utf-8' if format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(stream(), media_type=media_type, headers={
+        'Content-Disposition': f'attachment; filename="screenshots.{format}"'
+    })
+
+
+@app.get("/search")
+def search(
+    q: str,
+    employee_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    """Полнотекстовый поиск по распознанному тексту: слова, "фразы", префиксы слово*"""
+    try:
+        results = search_screenshots(db, q, employee_id, date_from, date_to, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except OperationalError as e:
+        raise HTTPException(status_code=503, detail=f"Полнотекстовый индекс недоступен: {e.orig}")
+    return {"query": q, "count": len(results), "results": results}
+
+
+@app.get("/api/entities/top")
+def entities_top(
+    employee_id: Optional[int] = None,
+    day_from: Optional[date] = None,
+    day_to: Optional[date] = None,
+    type: Optional[str] = Query(None, pattern=f"^({'|'.join(ENTITY_TYPES)})$"),
+    by_day: bool = False,
+    limit: int = Query(20, ge=1, le=ENTITY_TOP_MAX_LIMIT),
+    db: Session = Depends(get_db),
+):
+    """Самые частые сущности; by_day=true - топ для каждого сотрудника и дня"""
+    return {"items": top_entities(db, employee_id, day_from, day_to, type, by_day, limit)}
+
+
+@app.get("/api/entities/screenshots")
+def entity_screenshots(
+    lemma: str,
+    type: Optional[str] = Query(None, pattern=f"^({'|'.join(ENTITY_TYPES)})$"),
+    employee_id: Optional[int] = None,
+    day_from: Optional[date] = None,
+    day_to: Optional[date] = None,
+    limit: int = Query(50, ge=1, le=PAGE_MAX_LIMIT),
+    db: Session = Depends(get_db),
+):
+    """Скриншоты, в которых упоминается сущность с данной нормальной формой"""
+    return {"items": screenshots_with_entity(db, lemma, type, employee_id, day_from, day_to, limit)}
+
+
+@app.get("/api/dead-letters")
+def list_dead_letters(
+    limit: int = Query(50, ge=1, le=PAGE_MAX_LIMIT),
+    cursor: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """Скриншоты, исчерпавшие попытки обработки, с последней ошибкой; вернуть в обработку - utilscripts/requeue_dead_letters.py"""
+    items = dead_letters(db, limit, cursor)
+    return {"items": items, "next_cursor": items[-1]['id'] if len(items) == limit else None}
+
+
+@app.get("/status")
+def sweep_status():
+    """Метрики последнего обхода: длительность, отставание от интервала, незаконченные сотрудники"""
+    try:
+        with open(SWEEP_STATUS_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"detail": "Обходы ещё не выполнялись"}
@@ -0,0 +1,145 @@
+# -поиск областей с текстом на скриншоте перед OCR
+import os
+import cv2
+import numpy as np
+from loguru import logger
+from config import (
+    TEXT_REGION_MODEL,
+    TEXT_REGION_CONF,
+    TEXT_REGION_IGNORE_TOP,
+    TEXT_REGION_IGNORE_BOTTOM,
+    TEXT_REGION_PADDING,
+    TEXT_REGION_MAX_AREA_RATIO
+)
+
+# Блоки выше этого делятся на полосы по промежуткам между строками
+MAX_BLOCK_HEIGHT = 200
+
+
+class TextRegionDetector:
+    """Находит окна и блоки с текстом: детектор YOLO, если есть модель, иначе морфология OpenCV.
+
+    detect возвращает прямоугольники [x0, y0, x1, y1] в порядке чтения или None,
+    если областей не найдено или текст занимает большую часть кадра: тогда
+    распознаётся весь кадр.
+    """
+
+    def __init__(self, model_path=TEXT_REGION_MODEL, conf: float = TEXT_REGION_CONF,
+                 ignore_top: int = TEXT_REGION_IGNORE_TOP, ignore_bottom: int = TEXT_REGION_IGNORE_BOTTOM,
+                 padding: int = TEXT_REGION_PADDING, max_area_ratio: float = TEXT_REGION_MAX_AREA_RATIO):
+        self.conf = conf
+        self.ignore_top = ignore_top
+        self.ignore_bottom = ignore_bottom
+        self.padding = padding
+        self.max_area_ratio = max_area_ratio
+        self.model = None
+
+        if model_path and os.path.exists(model_path):
+            from ultralytics import YOLO
+            self.model = YOLO(str(model_path))
+            self.mode = f"yolo-{os.path.basename(model_path)}-{os.path.getmtime(model_path):.0f}"
+        else:
+            self.mode = "morph"
+        logger.info(f"Поиск областей текста: {'YOLO ' + str(model_path) if self.model else 'морфология OpenCV'}")
+
+    @property
+    def version(self) -> str:
+        """Строка настроек для ключа кэша OCR"""
+        return (f"{self.mode}:{self.conf}:{self.ignore_top}:{self.ignore_bottom}:"
+                f"{self.padding}:{self.max_area_ratio}")
+
+    def _detect_yolo(self, image: np.ndarray) -> list:
+        result = self.model.predict(image, conf=self.conf, verbose=False)[0]
+        return [[int(v) for v in box] for box in result.boxes.xyxy.tolist()]
+
+    @staticmethod
+    def _detect_morph(image: np.ndarray) -> list:
+        # Контуры символов через морфологический градиент, затем склейка символов в строки и блоки
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+        _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        connected = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 5)))
+
+        count, _, stats, _ = cv2.connectedComponentsWithStats(connected, connectivity=8)
+        boxes = []
+        for x, y, w, h, area in stats[1:count]:
+            if h < 8 or w < 12:
+                continue
+            # Плотный абзац после склейки сливается в один высокий блок: делим его на полосы
+            bands = TextRegionDetector._split_tall(binary, x, y, w, h) if h > MAX_BLOCK_HEIGHT else [(y, y + h)]
+            for y0, y1 in bands:
+                # Блок текста заполнен штрихами
+                if y1 - y0 < 8 or cv2.countNonZero(binary[y0:y1, x:x + w]) < 0.1 * w * (y1 - y0):
+                    continue
+                boxes.append([int(x), int(y0), int(x + w), int(y1)])
+        return boxes
+
+    @staticmethod
+    def _split_tall(binary: np.ndarray, x: int, y: int, w: int, h: int) -> list:
+        """Полосы (y0, y1) не выше MAX_BLOCK_HEIGHT, разрезанные только по промежуткам между строками.
+
+        Промежуток - строка пикселей со штрихами не более 10% от самой заполненной строки блока
+        (выносные элементы букв). Участок без промежутков выше MAX_BLOCK_HEIGHT остаётся целым,
+        чтобы не резать символы.
+        """
+        ink = np.count_nonzero(binary[y:y + h, x:x + w], axis=1)
+        filled = ink > 0.1 * ink.max()
+        # Непрерывные участки строк со штрихами
+        runs = []
+        start = None
+        for row, has_ink in enumerate(filled):
+            if has_ink and start is None:
+                start = row
+            elif not has_ink and start is not None:
+                runs.append((start, row))
+                start = None
+        if start is not None:
+            runs.append((start, h))
+
+        bands = []
+        for run_start, run_stop in runs:
+            if bands and run_stop - bands[-1][0] <= MAX_BLOCK_HEIGHT:
+                bands[-1][1] = run_stop
+            else:
+                bands.append([run_start, run_stop])
+        return [(y + band_start, y + band_stop) for band_start, band_stop in bands]
+
+    def detect(self, image: np.ndarray):
+        height, width = image.shape[:2]
+        boxes = self._detect_yolo(image) if self.model is not None else self._detect_morph(image)
+
+        # Панель задач и полосы заголовков не несут полезного текста
+        top, bottom = self.ignore_top, height - self.ignore_bottom
+        regions = []
+        for x0, y0, x1, y1 in boxes:
+            y0, y1 = max(y0, top), min(y1, bottom)
+            if y1 <= y0:
+                continue
+            regions.append([max(0, x0 - self.padding), max(0, y0 - self.padding),
+                            min(width, x1 + self.padding), min(height, y1 + self.padding)])
+
+        if not regions:
+            return None
+        regions = self._merge(regions)
+        covered = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+        if covered > self.max_area_ratio * width * height:
+            return None
+        return sorted(regions, key=lambda r: (r[1], r[0]))
+
+    @staticmethod
+    def _merge(regions: list) -> list:
+        """Сливает пересекающиеся прямоугольники, чтобы текст не распознавался дважды"""
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a, b = regions[i], regions[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return regions
@@ -0,0 +1,115 @@
+# -полнотекстовый поиск по распознанному тексту скриншотов (SQLite FTS5)
+import re
+from datetime import datetime
+from typing import Optional
+from loguru import logger
+from sqlalchemy import column, literal_column, select, table, text
+from sqlalchemy.exc import OperationalError
+from config import FTS_ENABLED, FTS_TOKENIZER, FTS_PREFIX_LENGTHS
+from models import Screenshot
+
+FTS_TABLE = 'screenshots_fts'
+
+# Внешнее содержимое: текст хранится только в screenshots, индекс синхронизируют триггеры
+_CREATE_STATEMENTS = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        processed_text, content='screenshots', content_rowid='id',
+        tokenize='{FTS_TOKENIZER}', prefix='{FTS_PREFIX_LENGTHS}'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS screenshots_fts_insert AFTER INSERT ON screenshots BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, processed_text) VALUES (new.id, new.processed_text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS screenshots_fts_delete AFTER DELETE ON screenshots BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, processed_text) VALUES ('delete', old.id, old.processed_text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS screenshots_fts_update AFTER UPDATE OF processed_text ON screenshots BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, processed_text) VALUES ('delete', old.id, old.processed_text);
+        INSERT INTO {FTS_TABLE}(rowid, processed_text) VALUES (new.id, new.processed_text);
+    END""",
+)
+
+_fts = table(FTS_TABLE, column('rowid'))
+
+# "фраза в кавычках" или отдельное слово, возможно со звёздочкой на конце (префикс)
+TOKEN_PATTERN = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+
+
+def fts_available(engine) -> bool:
+    return FTS_ENABLED and engine.dialect.name == 'sqlite'
+
+
+def ensure_fts_index(engine) -> bool:
+    """Создаёт FTS5-таблицу и триггеры; при первом создании индексирует уже сохранённые скриншоты"""
+    if not fts_available(engine):
+        return False
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+            ).first() is not None
+            for statement in _CREATE_STATEMENTS:
+                conn.execute(text(statement))
+    except OperationalError as e:
+        logger.warning(f"Полнотекстовый поиск недоступен (SQLite собран без FTS5?): {e}")
+        return False
+    if not exists:
+        rebuild_fts_index(engine)
+    return True
+
+
+def rebuild_fts_index(engine):
+    """Заново строит индекс по всей таблице screenshots"""
+    with engine.begin() as conn:
+        count = conn.execute(text("SELECT COUNT(*) FROM screenshots")).scalar()
+        logger.info(f"Построение полнотекстового индекса по {count} скриншотам")
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    return count
+
+
+def build_match_query(query: str) -> str:
+    """Переводит пользовательский запрос в выражение FTS5.
+
+    Слова объединяются через AND, "фраза в кавычках" ищется целиком, слово* - по префиксу.
+    Каждый терм экранируется кавычками, поэтому пунктуация из запроса не ломает синтаксис FTS5.
+    """
+    terms = []
+    for phrase, phrase_prefix, word in TOKEN_PATTERN.findall(query or ''):
+        prefix = phrase_prefix if phrase else ('*' if word.endswith('*') else '')
+        value = (phrase if phrase else word.rstrip('*').replace('"', '')).strip()
+        if value:
+            terms.append(f'"{value}"{prefix}')
+    if not terms:
+        raise ValueError("Пустой поисковый запрос")
+    return ' '.join(terms)
+
+
+def search_screenshots(db, query: str, employee_id: Optional[int] = None,
+                       date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                       limit: int = 50, offset: int = 0) -> list:
+    """Ищет скриншоты по тексту; результаты отсортированы по релевантности bm25"""
+    rank = literal_column(f"bm25({FTS_TABLE})")
+    statement = (
+        select(
+            Screenshot.id,
+            Screenshot.insider_id,
+            Screenshot.employee_id,
+            Screenshot.captured_at,
+            Screenshot.processed_at,
+            rank.label('rank'),
+            literal_column(f"snippet({FTS_TABLE}, 0, '[', ']', '…', 16)").label('snippet'),
+        )
+        .join(_fts, _fts.c.rowid == Screenshot.id)
+        .where(text(f"{FTS_TABLE} MATCH :match").bindparams(match=build_match_query(query)))
+        .order_by(rank)
+        .limit(limit)
+        .offset(offset)
+    )
+    if employee_id is not None:
+        statement = statement.where(Screenshot.employee_id == employee_id)
+    if date_from is not None:
+        statement = statement.where(Screenshot.activity_at >= date_from)
+    if date_to is not None:
+        statement = statement.where(Screenshot.activity_at < date_to)
+
+    return [dict(row._mapping) for row in db.execute(statement)]
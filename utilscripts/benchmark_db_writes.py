@@ -0,0 +1,80 @@
+# Сравнение скорости записи скриншотов в SQLite: по одной строке с commit на настройках
+# по умолчанию и пакетная запись ScreenshotWriter с WAL/synchronous=NORMAL.
+# Запуск из корня проекта: python utilscripts/benchmark_db_writes.py --rows 5000
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from db.database import Base, apply_sqlite_pragmas
+from models import Screenshot
+from screenshot_writer import ScreenshotWriter
+
+
+def make_row(index: int) -> dict:
+    return {
+        'insider_id': f"bench-{index}",
+        'employee_id': 1,
+        'file_path': f"temp/bench-{index}.jpg",
+        'processed_text': "Отчёт по задаче " * 40,
+        'image_hash': f"{index:016x}",
+        'hash_value': index,
+        'hash_algorithm': 'ahash',
+        'file_size': 250000,
+    }
+
+
+def make_session(path: str, tuned: bool):
+    engine = create_engine(f"sqlite:///{path}")
+    if tuned:
+        apply_sqlite_pragmas(engine)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def run_per_row(path: str, rows: int) -> float:
+    session = make_session(path, tuned=False)
+    started = time.perf_counter()
+    for index in range(rows):
+        session.add(Screenshot(**make_row(index)))
+        session.commit()
+    elapsed = time.perf_counter() - started
+    session.close()
+    return elapsed
+
+
+def run_batched(path: str, rows: int, batch_size: int) -> float:
+    session = make_session(path, tuned=True)
+    writer = ScreenshotWriter(session, batch_size=batch_size, flush_interval=3600)
+    started = time.perf_counter()
+    for index in range(rows):
+        writer.add(**make_row(index))
+    writer.flush()
+    elapsed = time.perf_counter() - started
+    session.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк записи скриншотов в SQLite")
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = run_per_row(os.path.join(tmp, 'before.db'), args.rows)
+        after = run_batched(os.path.join(tmp, 'after.db'), args.rows, args.batch_size)
+
+    print(f"Строк: {args.rows}")
+    print(f"По одной, настройки по умолчанию: {before:.2f} с, {args.rows / before:.0f} строк/с")
+    print(f"Пачками по {args.batch_size}, WAL/NORMAL:   {after:.2f} с, {args.rows / after:.0f} строк/с")
+    print(f"Ускорение: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
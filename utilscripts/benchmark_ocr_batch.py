@@ -0,0 +1,49 @@
+# Сравнение пропускной способности OCR: по одному изображению и пакетами.
+# Запуск из корня проекта: python utilscripts/benchmark_ocr_batch.py --limit 16
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processor import ImageProcessor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пакетного OCR")
+    parser.add_argument('--images', default='outputs/*.jpg', help="маска файлов изображений")
+    parser.add_argument('--limit', type=int, default=16, help="сколько изображений взять")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.images))[:args.limit]
+    if not paths:
+        print(f"Не найдено изображений по маске {args.images}")
+        return
+
+    processor = ImageProcessor()
+    images = [processor.load_image(path) for path in paths]
+
+    # Прогрев моделей, чтобы не учитывать первую инициализацию
+    processor.data_in_image(images[0])
+
+    started = time.perf_counter()
+    single = [processor.data_in_image(image) for image in images]
+    single_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = processor.data_in_images(images)
+    batched_time = time.perf_counter() - started
+
+    same_text = sum(
+        processor.extract_text(a) == processor.extract_text(b) for a, b in zip(single, batched)
+    )
+    print(f"Изображений: {len(images)}")
+    print(f"По одному: {single_time:.2f} с, {len(images) / single_time:.2f} изобр/с")
+    print(f"Пакетами:  {batched_time:.2f} с, {len(images) / batched_time:.2f} изобр/с")
+    print(f"Ускорение: {single_time / batched_time:.2f}x, совпадение текста: {same_text}/{len(images)}")
+
+
+if __name__ == "__main__":
+    main()
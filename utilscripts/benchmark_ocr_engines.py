@@ -0,0 +1,93 @@
+# Сравнение движков OCR по точности и задержке на размеченных скриншотах.
+# Эталонный текст лежит рядом с изображением в файле с тем же именем и расширением .txt.
+# Запуск из корня проекта: python utilscripts/benchmark_ocr_engines.py --images 'samples/*.jpg'
+import argparse
+import glob
+import os
+import re
+import statistics
+import sys
+import time
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ocr_engine import ENGINES, create_ocr_engine
+
+
+def normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def edit_distance(a, b) -> int:
+    """Расстояние Левенштейна между строками или списками слов"""
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+def load_samples(pattern: str) -> list:
+    samples = []
+    for path in sorted(glob.glob(pattern)):
+        reference_path = os.path.splitext(path)[0] + '.txt'
+        if not os.path.exists(reference_path):
+            continue
+        with open(reference_path, 'r', encoding='utf-8') as f:
+            samples.append((path, cv2.imread(path), normalize(f.read())))
+    return samples
+
+
+def benchmark(engine, samples: list) -> dict:
+    # Прогрев моделей, чтобы не учитывать первую инициализацию
+    engine.readtext(samples[0][1])
+
+    latencies, char_errors, chars, word_errors, words = [], 0, 0, 0, 0
+    for _, image, reference in samples:
+        started = time.perf_counter()
+        detections = engine.readtext(image)
+        latencies.append(time.perf_counter() - started)
+
+        text = normalize(' '.join(detection[1] for detection in detections))
+        char_errors += edit_distance(text, reference)
+        chars += len(reference)
+        word_errors += edit_distance(text.split(), reference.split())
+        words += len(reference.split())
+
+    latencies.sort()
+    return {
+        'cer': char_errors / max(1, chars),
+        'wer': word_errors / max(1, words),
+        'mean': statistics.mean(latencies),
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк движков OCR")
+    parser.add_argument('--images', default='samples/*.jpg', help="маска изображений с эталонными .txt рядом")
+    parser.add_argument('--engines', default=','.join(ENGINES), help="движки через запятую")
+    args = parser.parse_args()
+
+    samples = load_samples(args.images)
+    if not samples:
+        print(f"Не найдено изображений с эталонным текстом по маске {args.images}")
+        return
+
+    print(f"Изображений: {len(samples)}")
+    print(f"{'движок':<12}{'CER':>8}{'WER':>8}{'сред., с':>12}{'p95, с':>10}")
+    for name in args.engines.split(','):
+        try:
+            engine = create_ocr_engine(name.strip())
+        except Exception as e:
+            print(f"{name:<12}недоступен: {e}")
+            continue
+        result = benchmark(engine, samples)
+        print(f"{name:<12}{result['cer']:>8.3f}{result['wer']:>8.3f}{result['mean']:>12.3f}{result['p95']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
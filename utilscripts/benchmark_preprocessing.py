@@ -0,0 +1,65 @@
+# Сравнение профилей предобработки: точность распознавания против задержки.
+# Эталонный текст лежит рядом с изображением в файле с тем же именем и расширением .txt.
+# Запуск из корня проекта: python utilscripts/benchmark_preprocessing.py --images 'samples/*.jpg'
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_ocr_engines import load_samples, normalize, edit_distance
+from image_preprocessing import PROFILES, ImagePreprocessor
+from ocr_engine import create_ocr_engine
+from config import OCR_ENGINE
+
+
+def benchmark(engine, preprocessor: ImagePreprocessor, samples: list) -> dict:
+    engine.canvas_size = preprocessor.max_side or None
+    # Прогрев моделей, чтобы не учитывать первую инициализацию
+    engine.readtext(preprocessor.apply(samples[0][1])[0])
+
+    latencies, pixels, char_errors, chars = [], [], 0, 0
+    for _, image, reference in samples:
+        started = time.perf_counter()
+        prepared, _ = preprocessor.apply(image)
+        detections = engine.readtext(prepared)
+        latencies.append(time.perf_counter() - started)
+        pixels.append(prepared.shape[0] * prepared.shape[1])
+
+        text = normalize(' '.join(detection[1] for detection in detections))
+        char_errors += edit_distance(text, reference)
+        chars += len(reference)
+
+    return {
+        'cer': char_errors / max(1, chars),
+        'mean': statistics.mean(latencies),
+        'megapixels': statistics.mean(pixels) / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк профилей предобработки OCR")
+    parser.add_argument('--images', default='samples/*.jpg', help="маска изображений с эталонными .txt рядом")
+    parser.add_argument('--engine', default=OCR_ENGINE, help="движок OCR")
+    parser.add_argument('--profiles', default=','.join(PROFILES), help="профили через запятую")
+    args = parser.parse_args()
+
+    samples = load_samples(args.images)
+    if not samples:
+        print(f"Не найдено изображений с эталонным текстом по маске {args.images}")
+        return
+
+    engine = create_ocr_engine(args.engine)
+    print(f"Изображений: {len(samples)}, движок: {engine.version}")
+    print(f"{'профиль':<12}{'CER':>8}{'сред., с':>12}{'Мпикс':>8}")
+    for profile in args.profiles.split(','):
+        profile = profile.strip()
+        preprocessor = ImagePreprocessor(profile, grayscale=None, max_side=None, binarize=None)
+        result = benchmark(engine, preprocessor, samples)
+        print(f"{profile:<12}{result['cer']:>8.3f}{result['mean']:>12.3f}{result['megapixels']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
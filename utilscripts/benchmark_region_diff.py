@@ -0,0 +1,54 @@
+# Сравнение распознавания изменившихся областей с полным OCR на последовательности кадров.
+# Кадры берутся в порядке имён файлов как соседние скриншоты одного сотрудника.
+# Запуск из корня проекта: python utilscripts/benchmark_region_diff.py --images 'frames/*.jpg' --limit 40
+import argparse
+import difflib
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processor import ImageProcessor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Точность и скорость OCR изменившихся областей")
+    parser.add_argument('--images', default='outputs/*.jpg', help="маска файлов кадров")
+    parser.add_argument('--limit', type=int, default=40, help="сколько кадров взять")
+    parser.add_argument('--tolerance', type=float, default=0.95, help="минимальная доля совпадения текста")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.images))[:args.limit]
+    if not paths:
+        print(f"Не найдено изображений по маске {args.images}")
+        return
+
+    processor = ImageProcessor()
+    images = [processor.load_image(path) for path in paths]
+
+    # Прогрев моделей, чтобы не учитывать первую инициализацию
+    processor.data_in_image(images[0])
+
+    started = time.perf_counter()
+    full = [processor.extract_text(processor.data_in_image(image)) for image in images]
+    full_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    diff = [processor.extract_text(processor.data_in_changed_regions(image, 'benchmark')) for image in images]
+    diff_time = time.perf_counter() - started
+
+    ratios = [difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(full, diff)]
+    below = [(os.path.basename(path), ratio) for path, ratio in zip(paths, ratios) if ratio < args.tolerance]
+    print(f"Кадров: {len(images)}")
+    print(f"Полный OCR:           {full_time:.2f} с, {len(images) / full_time:.2f} кадр/с")
+    print(f"Изменившиеся области: {diff_time:.2f} с, {len(images) / diff_time:.2f} кадр/с")
+    print(f"Совпадение текста: среднее {sum(ratios) / len(ratios):.3f}, минимум {min(ratios):.3f}")
+    print(f"Ниже допуска {args.tolerance}: {len(below)}")
+    for name, ratio in below:
+        print(f"  {name}: {ratio:.3f}")
+
+
+if __name__ == "__main__":
+    main()
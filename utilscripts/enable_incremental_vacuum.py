@@ -0,0 +1,27 @@
+# Однократный перевод существующей базы SQLite в режим auto_vacuum=INCREMENTAL.
+# После этого очистка старых скриншотов возвращает освободившееся место через PRAGMA incremental_vacuum.
+# VACUUM переписывает весь файл базы: запускать при остановленном обработчике и с запасом места на диске.
+# Запуск из корня проекта: python utilscripts/enable_incremental_vacuum.py
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+from db.database import engine, enable_incremental_vacuum
+
+
+def main():
+    if engine.dialect.name != 'sqlite':
+        logger.info("База данных не SQLite, перевод не требуется")
+        return
+    started = time.monotonic()
+    if enable_incremental_vacuum():
+        logger.info(f"База переведена в режим auto_vacuum=INCREMENTAL за {time.monotonic() - started:.1f} с")
+    else:
+        logger.info("База уже в режиме auto_vacuum=INCREMENTAL")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+# Построение полнотекстового индекса по уже сохранённым скриншотам.
+# Новые и удалённые строки индекс подхватывает сам через триггеры; скрипт нужен для
+# первоначального заполнения и для восстановления индекса.
+# Запуск из корня проекта: python utilscripts/rebuild_fts.py
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database import engine, init_db
+from text_search import rebuild_fts_index, fts_available
+
+
+def main():
+    if not fts_available(engine):
+        print("Полнотекстовый поиск отключён (FTS_ENABLED) или база не SQLite")
+        return
+    init_db()
+    started = time.perf_counter()
+    count = rebuild_fts_index(engine)
+    print(f"Проиндексировано скриншотов: {count} за {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# Просмотр и возврат в обработку скриншотов из dead letter (исчерпавших CHECKPOINT_MAX_ATTEMPTS).
+# Запуск из корня проекта:
+#   python utilscripts/requeue_dead_letters.py --list
+#   python utilscripts/requeue_dead_letters.py              # вернуть все
+#   python utilscripts/requeue_dead_letters.py ID1 ID2      # вернуть выбранные insider_id
+# Возвращённые скриншоты обрабатываются в начале следующего обхода; в режиме общей очереди
+# их задачи снова становятся pending.
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database import SessionLocal, init_db
+from checkpoint import dead_letters, requeue_dead_letters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dead letter скриншотов: просмотр и повторная обработка")
+    parser.add_argument('insider_ids', nargs='*', help="insider_id скриншотов; без них - все из dead letter")
+    parser.add_argument('--list', action='store_true', help="только вывести список")
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    init_db()
+    session = SessionLocal()
+    try:
+        if args.list:
+            for item in dead_letters(session, args.limit):
+                print(f"{item['insider_id']}\tэтап {item['stage']}\tпопыток {item['attempts']}\t{item['last_error']}")
+            return
+        requeued = requeue_dead_letters(session, args.insider_ids or None)
+        print(f"Возвращено в обработку: {requeued}")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Проверка возврата dead letter в режиме общей очереди: скриншот, исчерпавший попытки во время
+# недоступности API, после requeue_dead_letters снова выдаётся узлу и сохраняется в базу.
+# API и OCR заменены заглушками, база - временный файл SQLite.
+# Запуск из корня проекта: python utilscripts/requeue_dead_letters_check.py
+import os
+import sys
+import tempfile
+
+TMP = tempfile.mkdtemp(prefix='requeue_check_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(TMP, 'check.db')}"
+os.environ['TEMP_DIR'] = TMP
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+from db.database import SessionLocal, init_db
+from checkpoint import CheckpointStore, requeue_dead_letters
+from hash_index import NearDuplicateIndex
+from image_processor import AnalysisResult
+from models import Employee, QueueItem, Screenshot, ScreenshotState
+from screenshot_processor import ScreenshotProcessor
+from work_queue import WorkQueue
+
+FILE_ID = 'requeue-check-1'
+
+
+class FakeInsiderService:
+    """API, который не отдаёт файлы, пока online=False"""
+
+    def __init__(self):
+        self.online = False
+        image = np.full((64, 64, 3), 255, dtype=np.uint8)
+        cv2.putText(image, 'ok', (8, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+        self.content = cv2.imencode('.jpg', image)[1].tobytes()
+
+    def fetch_screenshot(self, file_id: str) -> bytes:
+        return self.content if self.online else None
+
+
+class FakeImageProcessor:
+    """OCR и NLP без моделей"""
+
+    def cached_result(self, image):
+        return None, None
+
+    def ocr_detections(self, image, file_id, frame_key=None):
+        return [file_id]
+
+    def ocr_detections_batch(self, images, file_ids):
+        return [[file_id] for file_id in file_ids]
+
+    def extract_text(self, detections):
+        return ' '.join(detections)
+
+    def clean_ocr_text(self, text):
+        return text
+
+    def analyze_text(self, text):
+        return AnalysisResult(text, [])
+
+    def analyze_texts(self, texts):
+        return [self.analyze_text(text) for text in texts]
+
+    def store_result(self, *args):
+        pass
+
+
+def make_processor(insider_service) -> ScreenshotProcessor:
+    # Без __init__: обработчик не загружает модели и не ставит обработчики сигналов
+    processor = ScreenshotProcessor.__new__(ScreenshotProcessor)
+    processor.running = True
+    processor.sweep_deadline = None
+    processor.session = SessionLocal()
+    processor.insider_service = insider_service
+    processor.image_processor = FakeImageProcessor()
+    processor.ocr_pool = None
+    processor.hash_index = NearDuplicateIndex()
+    processor.work_queue = WorkQueue(SessionLocal, max_attempts=2, retry_seconds=0)
+    processor.checkpoints = CheckpointStore(SessionLocal, spool_dir=os.path.join(TMP, 'spool'), max_attempts=2)
+    return processor
+
+
+def drain(processor):
+    while processor.process_queue_batch():
+        pass
+
+
+def main():
+    init_db()
+    session = SessionLocal()
+    session.add(Employee(id=1, insider_id='requeue-check'))
+    session.commit()
+
+    insider_service = FakeInsiderService()
+    processor = make_processor(insider_service)
+    processor.work_queue.enqueue(session, 1, [FILE_ID])
+
+    drain(processor)
+    state = session.query(ScreenshotState).filter_by(insider_id=FILE_ID).one()
+    item = session.query(QueueItem).filter_by(insider_id=FILE_ID).one()
+    print(f"API недоступен: задача {item.status}, попыток {item.attempts}, dead letter {state.dead_letter}")
+    ok = item.status == 'failed' and state.dead_letter
+
+    print(f"Возвращено из dead letter: {requeue_dead_letters(session, [FILE_ID])}")
+    insider_service.online = True
+    drain(processor)
+
+    session.expire_all()
+    stored = session.query(Screenshot).filter_by(insider_id=FILE_ID).count()
+    item = session.query(QueueItem).filter_by(insider_id=FILE_ID).one()
+    print(f"API доступен: задача {item.status}, сохранено скриншотов {stored}")
+    ok = ok and stored == 1 and item.status == 'done'
+
+    processor.checkpoints.close()
+    session.close()
+    print("OK" if ok else "ОШИБКА")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
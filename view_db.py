@@ -1,23 +1,30 @@
+from sqlalchemy import func, select
 from db.database import SessionLocal
 from models import Employee, Screenshot
 
 def view_database():
     session = SessionLocal()
-    table = Screenshot
-    table2 = Employee
     try:
-        # Получаем все записи
-        images = session.query(table).all()
-        mages = session.query(table2).all()
-        
+        # Счётчики агрегатами, строки - потоком с курсора без загрузки всей таблицы
+        images_count = session.query(func.count(Screenshot.id)).scalar()
+        employees_count = session.query(func.count(Employee.id)).scalar()
+
         print("\n=== Содержимое базы данных ===")
-        print(f"Всего записей: {len(images)}\n")
-        
+        print(f"Всего записей: {images_count}, сотрудников: {employees_count}\n")
+
+        images = session.execute(
+            select(Screenshot.id, Screenshot.insider_id).order_by(Screenshot.id)
+            .execution_options(stream_results=True, yield_per=1000)
+        )
         for img in images:
             print(img.id, img.insider_id)
 
-        for user in mages:
-            print(user.id, user.insider_id )
+        users = session.execute(
+            select(Employee.id, Employee.insider_id).order_by(Employee.id)
+            .execution_options(stream_results=True, yield_per=1000)
+        )
+        for user in users:
+            print(user.id, user.insider_id)
             
     except Exception as e:
         print(f"Ошибка при чтении базы данных: {str(e)}")
@@ -25,4 +32,4 @@ def view_database():
         session.close()
 
 if __name__ == "__main__":
-    view_database() 
\ No newline at end of file
+    view_database() 
@@ -0,0 +1,260 @@
+# -общая очередь скриншотов с арендой: несколько узлов OCR делят один обход
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from loguru import logger
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.orm import aliased
+from config import (
+    WORK_QUEUE_LEASE_SECONDS,
+    WORK_QUEUE_HEARTBEAT_SECONDS,
+    WORK_QUEUE_MAX_ATTEMPTS,
+    WORK_QUEUE_RETRY_SECONDS
+)
+from models import Employee, QueueItem
+from db.database import insert_ignoring_conflicts
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class WorkQueue:
+    """Очередь скриншотов в общей БД.
+
+    Узел забирает пачку задач в аренду до lease_expires_at и продлевает её, пока работает.
+    Аренду упавшего узла после истечения забирает другой узел. Неудачная задача
+    возвращается в очередь; после max_attempts попыток она помечается failed. Пачка составляется по очереди из задач
+    разных сотрудников, чтобы один сотрудник с тысячами скриншотов не занимал все узлы.
+    """
+
+    def __init__(self, session_factory, owner: str = None, lease_seconds: int = WORK_QUEUE_LEASE_SECONDS,
+                 heartbeat_seconds: int = WORK_QUEUE_HEARTBEAT_SECONDS, max_attempts: int = WORK_QUEUE_MAX_ATTEMPTS,
+                 retry_seconds: int = WORK_QUEUE_RETRY_SECONDS):
+        self.session_factory = session_factory
+        self.owner = owner or default_owner()
+        self.lease = timedelta(seconds=lease_seconds)
+        self.heartbeat_seconds = heartbeat_seconds or max(1, lease_seconds // 3)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_seconds = max(0, retry_seconds)
+        self._heartbeat_stop = threading.Event()
+        self._heartbeat_thread = None
+
+    def enqueue(self, session, employee_id: int, file_ids: list, captured_at: dict = None) -> int:
+        """Добавляет задачи; уже поставленные в очередь file_id пропускаются. Возвращает число новых
+
+        captured_at - время активности каждого file_id, если известно.
+        """
+        if not file_ids:
+            return 0
+        now = datetime.utcnow()
+        captured_at = captured_at or {}
+        rows = [
+            {'insider_id': file_id, 'employee_id': employee_id, 'status': PENDING, 'attempts': 0,
+             'captured_at': captured_at.get(file_id), 'enqueued_at': now, 'updated_at': now}
+            for file_id in dict.fromkeys(file_ids)
+        ]
+        added = insert_ignoring_conflicts(session, QueueItem, rows, 'insider_id')
+        session.commit()
+        return added
+
+    def claim(self, session, limit: int) -> list:
+        """Забирает в аренду до limit задач: [(id, insider_id, employee_id)]"""
+        now = datetime.utcnow()
+        self._reap(session, now)
+
+        chosen = self._candidates(session, limit, now)
+        if not chosen:
+            session.commit()
+            return []
+        candidates = select(QueueItem.id).where(QueueItem.id.in_(chosen), QueueItem.status == PENDING)
+        if session.get_bind().dialect.name == 'postgresql':
+            # Задачи, которые сейчас забирает другой узел, пропускаются без ожидания
+            candidates = candidates.with_for_update(skip_locked=True)
+
+        # Условие status == pending повторяется в UPDATE: задача не достанется двум узлам
+        claimed = session.execute(
+            update(QueueItem)
+            .where(QueueItem.id.in_(candidates), QueueItem.status == PENDING)
+            .values(
+                status=LEASED,
+                lease_owner=self.owner,
+                lease_expires_at=now + self.lease,
+                attempts=QueueItem.attempts + 1,
+                updated_at=now,
+            )
+            .returning(QueueItem.id, QueueItem.insider_id, QueueItem.employee_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        session.commit()
+        return sorted(claimed)
+
+    @staticmethod
+    def _candidates(session, limit: int, now: datetime) -> list:
+        """id задач для пачки: сначала первые задачи всех сотрудников, потом вторые и т.д.
+
+        Ранжируются не все ожидающие задачи, а только первые depth задач каждого сотрудника,
+        каждая выборка - диапазон индекса idx_queue_status_employee. Если их не хватило на
+        пачку, а у кого-то из сотрудников задачи ещё остались, depth удваивается.
+        Неудачные задачи, пауза перед повтором которых не истекла, пропускаются.
+        """
+        employees = session.scalar(select(func.count()).select_from(Employee)) or 1
+        depth = max(1, -(-limit // employees))
+        item = aliased(QueueItem)
+        while True:
+            head = (
+                select(item.id)
+                .where(
+                    item.status == PENDING,
+                    item.employee_id == Employee.id,
+                    or_(item.not_before.is_(None), item.not_before <= now),
+                )
+                .order_by(item.id)
+                .limit(depth)
+                .correlate(Employee)
+            )
+            rows = session.execute(
+                select(QueueItem.id, QueueItem.employee_id)
+                .select_from(Employee)
+                .join(QueueItem, QueueItem.id.in_(head))
+            ).all()
+            per_employee = {}
+            for item_id, employee_id in sorted(rows):
+                per_employee.setdefault(employee_id, []).append(item_id)
+            if len(rows) >= limit or depth >= limit or all(len(ids) < depth for ids in per_employee.values()):
+                break
+            depth = min(limit, depth * 2)
+
+        ranked = sorted(
+            (position, item_id)
+            for ids in per_employee.values()
+            for position, item_id in enumerate(ids)
+        )
+        return [item_id for _, item_id in ranked[:limit]]
+
+    def _reap(self, session, now: datetime):
+        """Истёкшие аренды: задача возвращается в очередь или, если попытки исчерпаны, помечается failed"""
+        expired = and_(QueueItem.status == LEASED, QueueItem.lease_expires_at < now)
+        # Задачи, на которых узлы падали max_attempts раз, больше не выдаются
+        reaped = session.execute(
+            update(QueueItem)
+            .where(expired, QueueItem.attempts >= self.max_attempts)
+            .values(status=FAILED, lease_owner=None, lease_expires_at=None, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if reaped:
+            logger.warning(f"Очередь: {reaped} задач исчерпали {self.max_attempts} попыток и помечены failed")
+        session.execute(
+            update(QueueItem)
+            .where(expired)
+            .values(status=PENDING, lease_owner=None, lease_expires_at=None, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+
+    def complete(self, session, ids: list):
+        """Задачи выполнены (скриншот сохранён или оказался дубликатом)"""
+        self._finish(session, ids, status=DONE, owned_only=False)
+
+    def fail(self, session, ids: list):
+        """Неудачная попытка: задача возвращается в очередь, пока не исчерпаны max_attempts.
+
+        Повтор откладывается на retry_seconds * 2^(попытка - 1), чтобы кратковременный сбой
+        не израсходовал все попытки за один обход.
+        """
+        if not ids:
+            return
+        attempts = dict(session.execute(
+            select(QueueItem.id, QueueItem.attempts).where(QueueItem.id.in_(ids))
+        ).all())
+        exhausted, retries = [], {}
+        for item_id in ids:
+            attempt = attempts.get(item_id, 0)
+            if attempt >= self.max_attempts:
+                exhausted.append(item_id)
+            else:
+                retries.setdefault(attempt, []).append(item_id)
+        now = datetime.utcnow()
+        for attempt, group in retries.items():
+            delay = timedelta(seconds=self.retry_seconds * 2 ** max(0, attempt - 1))
+            self._finish(session, group, status=PENDING, owned_only=True, not_before=now + delay)
+        self._finish(session, exhausted, status=FAILED, owned_only=True)
+
+    def release(self, session, ids: list):
+        """Возвращает невыполненные задачи в очередь, например при остановке узла"""
+        self._finish(session, ids, status=PENDING, owned_only=True, refund=True)
+
+    def _finish(self, session, ids: list, status: str, owned_only: bool, refund: bool = False,
+                not_before: datetime = None):
+        if not ids:
+            return
+        values = {'status': status, 'lease_owner': None, 'lease_expires_at': None, 'not_before': not_before,
+                  'updated_at': datetime.utcnow()}
+        if refund:
+            values['attempts'] = QueueItem.attempts - 1
+        statement = update(QueueItem).where(QueueItem.id.in_(ids))
+        if owned_only:
+            # Если аренда истекла и задачу забрал другой узел, она уже не наша
+            statement = statement.where(QueueItem.lease_owner == self.owner, QueueItem.status == LEASED)
+        session.execute(statement.values(**values).execution_options(synchronize_session=False))
+        session.commit()
+
+    def extend_leases(self, session) -> int:
+        """Продлевает аренду всех задач этого узла"""
+        now = datetime.utcnow()
+        extended = session.execute(
+            update(QueueItem)
+            .where(QueueItem.lease_owner == self.owner, QueueItem.status == LEASED)
+            .values(lease_expires_at=now + self.lease, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        session.commit()
+        return extended
+
+    def start_heartbeat(self):
+        """Фоновое продление аренды, пока узел обрабатывает пачку"""
+        if self._heartbeat_thread is not None:
+            return
+        self._heartbeat_stop.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, name='queue-heartbeat', daemon=True)
+        self._heartbeat_thread.start()
+
+    def stop_heartbeat(self):
+        if self._heartbeat_thread is None:
+            return
+        self._heartbeat_stop.set()
+        self._heartbeat_thread.join()
+        self._heartbeat_thread = None
+
+    def _heartbeat(self):
+        # Своя сессия: основная занята потоком обработки
+        session = self.session_factory()
+        try:
+            while not self._heartbeat_stop.wait(self.heartbeat_seconds):
+                try:
+                    self.extend_leases(session)
+                except Exception as e:
+                    logger.error(f"Очередь: не удалось продлить аренду: {e}")
+                    session.rollback()
+        finally:
+            session.close()
+
+    def purge(self, session, older_than: timedelta) -> int:
+        """Удаляет выполненные и окончательно неудачные задачи старше older_than"""
+        removed = session.execute(
+            delete(QueueItem)
+            .where(QueueItem.status.in_((DONE, FAILED)), QueueItem.updated_at < datetime.utcnow() - older_than)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        session.commit()
+        return removed
+
+    def stats(self, session) -> dict:
+        counts = dict(session.execute(select(QueueItem.status, func.count()).group_by(QueueItem.status)).all())
+        return {status: counts.get(status, 0) for status in (PENDING, LEASED, DONE, FAILED)}